@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""Time unfold_flowed on format=flowed bodies of doubling size.
+
+The time per line should stay flat as the body grows:
+
+    python benchmarks/bench_flowed.py
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from email2slack.parser import unfold_flowed  # noqa: E402
+
+
+def flowed_body(lines):
+    # paragraphs of 20 soft broken lines, half of them quoted
+    result = []
+    for i in range(lines):
+        prefix = '> ' if (i // 20) % 2 else ''
+        soft = ' ' if i % 20 != 19 else ''
+        result.append('{:s}word{:d} lorem ipsum dolor sit amet{:s}'.format(prefix, i, soft))
+    return '\n'.join(result)
+
+
+def main():
+    print('{:>8s} {:>10s} {:>12s}'.format('lines', 'seconds', 'us/line'))
+    for lines in (1000, 2000, 4000, 8000, 16000, 32000, 64000):
+        text = flowed_body(lines)
+        seconds = min(timeit.repeat(lambda: unfold_flowed(text), number=1, repeat=3))
+        print('{:8d} {:10.4f} {:12.2f}'.format(lines, seconds, seconds / lines * 1e6))
+
+
+if __name__ == '__main__':
+    main()
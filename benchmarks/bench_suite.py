@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""Time every stage of email2slack on sample and generated mails.
+
+Parsing, HTML conversion, routing, chunking and building the payloads are
+timed separately, then whole runs of "email2slack --debug" in a new process.
+Inputs are tests/data/*.txt and generated mails: 1 MB of plain text, nested
+HTML tables, a multipart mail with many parts, format=flowed text and
+ISO-2022-JP.
+
+Results are written as JSON, so that runs on two commits can be compared:
+
+    python benchmarks/bench_suite.py -o before.json
+    git checkout topic
+    python benchmarks/bench_suite.py -o after.json --compare before.json
+
+-k selects benchmarks whose name contains one of the given strings.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from email.header import Header
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from email2slack import get_arg_parser  # noqa: E402
+from email2slack.chunker import Chunker  # noqa: E402
+from email2slack.htmltext import soup_text, stream_text  # noqa: E402
+from email2slack.parser import EmailParser, unfold_flowed  # noqa: E402
+from email2slack.routing import Router  # noqa: E402
+from email2slack.slack import Slack  # noqa: E402
+
+CONFIG = '''[Slack]
+default=https://hooks.slack.com/services/FOO/BAR/FOOBAR
+
+[Team]
+default=default
+
+[Channel]
+default=#general
+
+[Flags]
+pretext=true
+'''
+HEADING = '*Date*: d\n*From*: f\n*To*: t\n*Subject*: s\n'
+# seconds a single repeat should last at least
+MIN_TIME = 0.05
+
+
+def headers(message, subject):
+    message['From'] = 'Bench <bench@example.com>'
+    message['To'] = 'to@example.com'
+    message['Subject'] = subject
+    message['Date'] = 'Thu, 27 Jul 2017 22:39:48 +0900'
+    message['Message-ID'] = '<bench@example.com>'
+    return message.as_string().encode('ascii')
+
+
+def plain_mail(size=1000000):
+    words = ['lorem', 'ipsum', 'see http://example.com/a?b=c&d', 'mail me@example.com', '555-123-4567', 'a<b>&c']
+    lines = []
+    length = 0
+    i = 0
+    while length < size:
+        line = ' '.join(words[(i + j) % len(words)] for j in range(8))
+        lines.append(line)
+        length += len(line) + 1
+        i += 1
+    return headers(MIMEText('\n'.join(lines) + '\n', 'plain', 'utf-8'), 'plain text')
+
+
+def nested_tables(rows=200, depth=3):
+    cell = 'value'
+    for level in range(depth):
+        cell = '<table><tr><td>{:s}</td><td><p>level {:d}<br>x</p></td></tr></table>'.format(cell, level)
+    row = '<tr>{:s}</tr>\n'.format(''.join('<td>{:s}</td>'.format(cell) for _ in range(5)))
+    return '<html><head><style>td {{ color: red }}</style></head><body><table>{:s}</table></body></html>'.format(
+        row * rows
+    )
+
+
+def html_mail():
+    # HTML only, so that building the payload converts it
+    return headers(MIMEText(nested_tables(), 'html', 'utf-8'), 'nested tables')
+
+
+def multipart_mail(parts=200):
+    message = MIMEMultipart('mixed')
+    for i in range(parts):
+        if i % 2:
+            message.attach(MIMEApplication(os.urandom(4096), 'octet-stream'))
+        else:
+            message.attach(MIMEText('part {:d}\n'.format(i) * 20, 'plain', 'utf-8'))
+    return headers(message, 'many parts')
+
+
+def flowed_mail(lines=20000):
+    text = []
+    for i in range(lines):
+        prefix = '> ' if (i // 20) % 2 else ''
+        soft = ' ' if i % 20 != 19 else ''
+        text.append('{:s}word{:d} lorem ipsum dolor sit amet{:s}'.format(prefix, i, soft))
+    message = MIMEText('\n'.join(text) + '\n', 'plain', 'utf-8')
+    message.set_param('format', 'flowed')
+    message.set_param('delsp', 'yes')
+    return headers(message, 'flowed')
+
+
+def iso_2022_jp_mail(lines=5000):
+    body = '\n'.join('{:d} 日本語のテキストです。メールの本文。'.format(i) for i in range(lines)) + '\n'
+    return headers(MIMEText(body, 'plain', 'iso-2022-jp'), Header('日本語の件名', 'iso-2022-jp'))
+
+
+def load_mails():
+    mails = []
+    for path in sorted(glob.glob(os.path.join(ROOT, 'tests', 'data', '*.txt'))):
+        with open(path, 'rb') as fp:
+            mails.append(('data-' + os.path.splitext(os.path.basename(path))[0], fp.read()))
+    mails.extend([
+        ('plain-1mb', plain_mail()),
+        ('html-nested-tables', html_mail()),
+        ('multipart-200', multipart_mail()),
+        ('flowed', flowed_mail()),
+        ('iso-2022-jp', iso_2022_jp_mail()),
+    ])
+    return mails
+
+
+def routing_rules(count=200):
+    rules = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            rules.append(('user{:d}@example.com'.format(i), 'exact{:d}'.format(i)))
+        elif kind == 1:
+            rules.append(('.*@host{:d}\\.example\\.org$'.format(i), 'domain{:d}'.format(i)))
+        else:
+            rules.append(('alert-{:d}-.*@monitor\\.example\\.net'.format(i), 'regex{:d}'.format(i)))
+    rules.append(('.*', 'default'))
+    return rules
+
+
+def routing_addresses(count=1000):
+    addresses = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            addresses.append('user{:d}@example.com'.format(i % 200))
+        elif kind == 1:
+            addresses.append('someone@host{:d}.example.org'.format(i % 200))
+        elif kind == 2:
+            addresses.append('alert-{:d}-disk@monitor.example.net'.format(i % 200))
+        else:
+            addresses.append('nobody{:d}@unknown.example'.format(i))
+    return addresses
+
+
+class Suite(object):
+    def __init__(self, repeat=5, keywords=None):
+        self.repeat = repeat
+        self.keywords = keywords
+        self.results = {}
+
+    def selected(self, name):
+        return not self.keywords or any(k in name for k in self.keywords)
+
+    def time(self, name, func, size=None, number=None):
+        if not self.selected(name):
+            return
+        if number is None:
+            # calibrate, so that a repeat lasts at least MIN_TIME
+            number = 1
+            while True:
+                if timeit.timeit(func, number=number) >= MIN_TIME or number >= 10000:
+                    break
+                number *= 2
+        times = sorted(t / number for t in timeit.repeat(func, number=number, repeat=self.repeat))
+        result = {'seconds': times[0], 'median': times[len(times) // 2], 'number': number, 'repeat': self.repeat}
+        if size is not None:
+            result['bytes'] = size
+        self.results[name] = result
+        print('{:48s} {:12.6f} {:12.6f}'.format(name, result['seconds'], result['median']))
+        sys.stdout.flush()
+
+    def run(self, workdir):
+        config = os.path.join(workdir, 'email2slack.conf')
+        with io.open(config, 'w', encoding='utf-8') as fp:
+            fp.write(CONFIG)
+        os.environ['EMAIL2SLACK_STATE_DIR'] = os.path.join(workdir, 'state')
+        slack = Slack(get_arg_parser().parse_args(['-d', '-f', config]))
+
+        print('{:48s} {:>12s} {:>12s}'.format('benchmark', 'best (s)', 'median (s)'))
+        mails = load_mails()
+        for name, raw in mails:
+            self.time('parse/' + name, lambda: EmailParser.parse(io.BytesIO(raw)), len(raw))
+
+        for name, raw in mails:
+            mail = EmailParser.parse(io.BytesIO(raw))
+            html = mail['body-html']
+            if html:
+                size = len(html.encode('utf-8'))
+                self.time('html/stream/' + name, lambda: stream_text(html), size)
+                self.time('html/bs4/' + name, lambda: soup_text(html), size)
+            body = mail['body-plain'] or stream_text(html or '')
+            self.time('chunk/' + name, lambda: list(Chunker(body).chunks(HEADING, 'continued\n')), len(body))
+            self.time('build/' + name, lambda: slack.build(mail), len(raw))
+
+        flowed = '\n'.join('word{:d} lorem ipsum dolor sit amet '.format(i) for i in range(20000))
+        self.time('flowed/unfold', lambda: unfold_flowed(flowed), len(flowed))
+
+        rules = routing_rules()
+        addresses = routing_addresses()
+        self.time('routing/index', lambda: Router(rules))
+        router = Router(rules)
+        router.match(addresses[0])
+        self.time('routing/match', lambda: [router.match(a) for a in addresses], len(addresses))
+        self.time('routing/match_all', lambda: [router.match_all(a) for a in addresses], len(addresses))
+
+        with open(os.devnull, 'wb') as devnull:
+            for name, raw in mails:
+                path = os.path.join(workdir, name + '.eml')
+                with open(path, 'wb') as fp:
+                    fp.write(raw)
+
+                def end_to_end():
+                    with open(path, 'rb') as stdin:
+                        subprocess.check_call(
+                            [sys.executable, '-m', 'email2slack', '-d', '-f', config],
+                            stdin=stdin, stdout=devnull, cwd=ROOT
+                        )
+
+                self.time('e2e/' + name, end_to_end, len(raw), number=1)
+
+
+def git_commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def compare(results, path):
+    with io.open(path, encoding='utf-8') as fp:
+        baseline = json.load(fp)['results']
+    print()
+    print('{:48s} {:>12s} {:>12s} {:>8s}'.format('benchmark', 'before (s)', 'after (s)', 'ratio'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before = baseline[name]['seconds']
+        after = results[name]['seconds']
+        print('{:48s} {:12.6f} {:12.6f} {:8.2f}'.format(name, before, after, after / before if before else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark email2slack stages')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', metavar='JSON', help='compare with the results of an earlier run')
+    parser.add_argument('--repeat', type=int, default=5, help='repeats per benchmark (default: %(default)s)')
+    parser.add_argument('-k', dest='keywords', action='append', help='only run benchmarks whose name contains this')
+    args = parser.parse_args()
+
+    suite = Suite(repeat=args.repeat, keywords=args.keywords)
+    workdir = tempfile.mkdtemp(prefix='email2slack-bench-')
+    try:
+        suite.run(workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'results': suite.results,
+    }
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as fp:
+            fp.write(json.dumps(report, indent=2, sort_keys=True))
+    if args.compare:
+        compare(suite.results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
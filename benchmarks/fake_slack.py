@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""Local stand-in for Slack incoming webhooks, for load tests.
+
+Every POST is answered after --latency seconds (plus up to --jitter more),
+with 429 and a Retry-After header for a --rate-limited fraction of them and
+500 for an --errors fraction. Counts of requests and statuses are kept.
+
+    python benchmarks/fake_slack.py --port 8080 --latency 0.05 --rate-limited 0.01
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        delay = server.latency + random.random() * server.jitter
+        if delay:
+            time.sleep(delay)
+        draw = random.random()
+        if draw < server.rate_limited:
+            status, body = 429, b'rate_limited'
+        elif draw < server.rate_limited + server.errors:
+            status, body = 500, b'internal_error'
+        else:
+            status, body = 200, b'ok'
+        server.count(status, length)
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '{!s}'.format(server.retry_after))
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', '{:d}'.format(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeSlack(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, jitter=0.0, rate_limited=0.0, retry_after=1,
+                 errors=0.0):
+        HTTPServer.__init__(self, address, WebhookHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+        self.errors = errors
+        self.__lock = threading.Lock()
+        self.__counts = Counter()
+
+    @property
+    def url(self):
+        return 'http://{:s}:{:d}/hook'.format(*self.server_address[:2])
+
+    def count(self, status, length):
+        with self.__lock:
+            self.__counts['requests'] += 1
+            self.__counts['bytes'] += length
+            self.__counts[status] += 1
+
+    def stats(self):
+        with self.__lock:
+            return dict(self.__counts)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before every answer')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many more seconds, at random')
+    parser.add_argument('--rate-limited', type=float, default=0.0, help='fraction of posts answered with 429')
+    parser.add_argument('--retry-after', type=float, default=1, help='Retry-After of 429 answers, in seconds')
+    parser.add_argument('--errors', type=float, default=0.0, help='fraction of posts answered with 500')
+
+
+def from_arguments(args, address=('127.0.0.1', 0)):
+    return FakeSlack(
+        address, latency=args.latency, jitter=args.jitter, rate_limited=args.rate_limited,
+        retry_after=args.retry_after, errors=args.errors
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fake Slack incoming webhook')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = from_arguments(args, (args.host, args.port))
+    print('listening on {:s}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(server.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""Forward a corpus of mails to a local fake Slack and measure throughput.
+
+Mails are replayed at --concurrency through the real entry points: a new
+"python -m email2slack" process per mail (--mode cli), or an
+"email2slack serve --socket" daemon spoken to like email2slack-client does
+(--mode daemon). Posts go to benchmarks/fake_slack.py, which can add latency
+and answer with 429 or 500. The report gives mails per second, p50/p99 of the
+time from handing a mail over to email2slack finishing with it, and posts per
+mail:
+
+    python benchmarks/load_test.py --mode daemon --mails 2000 --concurrency 16 --latency 0.05
+    python benchmarks/load_test.py --maildir ~/Maildir/.alerts --rate-limited 0.05 -o load.json
+
+The rate limiter and the Message-ID cache are disabled, so that replaying a
+small corpus measures forwarding rather than pacing or deduplication.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import glob
+import io
+import json
+import mailbox
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_slack  # noqa: E402
+
+CONFIG = '''[Slack]
+default={url:s}
+
+[Team]
+default=default
+
+[Channel]
+default=#load
+
+[Flags]
+pretext={pretext:s}
+
+[Rate Limit]
+enabled=false
+retries={retries:d}
+
+[Dedup]
+enabled=false
+'''
+
+
+def load_corpus(maildir=None):
+    if maildir:
+        box = mailbox.Maildir(maildir, factory=None, create=False)
+        get_bytes = getattr(box, 'get_bytes', None) or box.get_string
+        return [get_bytes(key) for key in sorted(box.keys())]
+    mails = []
+    for path in sorted(glob.glob(os.path.join(ROOT, 'tests', 'data', '*.txt'))):
+        with open(path, 'rb') as fp:
+            mails.append(fp.read())
+    return mails
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+class CliSender(object):
+    """A new email2slack process per mail, as with an MTA pipe alias."""
+
+    def __init__(self, config, env):
+        self.config = config
+        self.env = env
+
+    def start(self):
+        pass
+
+    def send(self, raw):
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'email2slack', '-f', self.config],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=ROOT, env=self.env
+        )
+        process.communicate(raw)
+        return process.returncode == 0
+
+    def stop(self):
+        pass
+
+
+class DaemonSender(object):
+    """One "email2slack serve --socket" daemon, spoken to like email2slack-client."""
+
+    def __init__(self, config, env, workers, directory):
+        self.config = config
+        self.env = env
+        self.workers = workers
+        self.path = os.path.join(directory, 'email2slack.sock')
+        # not a pipe: nobody reads it while the test runs, the daemon would block once it is full
+        self.log = os.path.join(directory, 'daemon.log')
+        self.process = None
+
+    def start(self):
+        with open(self.log, 'wb') as log:
+            self.process = subprocess.Popen(
+                [sys.executable, '-m', 'email2slack', 'serve', '--socket', self.path, '--workers',
+                 '{:d}'.format(self.workers), '-f', self.config],
+                stderr=log, cwd=ROOT, env=self.env
+            )
+        deadline = time.time() + 30
+        while not os.path.exists(self.path):
+            if self.process.poll() is not None or time.time() > deadline:
+                with io.open(self.log, encoding='utf-8', errors='replace') as fp:
+                    raise Exception('daemon did not start: {:s}'.format(fp.read()))
+            time.sleep(0.05)
+
+    def send(self, raw):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            sock.sendall(b'\n' + raw)
+            sock.shutdown(socket.SHUT_WR)
+            return sock.makefile('rb').readline().rstrip(b'\n') == b'OK'
+        finally:
+            sock.close()
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+
+
+class LoadTest(object):
+    def __init__(self, sender, mails, count, concurrency):
+        self.sender = sender
+        self.mails = mails
+        self.count = count
+        self.concurrency = concurrency
+        self.latencies = []
+        self.failed = 0
+        self.__lock = threading.Lock()
+
+    def one(self, i):
+        raw = self.mails[i % len(self.mails)]
+        start = time.time()
+        try:
+            ok = self.sender.send(raw)
+        except (IOError, OSError):
+            ok = False
+        elapsed = time.time() - start
+        with self.__lock:
+            self.latencies.append(elapsed)
+            if not ok:
+                self.failed += 1
+
+    def run(self):
+        pool = ThreadPool(self.concurrency)
+        start = time.time()
+        try:
+            pool.map(self.one, range(self.count), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='load test email2slack against a local fake Slack')
+    parser.add_argument('--mode', choices=('cli', 'daemon'), default='cli', help='entry point (default: %(default)s)')
+    parser.add_argument('--maildir', help='replay this Maildir instead of tests/data')
+    parser.add_argument('--mails', type=int, default=200, help='mails to send, the corpus is cycled')
+    parser.add_argument('--concurrency', type=int, default=8, help='mails in flight at once')
+    parser.add_argument('--workers', type=int, default=8, help='worker threads of the daemon')
+    parser.add_argument('--pretext', action='store_true', help='enable [Flags] pretext, long mails are chunked')
+    parser.add_argument('--retries', type=int, default=3, help='[Rate Limit] retries after a 429')
+    parser.add_argument('-o', '--output', help='write the report to this JSON file')
+    fake_slack.add_arguments(parser)
+    args = parser.parse_args()
+
+    mails = load_corpus(args.maildir)
+    if not mails:
+        parser.error('no mails to replay')
+    workdir = tempfile.mkdtemp(prefix='email2slack-load-')
+    server = fake_slack.from_arguments(args).start()
+    try:
+        config = os.path.join(workdir, 'email2slack.conf')
+        with io.open(config, 'w', encoding='utf-8') as fp:
+            fp.write(CONFIG.format(url=server.url, pretext='true' if args.pretext else 'false', retries=args.retries))
+        env = dict(os.environ, EMAIL2SLACK_STATE_DIR=os.path.join(workdir, 'state'))
+        if args.mode == 'cli':
+            sender = CliSender(config, env)
+        else:
+            sender = DaemonSender(config, env, args.workers, workdir)
+        sender.start()
+        try:
+            test = LoadTest(sender, mails, args.mails, args.concurrency)
+            elapsed = test.run()
+        finally:
+            sender.stop()
+    finally:
+        server.stop()
+        shutil.rmtree(workdir)
+
+    stats = server.stats()
+    report = {
+        'mode': args.mode,
+        'python': platform.python_version(),
+        'time': time.time(),
+        'mails': args.mails,
+        'corpus': len(mails),
+        'concurrency': args.concurrency,
+        'failed': test.failed,
+        'seconds': elapsed,
+        'mails_per_second': args.mails / elapsed,
+        'p50': percentile(test.latencies, 0.5),
+        'p99': percentile(test.latencies, 0.99),
+        'posts': stats.get('requests', 0),
+        'posts_per_mail': stats.get('requests', 0) / float(args.mails),
+        'statuses': dict(('{!s}'.format(k), v) for k, v in stats.items() if k not in ('requests', 'bytes')),
+    }
+    print('{:d} mails ({:d} failed) in {:.2f}s: {:.1f} mails/s'.format(
+        args.mails, test.failed, elapsed, report['mails_per_second']
+    ))
+    print('latency p50 {:.3f}s p99 {:.3f}s'.format(report['p50'], report['p99']))
+    print('{:d} posts, {:.2f} per mail, statuses {!s}'.format(
+        report['posts'], report['posts_per_mail'], report['statuses']
+    ))
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as fp:
+            fp.write(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,39 @@
 #!/usr/bin/env python
 from __future__ import unicode_literals
 
-import argparse
+import importlib
 import sys
 
-from .parser import EmailParser
-from .slack import Slack
+# sub-command name -> module providing main(argv)
+COMMANDS = {
+    'serve': '.server',
+    'deliver': '.spool',
+    'digest': '.digest',
+    'ingest': '.ingest',
+    'profile': '.profiling',
+}
+# name -> module, imported on first use so that email2slack.client, which
+# runs this file first, starts without the whole package
+LAZY = {
+    'EmailParser': '.parser',
+    'Slack': '.slack',
+}
 
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name not in LAZY:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+        value = getattr(importlib.import_module(LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+else:
+    from .parser import EmailParser
+    from .slack import Slack
 
-def get_arg_parser():
-    parser = argparse.ArgumentParser()
+
+def get_arg_parser(add_help=True, parser_class=None):
+    import argparse
+    parser = (parser_class or argparse.ArgumentParser)(add_help=add_help)
     parser.add_argument(
         '-d', '--debug', action='store_true',
         help='dry run, does not post to slack.'
@@ -28,17 +52,36 @@ def get_arg_parser():
         '-c', '--channel',
         help='override default Slack channel'
     )
+    parser.add_argument(
+        '--spool',
+        help='only queue notifications in this directory, see "email2slack deliver"'
+    )
+    parser.add_argument(
+        '--profile', metavar='DIR',
+        help='profile every mail into this directory, see "email2slack profile"'
+    )
     return parser
 
 
-def main():
-    args = get_arg_parser().parse_args()
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        command = importlib.import_module(COMMANDS[argv[0]], __name__)
+        return command.main(argv[1:])
+
+    from .parser import EmailParser
+    from .slack import Slack
+    args = get_arg_parser().parse_args(argv)
     try:
         fp = sys.stdin.buffer
     except AttributeError:
         fp = sys.stdin
-    mail = EmailParser.parse(fp)
-    Slack(args).notify(mail)
+    slack = Slack(args)
+    with slack.profiler.sample() as sample:
+        mail = EmailParser.parse(fp, detector=slack.detector, **slack.limits)
+        sample.tag(mail)
+        slack.notify(mail)
 
 
 if __name__ == '__main__':
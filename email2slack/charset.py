@@ -0,0 +1,149 @@
+"""Turning MIME part payloads into text.
+
+The charset declared in Content-Type is tried first and verified with a strict
+decode; only when it is missing or wrong does a statistical detector look at
+a bounded sample of the payload.
+"""
+from __future__ import unicode_literals
+
+import codecs
+import importlib
+
+from . import metrics
+
+try:
+    from nkf import nkf
+except ImportError:
+    nkf = None
+
+# detector modules, in order of preference for 'auto'
+BACKENDS = ('cchardet', 'chardet', 'charset_normalizer')
+SAMPLE_SIZE = 64 * 1024
+# charsets that are not ASCII compatible, so ASCII-only bytes prove nothing
+NOT_ASCII_COMPATIBLE = ('utf_16', 'utf_16_be', 'utf_16_le', 'utf_32', 'utf_32_be', 'utf_32_le', 'utf_7')
+
+ISO_2022_JP = ('iso2022_jp', 'iso2022_jp_1', 'iso2022_jp_2', 'iso2022_jp_2004', 'iso2022_jp_3', 'iso2022_jp_ext')
+SHIFT_JIS = ('shift_jis', 'cp932', 'shift_jis_2004', 'shift_jisx0213')
+EUC_JP = ('euc_jp', 'euc_jis_2004', 'euc_jisx0213')
+
+
+class Detector(object):
+    """Charset detection with one backend, on the first sample bytes of a payload.
+
+    The backend module is imported on first use.
+    """
+
+    def __init__(self, backend='auto', sample=SAMPLE_SIZE):
+        if backend not in ('auto',) + BACKENDS:
+            raise ValueError('unknown charset detector: {:s}'.format(backend))
+        self.backend = backend
+        self.sample_size = sample
+        self.function = None
+
+    def get_function(self):
+        """Return the detect(bytes) -> encoding function of the backend."""
+        if self.function is None:
+            names = BACKENDS if self.backend == 'auto' else (self.backend,)
+            for name in names:
+                try:
+                    module = importlib.import_module(name)
+                except ImportError:
+                    continue
+                self.function = module.detect
+                break
+            else:
+                raise ImportError('no charset detector available, install one of: {:s}'.format(', '.join(names)))
+        return self.function
+
+    def __call__(self, body):
+        sample = body[:self.sample_size]
+        with metrics.timer('charset') as timer:
+            timer.bytes = len(sample)
+            return self.get_function()(sample)['encoding']
+
+
+# used when decode() is not given a detector
+default_detector = Detector()
+
+
+def configure(detector='auto', sample=SAMPLE_SIZE):
+    global default_detector
+    default_detector = Detector(detector, sample)
+
+
+def normalize(charset):
+    """Python codec name for charset, or None if Python does not know it."""
+    if not charset:
+        return None
+    try:
+        return codecs.lookup(charset).name.replace('-', '_')
+    except LookupError:
+        return None
+
+
+def detect(body, detector=None):
+    return (detector or default_detector)(body)
+
+
+def to_unicode(body, charset, nkf_options, errors='replace', strict=False):
+    """Decode body with the ISO-2022-JP/Shift_JIS/EUC-JP workarounds.
+
+    nkf_options are the nkf flags for input charset, e.g. '-J' for ISO-2022-JP;
+    nkf is used when available, else the most inclusive Python codec.
+    """
+    name = normalize(charset)
+    if name in ISO_2022_JP:
+        if callable(nkf):
+            body, charset = nkf(nkf_options['J'], body), 'utf-8'
+        else:
+            charset = 'ISO-2022-JP-2004'
+            body = body.replace(b'\033$B', b'\033$(Q').replace(b'\033(J', b'\033(B')
+    elif name in SHIFT_JIS:
+        if callable(nkf):
+            body, charset = nkf(nkf_options['S'], body), 'utf-8'
+        else:
+            charset = 'CP932'
+    elif name in EUC_JP:
+        if callable(nkf):
+            body, charset = nkf(nkf_options['E'], body), 'utf-8'
+        else:
+            charset = 'EUCJIS2004'
+    return body.decode(charset, 'strict' if strict else errors)
+
+
+BODY_NKF_OPTIONS = {'J': '-Jwx', 'S': '-Swx', 'E': '-Ew'}
+HEADER_NKF_OPTIONS = {'J': '-Jw', 'S': '-Sw', 'E': '-Ew'}
+
+
+def decode(body, declared=None, truncated=False, detector=None):
+    """Text of a MIME part payload whose Content-Type declares charset declared.
+
+    truncated means body was cut at an arbitrary byte, so an incomplete
+    character at its very end is dropped rather than failing verification.
+    detector is the Detector used when declared is missing or wrong.
+    """
+    name = normalize(declared)
+    if b'\033' not in body and name not in NOT_ASCII_COMPATIBLE:
+        try:
+            return body.decode('ascii')
+        except UnicodeDecodeError:
+            pass
+    if name:
+        try:
+            return to_unicode(body, name, BODY_NKF_OPTIONS, strict=True)
+        except UnicodeDecodeError as e:
+            if truncated and e.start >= len(body) - 4:
+                try:
+                    return to_unicode(body[:e.start], name, BODY_NKF_OPTIONS, strict=True)
+                except (UnicodeDecodeError, LookupError):
+                    pass
+        except LookupError:
+            pass
+
+    charset = detect(body, detector)
+    if charset is None:
+        charset = 'utf-8'
+    try:
+        return to_unicode(body, charset, BODY_NKF_OPTIONS)
+    except LookupError:
+        return body.decode('utf-8', 'replace')
@@ -0,0 +1,135 @@
+"""Splitting mail bodies into Slack messages.
+
+Slack counts a message after escaping &, < and >, and after expanding URLs,
+mail addresses and phone numbers into <...|...> links, so every line is
+measured by its escaped length plus that expansion.
+"""
+from __future__ import unicode_literals
+
+import re
+from email.utils import getaddresses
+
+MESSAGE_LIMIT = 4000
+# messages packed into one post, text and attachments; Slack truncates a
+# message after 40,000 characters
+CHUNKS_PER_POST = 10
+PRE = '``````\n'
+
+URL = re.compile(r'(https?://[-\w\d:#@%/;$()~_?+=.&]*)')
+DOMAINURL = re.compile(r'(\b(?:[\w\d][-\w\d]+?\.)+\w{2,4}\b)')
+CALLTO = re.compile(r'\b(\d{3}-\d{3}-\d{4}|\d{4}-\d{3}-\d{4})\b')
+MAILTO = re.compile(r'<mailto:[^>]+>')
+# words which getaddresses parses on their own, whatever surrounds them
+PLAIN_WORD = re.compile(r'[-\w.%+]+@[-\w.]+\Z')
+
+
+def html_escape(text):
+    return text \
+        .replace('&', '&amp;') \
+        .replace('<', '&lt;') \
+        .replace('>', '&gt;')
+
+
+def increment_of_url(text):
+    urls = URL.findall(text)
+    domains = DOMAINURL.findall(text)
+    return len(urls) * len('<>') + len(''.join(domains)) + len(urls) * len('<http://|>')
+
+
+def increment_of_callto(text):
+    return len(CALLTO.findall(text)) * len('<callto:>')
+
+
+def mailaddr_words(text):
+    return [x for x in MAILTO.sub('', text).replace(' ', '\n').splitlines() if x.find('@') > 1]
+
+
+def increment_of_mailaddr(text, words=None):
+    if words is None:
+        words = mailaddr_words(text)
+    if not words:
+        return 0
+    addrs = [a for n, a in getaddresses(words)]
+    return len(''.join(addrs)) + len(addrs) * len('<mailto:|>')
+
+
+def increment_of(text):
+    return increment_of_url(text) + increment_of_mailaddr(text) + increment_of_callto(text)
+
+
+def limit_for(heading):
+    """Room left for the body in a message starting with heading."""
+    return MESSAGE_LIMIT - len(html_escape(heading)) - increment_of_mailaddr(heading) - len(PRE)
+
+
+class Chunker(object):
+    """Measures a body once and splits it into messages.
+
+    escaped is the HTML escaped body; lines, their escaped text and their
+    link expansion are computed on first use and kept, so the body is
+    scanned once whether it fits one message or not.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.escaped = html_escape(body)
+        self.__lines = None
+        self.__increments = None
+        self.__mailaddr_words = None
+
+    @property
+    def lines(self):
+        if self.__lines is None:
+            self.__lines = self.escaped.splitlines()
+        return self.__lines
+
+    @property
+    def increments(self):
+        if self.__increments is None:
+            increments = []
+            words = []
+            for line in self.body.splitlines():
+                line_words = mailaddr_words(line)
+                words.extend(line_words)
+                increments.append(
+                    increment_of_url(line) + increment_of_mailaddr(line, line_words) + increment_of_callto(line)
+                )
+            self.__increments = increments
+            self.__mailaddr_words = words
+        return self.__increments
+
+    def increment(self):
+        """Link expansion of the whole body."""
+        increments = self.increments
+        if '<mailto:' not in self.body and all(PLAIN_WORD.match(w) for w in self.__mailaddr_words):
+            return sum(increments)
+        # getaddresses may parse words across lines, measure the body at once
+        return increment_of(self.body)
+
+    def fits(self, heading):
+        return len(self.escaped) + self.increment() <= limit_for(heading)
+
+    def chunks(self, heading, continued):
+        """Yield (heading, escaped chunk) for each message, in order.
+
+        The first message uses heading, the following ones continued.
+        """
+        lines = self.lines
+        increments = self.increments
+        count = len(lines)
+        limit = limit_for(heading)
+        start = 0
+        while start < count:
+            i = start
+            length = 0
+            while i < count and length + len(lines[i]) + increments[i] + 1 < limit:
+                length += len(lines[i]) + increments[i] + 1
+                i += 1
+            if i == start:
+                # a single line longer than a message, send it anyway
+                i += 1
+            yield heading, '\n'.join(lines[start:i]) + '\n'
+            start = i
+            if heading is not continued:
+                heading = continued
+                limit = limit_for(heading)
@@ -0,0 +1,75 @@
+"""Thin pipe client for a running `email2slack serve --socket` daemon.
+
+Intended for MTA pipe aliases: it only hands stdin over to the daemon and
+waits for its answer, so it must stay cheap to start. Keep imports minimal.
+Falls back to the in-process email2slack.main() when the daemon is down.
+"""
+from __future__ import unicode_literals
+
+import os
+import socket
+import sys
+
+DEFAULT_SOCKET = '/var/run/email2slack/email2slack.sock'
+EX_TEMPFAIL = 75  # sysexits.h, asks the MTA to retry later
+CHUNK_SIZE = 65536
+
+
+def quote(arg):
+    return "'" + arg.replace("'", "'\"'\"'") + "'"
+
+
+def split_argv(argv):
+    path = os.environ.get('EMAIL2SLACK_SOCKET', DEFAULT_SOCKET)
+    rest = []
+    i = 0
+    while i < len(argv):
+        if argv[i].startswith('--socket='):
+            path = argv[i][len('--socket='):]
+        elif argv[i] == '--socket' and i + 1 < len(argv):
+            i += 1
+            path = argv[i]
+        else:
+            rest.append(argv[i])
+        i += 1
+    return path, rest
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    path, argv = split_argv(argv)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        import email2slack
+        return email2slack.main(argv)
+
+    try:
+        stdin = sys.stdin.buffer
+    except AttributeError:
+        stdin = sys.stdin
+    try:
+        sock.sendall((' '.join(quote(x) for x in argv) + '\n').encode('utf-8'))
+        while True:
+            chunk = stdin.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sock.sendall(chunk)
+        sock.shutdown(socket.SHUT_WR)
+        answer = sock.makefile('rb').readline().decode('utf-8').rstrip('\n')
+    except socket.error as e:
+        answer = 'ERR {!s}'.format(e)
+    finally:
+        sock.close()
+
+    if answer != 'OK':
+        sys.stderr.write('email2slack: {:s}\n'.format(answer or 'ERR connection closed by daemon'))
+        sys.exit(EX_TEMPFAIL)
+
+
+if __name__ == '__main__':
+    main()
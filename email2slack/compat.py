@@ -5,4 +5,36 @@ try:
 except ImportError:
     from ConfigParser import ConfigParser as compat_configparser  # Python 2
 
-__all__ = ['compat_configparser']
+try:
+    import socketserver as compat_socketserver  # Python 3
+except ImportError:
+    import SocketServer as compat_socketserver  # Python 2
+
+try:
+    from html.parser import HTMLParser as compat_htmlparser  # Python 3
+except ImportError:
+    from HTMLParser import HTMLParser as compat_htmlparser  # Python 2
+
+try:
+    from functools import lru_cache as compat_lru_cache  # Python 3
+except ImportError:
+    import functools
+
+    def compat_lru_cache(maxsize=128):  # Python 2, forgets everything once full
+        def decorator(func):
+            cache = {}
+
+            @functools.wraps(func)
+            def wrapper(*args):
+                try:
+                    return cache[args]
+                except KeyError:
+                    pass
+                if len(cache) >= maxsize:
+                    cache.clear()
+                result = cache[args] = func(*args)
+                return result
+            return wrapper
+        return decorator
+
+__all__ = ['compat_configparser', 'compat_htmlparser', 'compat_lru_cache', 'compat_socketserver']
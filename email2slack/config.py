@@ -0,0 +1,227 @@
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import os
+
+from .compat import *
+from .routing import KeywordRouter, Router
+from .state import state_directory
+
+CANDIDATES = [
+    'email2slack',
+    os.path.expanduser('~/.email2slack'),
+    '/etc/email2slack',
+    '/usr/local/etc/email2slack'
+]
+# bump when the cached layout changes
+CACHE_VERSION = 3
+# content routing sections and the table built from each
+CONTENT_ROUTES = [
+    ('Subject Route', 'subject_route'),
+    ('From Route', 'from_route'),
+    ('Body Route', 'body_route'),
+]
+BOOLEAN_STATES = {
+    '1': True, 'yes': True, 'true': True, 'on': True,
+    '0': False, 'no': False, 'false': False, 'off': False
+}
+
+
+class Config(object):
+    """Read-only, serializable copy of the parsed configuration files.
+
+    Offers the subset of the ConfigParser interface email2slack uses.
+    """
+
+    def __init__(self, sections):
+        self.__sections = [(name, [(k, v) for k, v in items]) for name, items in sections]
+        self.__index = dict((name, dict(items)) for name, items in self.__sections)
+
+    @classmethod
+    def from_parser(cls, cfg):
+        return cls([(name, cfg.items(name)) for name in cfg.sections()])
+
+    def to_list(self):
+        return self.__sections
+
+    def has_section(self, section):
+        return section in self.__index
+
+    def has_option(self, section, option):
+        return option in self.__index.get(section, {})
+
+    def items(self, section):
+        return list(dict(self.__sections).get(section, []))
+
+    def get(self, section, option):
+        return self.__index[section][option]
+
+    def getint(self, section, option):
+        return int(self.get(section, option))
+
+    def getfloat(self, section, option):
+        return float(self.get(section, option))
+
+    def getboolean(self, section, option):
+        value = self.get(section, option).lower()
+        if value not in BOOLEAN_STATES:
+            raise ValueError('Not a boolean: {:s}'.format(value))
+        return BOOLEAN_STATES[value]
+
+
+class Snapshot(object):
+    """Configuration and routing tables built from one version of the files."""
+
+    def __init__(self, config, tables, stamp):
+        self.config = config
+        self.tables = tables
+        self.stamp = stamp
+        self.team = Router(tables['team'])
+        self.channel = Router(tables['channel'])
+        self.mime_part = Router(tables['mime_part'])
+        self.pretext = Router(tables['pretext'])
+        self.digest_from = Router(tables['digest_from'])
+        self.digest_subject = Router(tables['digest_subject'])
+        self.subject_route = KeywordRouter(tables['subject_route'])
+        self.from_route = KeywordRouter(tables['from_route'])
+        self.body_route = KeywordRouter(tables['body_route'])
+
+
+def candidates(args):
+    result = list(CANDIDATES)
+    if args.config:
+        result.insert(0, args.config)
+    return result
+
+
+def get_stamp(paths):
+    """What the cache depends on: path, mtime and size of every existing candidate."""
+    stamp = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stamp.append([os.path.abspath(path), st.st_mtime, st.st_size])
+    return stamp
+
+
+def build_tables(cfg, args):
+    default_slack = args.slack
+    default_team = args.team
+    default_channel = args.channel
+
+    slack = {}
+    if cfg.has_section('Team'):
+        for name, url in cfg.items('Slack'):
+            if name == 'default' and default_slack:
+                url = default_slack
+                default_slack = None
+            slack[name] = url
+    if default_slack:
+        slack['default'] = default_slack
+
+    team = []
+    if cfg.has_section('Team'):
+        for pattern, name in cfg.items('Team'):
+            if pattern == 'default':
+                pattern = r'.*'
+                if default_team:
+                    name = default_team
+                    default_team = None
+            team.append((pattern, slack[name]))
+    if default_team and default_team in slack:
+        team.append((r'.*', slack[default_team]))
+    if len(team) == 0 and 'default' in slack:
+        team.append((r'.*', slack['default']))
+
+    channel = []
+    if cfg.has_section('Channel'):
+        for pattern, name in cfg.items('Channel'):
+            if pattern == 'default':
+                pattern = r'.*'
+                if default_channel:
+                    name = default_channel
+                    default_channel = None
+            channel.append((pattern, name))
+    if default_channel:
+        channel.append((r'.*', default_channel))
+
+    tables = {
+        'team': team,
+        'channel': channel,
+        'mime_part': cfg.items('MIME Part') if cfg.has_section('MIME Part') else [],
+        'pretext': cfg.items('PreText') if cfg.has_section('PreText') else [],
+        'digest_from': cfg.items('Digest From') if cfg.has_section('Digest From') else [],
+        'digest_subject': cfg.items('Digest Subject') if cfg.has_section('Digest Subject') else [],
+    }
+    for section, table in CONTENT_ROUTES:
+        # KEYWORD=[TEAM_ALIAS ]CHANNEL, the team defaults to the one of the To address
+        tables[table] = []
+        if cfg.has_section(section):
+            for keyword, value in cfg.items(section):
+                destination = value.split(None, 1)
+                if len(destination) == 2:
+                    destination = [slack[destination[0]], destination[1]]
+                else:
+                    destination = [None, value]
+                tables[table].append((keyword, destination))
+    return tables
+
+
+def cache_path(paths, args):
+    key = json.dumps([CACHE_VERSION, [os.path.abspath(p) for p in paths], args.slack, args.team, args.channel])
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(state_directory(), 'config-{:s}.json'.format(digest))
+
+
+def read_cache(path, stamp):
+    try:
+        with io.open(path, encoding='utf-8') as fp:
+            cached = json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+    if cached.get('version') != CACHE_VERSION or cached.get('stamp') != stamp:
+        return None
+    return Snapshot(Config(cached['config']), cached['tables'], stamp)
+
+
+def write_cache(path, snapshot):
+    tmp = '{:s}.{:d}.tmp'.format(path, os.getpid())
+    try:
+        with io.open(tmp, 'w', encoding='utf-8') as fp:
+            fp.write(json.dumps({
+                'version': CACHE_VERSION,
+                'stamp': snapshot.stamp,
+                'config': snapshot.config.to_list(),
+                'tables': snapshot.tables,
+            }, ensure_ascii=False))
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+
+def load(args, cache=True):
+    """Return the Snapshot for args, from the cache when no config file changed."""
+    paths = candidates(args)
+    stamp = get_stamp(paths)
+    path = None
+    if cache:
+        try:
+            path = cache_path(paths, args)
+        except (IOError, OSError):
+            path = None
+    if path:
+        snapshot = read_cache(path, stamp)
+        if snapshot is not None:
+            return snapshot
+
+    cfg = compat_configparser()
+    cfg.read(paths)
+    config = Config.from_parser(cfg)
+    snapshot = Snapshot(config, build_tables(config, args), stamp)
+    if path:
+        write_cache(path, snapshot)
+    return snapshot
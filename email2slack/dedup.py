@@ -0,0 +1,62 @@
+from __future__ import unicode_literals
+
+import time
+
+from .state import connect
+
+
+class DedupStore(object):
+    """Message-ID and destination pairs already notified, shared through a sqlite file.
+
+    Keys are claimed inside an immediate transaction, so of several processes
+    handling copies of one mail at once only one gets each key. A key is
+    forgotten ttl seconds after it was last seen, and only the max_entries
+    most recently seen keys are kept.
+    """
+
+    def __init__(self, path, ttl=86400, max_entries=100000):
+        self.path = path
+        self.ttl = float(ttl)
+        self.max_entries = max_entries
+        db = self.__connect()
+        try:
+            db.execute('CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY, used REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS seen_used ON seen (used)')
+        finally:
+            db.close()
+
+    def __connect(self):
+        return connect(self.path)
+
+    def claim(self, keys):
+        """Record keys as seen, returns those which were not seen yet."""
+        db = self.__connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            claimed = []
+            for key in keys:
+                row = db.execute('SELECT used FROM seen WHERE key = ?', (key,)).fetchone()
+                if row is None or row[0] < now - self.ttl:
+                    claimed.append(key)
+                db.execute('INSERT OR REPLACE INTO seen (key, used) VALUES (?, ?)', (key, now))
+            if claimed:
+                db.execute('DELETE FROM seen WHERE used < ?', (now - self.ttl,))
+                db.execute(
+                    'DELETE FROM seen WHERE key IN (SELECT key FROM seen ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,)
+                )
+            db.execute('COMMIT')
+            return claimed
+        finally:
+            db.close()
+
+    def release(self, keys):
+        """Forget keys, e.g. when posting failed and the MTA will retry."""
+        db = self.__connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            db.executemany('DELETE FROM seen WHERE key = ?', [(key,) for key in keys])
+            db.execute('COMMIT')
+        finally:
+            db.close()
@@ -0,0 +1,110 @@
+"""Mails held to be posted as one digest per destination.
+
+A mail matching [Digest From] or [Digest Subject] is not posted, its subject
+is counted for each of its destinations instead. The first mail held for a
+destination opens a window of the configured seconds; once it is over, the
+next notification, "email2slack deliver" or "email2slack digest" posts one
+message listing the distinct subjects and how often each was seen.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+
+from .state import connect
+
+
+class DigestStore(object):
+    """Held subjects per (webhook url, channel), shared through a sqlite file."""
+
+    def __init__(self, path):
+        self.path = path
+        db = connect(path)
+        try:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS window ('
+                'url TEXT, channel TEXT, started REAL, last REAL, due REAL, PRIMARY KEY (url, channel))'
+            )
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS held ('
+                'url TEXT, channel TEXT, subject TEXT, count INTEGER, first REAL, '
+                'PRIMARY KEY (url, channel, subject))'
+            )
+        finally:
+            db.close()
+
+    def hold(self, destinations, subject, window, count=1, started=None):
+        """Count subject for every (url, channel) in destinations."""
+        db = connect(self.path)
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            if started is None:
+                started = now
+            for url, channel in destinations:
+                db.execute(
+                    'INSERT OR IGNORE INTO window (url, channel, started, last, due) VALUES (?, ?, ?, ?, ?)',
+                    (url, channel, started, now, now + window)
+                )
+                db.execute('UPDATE window SET last = ? WHERE url = ? AND channel = ?', (now, url, channel))
+                db.execute(
+                    'INSERT OR IGNORE INTO held (url, channel, subject, count, first) VALUES (?, ?, ?, 0, ?)',
+                    (url, channel, subject, now)
+                )
+                db.execute(
+                    'UPDATE held SET count = count + ? WHERE url = ? AND channel = ? AND subject = ?',
+                    (count, url, channel, subject)
+                )
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    def take_due(self):
+        """Remove the digests whose window is over and return them, oldest first.
+
+        Each digest is (url, channel, started, last, [(subject, count), ...]).
+        """
+        db = connect(self.path)
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            digests = []
+            windows = db.execute(
+                'SELECT url, channel, started, last FROM window WHERE due <= ? ORDER BY started', (time.time(),)
+            ).fetchall()
+            for url, channel, started, last in windows:
+                entries = db.execute(
+                    'SELECT subject, count FROM held WHERE url = ? AND channel = ? ORDER BY first', (url, channel)
+                ).fetchall()
+                db.execute('DELETE FROM held WHERE url = ? AND channel = ?', (url, channel))
+                db.execute('DELETE FROM window WHERE url = ? AND channel = ?', (url, channel))
+                digests.append((url, channel, started, last, [(s, c) for s, c in entries]))
+            db.execute('COMMIT')
+            return digests
+        finally:
+            db.close()
+
+    def restore(self, digest):
+        """Hold a digest returned by take_due() again, e.g. when posting it failed."""
+        url, channel, started, last, entries = digest
+        for subject, count in entries:
+            self.hold([(url, channel)], subject, 0, count=count, started=started)
+
+
+def get_arg_parser():
+    from . import get_arg_parser as get_common_arg_parser
+    parser = get_common_arg_parser(add_help=False)
+    parser.prog = 'email2slack digest'
+    parser.add_argument('-h', '--help', action='help', help='show this help message and exit')
+    return parser
+
+
+def main(argv=None):
+    """Post the digests which are due, e.g. from cron when few mails arrive."""
+    from .slack import Slack
+    args = get_arg_parser().parse_args(argv)
+    if args.debug:
+        raise Exception('digests are not used with --debug')
+    slack = Slack(args)
+    if not slack.digest:
+        raise Exception('no [Digest From] or [Digest Subject] rule is configured')
+    slack.flush_digests()
@@ -0,0 +1,53 @@
+"""Concurrent delivery of one mail to several destinations.
+
+Posts for the same (webhook url, channel) keep their order, since chunks of a
+split mail must arrive in sequence; different destinations are posted at the
+same time, so the total latency is that of the slowest webhook.
+"""
+from __future__ import unicode_literals
+
+import asyncio
+from collections import OrderedDict
+
+
+def group_by_destination(posts):
+    groups = OrderedDict()
+    for url, payload in posts:
+        groups.setdefault((url, payload.get('channel')), []).append((url, payload))
+    return list(groups.values())
+
+
+async def post_in_order(loop, post, posts):
+    for url, payload in posts:
+        await loop.run_in_executor(None, post, url, payload)
+
+
+async def post_all(loop, post, groups):
+    results = await asyncio.gather(
+        *[post_in_order(loop, post, g) for g in groups],
+        return_exceptions=True
+    )
+    return OrderedDict(
+        ((g[0][0], g[0][1].get('channel')), r) for g, r in zip(groups, results) if isinstance(r, Exception)
+    )
+
+
+def deliver(posts, post):
+    """Post (url, payload) pairs with post(url, payload), one task per destination.
+
+    Returns the error of every (url, channel) a post failed for, the other
+    destinations are posted anyway.
+    """
+    groups = group_by_destination(posts)
+    if len(groups) <= 1:
+        try:
+            for url, payload in posts:
+                post(url, payload)
+        except Exception as e:
+            return OrderedDict([((url, payload.get('channel')), e)])
+        return OrderedDict()
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(post_all(loop, post, groups))
+    finally:
+        loop.close()
@@ -0,0 +1,355 @@
+"""Turning HTML mail bodies into text.
+
+The layout is the one email2slack always had: style, script, head and title
+are dropped, br becomes a newline, and the outermost td is followed by a
+space, the outermost tr and p by a newline. Runs of blank lines are then
+collapsed.
+
+The default 'stream' converter produces it in one pass over the parser
+events, keeping only the stack of open elements. The 'bs4' converter builds
+a BeautifulSoup tree, as email2slack used to.
+"""
+from __future__ import unicode_literals
+
+import re
+
+from . import metrics
+from .compat import compat_htmlparser
+
+CONVERTERS = ('stream', 'bs4')
+BLANK_LINES = re.compile('\n{2,}')
+
+DROP = frozenset(['style', 'script', 'head', 'title'])
+VOID = frozenset([
+    'area', 'base', 'basefont', 'bgsound', 'br', 'col', 'embed', 'frame', 'hr', 'image', 'img', 'input',
+    'keygen', 'link', 'meta', 'param', 'source', 'track', 'wbr'
+])
+HEAD = frozenset(['base', 'basefont', 'bgsound', 'link', 'meta', 'noframes', 'script', 'style', 'template', 'title'])
+# start tags which close an open p, table only in standards mode
+CLOSE_P = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'center', 'dd', 'details', 'dialog', 'dir', 'div', 'dl', 'dt',
+    'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hgroup',
+    'hr', 'li', 'listing', 'main', 'menu', 'nav', 'ol', 'p', 'plaintext', 'pre', 'section', 'summary', 'ul', 'xmp'
+])
+# end tags do not close elements beyond these
+SCOPE = frozenset(['applet', 'button', 'caption', 'marquee', 'object', 'table', 'td', 'template', 'th'])
+CELL = ('td', 'th')
+SECTION = frozenset(['caption', 'colgroup', 'tbody', 'tfoot', 'thead'])
+# start tags kept in a table, other elements are moved before it
+TABLE_CONTENT = frozenset([
+    'caption', 'col', 'colgroup', 'form', 'input', 'script', 'style', 'table', 'tbody', 'td', 'template', 'tfoot',
+    'th', 'thead', 'tr'
+])
+# end tags which do not close the elements opened after them
+FORMATTING = frozenset(['a', 'b', 'big', 'code', 'em', 'font', 'i', 'nobr', 's', 'small', 'strike', 'strong', 'tt', 'u'])
+# elements which other end tags do not close
+SPECIAL = frozenset([
+    'address', 'applet', 'area', 'article', 'aside', 'base', 'basefont', 'bgsound', 'blockquote', 'body', 'br',
+    'button', 'caption', 'center', 'col', 'colgroup', 'dd', 'details', 'dir', 'div', 'dl', 'dt', 'embed', 'fieldset',
+    'figcaption', 'figure', 'footer', 'form', 'frame', 'frameset', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'head',
+    'header', 'hgroup', 'hr', 'html', 'iframe', 'img', 'input', 'keygen', 'li', 'link', 'listing', 'main', 'marquee',
+    'menu', 'meta', 'nav', 'noembed', 'noframes', 'noscript', 'object', 'ol', 'p', 'param', 'plaintext', 'pre',
+    'script', 'section', 'select', 'source', 'style', 'summary', 'table', 'tbody', 'td', 'template', 'textarea',
+    'tfoot', 'th', 'thead', 'title', 'tr', 'track', 'ul', 'wbr', 'xmp'
+])
+# the first newline after these start tags is not part of the content
+SKIP_NEWLINE = frozenset(['listing', 'pre', 'textarea'])
+IGNORE = frozenset(['html', 'body'])
+WHITESPACE = ' \t\n\f'
+
+converter = 'stream'
+
+
+def check_converter(name):
+    if name not in CONVERTERS:
+        raise ValueError('unknown HTML converter: {:s}'.format(name))
+    return name
+
+
+def configure(name='stream'):
+    global converter
+    converter = check_converter(name)
+
+
+def to_text(html, name=None):
+    """Text of html with the converter name, the configured one if None."""
+    with metrics.timer('html') as timer:
+        timer.bytes = len(html)
+        if (name or converter) == 'bs4':
+            return soup_text(html)
+        return stream_text(html)
+
+
+def flatten(parts):
+    """Join strings and nested lists of strings, in order."""
+    result = []
+    pending = [iter(parts)]
+    while pending:
+        for part in pending[-1]:
+            if isinstance(part, list):
+                pending.append(iter(part))
+                break
+            result.append(part)
+        else:
+            pending.pop()
+    return ''.join(result)
+
+
+class TextConverter(compat_htmlparser):
+    """Streaming HTML to text converter.
+
+    Only the stack of open elements is kept, and the text is written as the
+    parser goes. It mirrors how an HTML5 parser nests elements as far as the
+    layout depends on it: implied head and tr elements, implicitly closed p,
+    td and tr, void elements, misnested formatting elements, and text or
+    elements misplaced in a table being moved before it. Those are written
+    into a list which is kept in front of every open table.
+    """
+
+    def __init__(self):
+        try:
+            compat_htmlparser.__init__(self, convert_charrefs=True)
+        except TypeError:
+            compat_htmlparser.__init__(self)  # Python 2
+        self.parts = []
+        self.out = self.parts
+        # (tag, output and ancestor counts after it) of the open elements
+        self.stack = []
+        # (text moved before it, its ancestor counts) of the open tables
+        self.tables = []
+        # open td, tr and p elements the current one is in
+        self.counts = {'p': 0, 'td': 0, 'tr': 0}
+        self.dropped = 0
+        self.mode = 'initial'  # 'initial', 'head' and 'body'
+        self.quirks = True
+        self.skip_newline = False
+
+    def handle_entityref(self, name):
+        self.handle_data(self.unescape('&{:s};'.format(name)))  # Python 2
+
+    def handle_charref(self, name):
+        self.handle_data(self.unescape('&#{:s};'.format(name)))  # Python 2
+
+    def handle_decl(self, decl):
+        # a rough approximation of the HTML5 quirks mode rules
+        words = decl.split()
+        if len(words) < 2 or words[0].lower() != 'doctype' or words[1].lower() != 'html':
+            return
+        upper = decl.upper()
+        self.quirks = '//DTD HTML' in upper and 'STRICT' not in upper and 'HTTP://' not in upper
+
+    def in_table(self):
+        """Whether the current element is a table or a row."""
+        return bool(self.stack) and self.stack[-1][0] in ('table', 'tr')
+
+    def table_mode(self):
+        """Whether the innermost table, row, cell or caption is a table or a row."""
+        if not self.tables:
+            return False
+        i = self.find_element(('table', 'tr', 'td', 'th', 'caption'), ())
+        return self.stack[i][0] in ('table', 'tr')
+
+    def push(self, tag, foster=False):
+        self.stack.append((tag, self.out, self.counts))
+        if foster:
+            # the element is moved before the table, out of its rows and cells
+            self.out, counts = self.tables[-1]
+            self.counts = dict(counts)
+        elif tag == 'table':
+            before = []
+            self.out.append(before)
+            self.tables.append((before, dict(self.counts)))
+        if tag in self.counts:
+            self.counts[tag] += 1
+        if tag in DROP:
+            self.dropped += 1
+
+    def pop(self):
+        tag, out, parent_counts = self.stack.pop()
+        counts = self.counts
+        if tag in counts:
+            counts[tag] -= 1
+        if tag in DROP:
+            self.dropped -= 1
+        elif self.dropped:
+            pass
+        elif tag == 'td':
+            if not counts['td']:
+                self.out.append(' ')
+        elif tag == 'tr':
+            if not counts['td'] and not counts['tr']:
+                self.out.append('\n')
+        elif tag == 'p':
+            if not counts['td'] and not counts['tr'] and not counts['p']:
+                self.out.append('\n')
+        elif tag == 'table':
+            self.tables.pop()
+        self.out = out
+        self.counts = parent_counts
+
+    def find_element(self, tags, scope=SCOPE):
+        """Position of the innermost open element in tags, not looking past scope."""
+        stack = self.stack
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] in tags:
+                return i
+            if stack[i][0] in scope:
+                break
+        return None
+
+    def close_element(self, tags, scope=SCOPE):
+        i = self.find_element(tags, scope)
+        if i is not None:
+            while len(self.stack) > i:
+                self.pop()
+        return i is not None
+
+    def close_to(self, tags):
+        """Close elements until the current one is in tags."""
+        while self.stack[-1][0] not in tags:
+            self.pop()
+
+    def handle_starttag(self, tag, attrs):
+        self.skip_newline = False
+        if tag == 'image':
+            tag = 'img'
+        if self.mode != 'body':
+            if tag in HEAD:
+                self.mode = 'head'
+            elif tag == 'head':
+                self.mode = 'head'
+                return
+            elif tag not in IGNORE:
+                self.mode = 'body'
+        if tag in IGNORE or tag == 'head':
+            return
+
+        foster = False
+        if tag in TABLE_CONTENT and tag not in ('table', 'form', 'input', 'script', 'style', 'template'):
+            if not self.tables:
+                return  # ignored outside of a table
+            if tag == 'tr':
+                self.close_element(('tr', 'caption'), ('table',))
+                self.close_to(('table',))
+            elif tag in CELL:
+                self.close_element(CELL + ('caption',), ('table',))
+                self.close_to(('table', 'tr'))
+                if self.stack[-1][0] == 'table':
+                    self.push('tr')
+            else:
+                self.close_element(('tr', 'caption'), ('table',))
+                self.close_to(('table',))
+                if tag == 'caption':
+                    self.push(tag)
+                return
+        elif tag == 'table':
+            if self.table_mode():
+                self.close_element(('table',), ())
+            elif not self.quirks:
+                self.close_element(('p',))
+        elif tag not in TABLE_CONTENT:
+            if tag in CLOSE_P:
+                self.close_element(('p',))
+            foster = self.in_table()
+
+        if tag == 'br':
+            if not self.dropped:
+                (self.tables[-1][0] if foster else self.out).append('\n')
+        elif tag not in VOID:
+            self.push(tag, foster)
+            self.skip_newline = tag in SKIP_NEWLINE and not self.tables
+            if tag == 'title':
+                self.set_cdata_mode(tag)
+
+    handle_startendtag = handle_starttag
+
+    def handle_endtag(self, tag):
+        if tag in IGNORE or tag == 'head':
+            self.mode = 'body'
+            return
+        self.skip_newline = False
+        if tag == 'br':
+            self.handle_starttag(tag, [])
+        elif tag == 'p':
+            if not self.close_element(('p',)):
+                self.push('p', self.in_table())
+                self.pop()
+        elif tag == 'table':
+            self.close_element(('table',), ())
+        elif tag in CELL or tag in ('tr', 'caption'):
+            self.close_element((tag,), ('table',))
+        elif tag in SECTION:
+            self.close_element(('tr',), ('table',))
+        elif tag in FORMATTING:
+            i = self.find_element((tag,))
+            if i is None:
+                return
+            if i == len(self.stack) - 1:
+                self.pop()
+            else:
+                # the elements opened inside it stay open
+                self.stack[i + 1] = (self.stack[i + 1][0],) + self.stack[i][1:]
+                del self.stack[i]
+        elif tag in SPECIAL:
+            self.close_element((tag,))
+        else:
+            self.close_element((tag,), SPECIAL)
+
+    def handle_data(self, data):
+        if self.skip_newline:
+            self.skip_newline = False
+            if data.startswith('\n'):
+                data = data[1:]
+        if self.dropped:
+            return
+        if self.mode != 'body':
+            data = data.lstrip(WHITESPACE)
+            if not data:
+                return
+            self.mode = 'body'
+        if self.in_table() and data.strip(WHITESPACE):
+            self.tables[-1][0].append(data)
+        else:
+            self.out.append(data)
+
+    def text(self):
+        compat_htmlparser.close(self)
+        while self.stack:
+            self.pop()
+        return flatten(self.parts)
+
+
+def stream_text(html):
+    parser = TextConverter()
+    parser.feed(html.replace('\r\n', '\n').replace('\r', '\n'))
+    return BLANK_LINES.sub('\n\n', parser.text()).lstrip('\n')
+
+
+_soup_parser = None
+
+
+def get_soup_parser():
+    global _soup_parser
+    if _soup_parser is None:
+        try:
+            import lxml
+            _soup_parser = 'lxml'
+        except ImportError:
+            _soup_parser = 'html5lib'
+    return _soup_parser
+
+
+def soup_text(html):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, get_soup_parser())
+    for e in soup(['style', 'script', '[document]', 'head', 'title']):
+        e.extract()
+    for br in soup.find_all("br"):
+        br.replace_with("\n")
+    for td in soup.find_all("td"):
+        td.replace_with(td.get_text() + " ")
+    for tr in soup.find_all("tr"):
+        tr.replace_with(tr.get_text() + "\n")
+    for p in soup.find_all("p"):
+        p.replace_with(p.get_text() + "\n")
+    return BLANK_LINES.sub('\n\n', soup.get_text()).lstrip('\n')
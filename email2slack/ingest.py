@@ -0,0 +1,253 @@
+"""Post the mails of an mbox file or a Maildir, e.g. to backfill a channel.
+
+Mails are parsed and their payloads built by a pool of processes, one batch
+ahead of delivery. Delivery follows the order of the mailbox, hence the
+order of mails is kept for every destination. The number of mails delivered
+is written to a checkpoint file after every batch and when the run stops, so
+that an interrupted run resumes after the last delivered mail.
+
+With --debug nothing is posted and no checkpoint is written, the summary
+reports how fast mails were parsed and built.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import logging
+import mailbox
+import multiprocessing
+import os
+import re
+import time
+
+from .upload import UPLOAD
+
+logger = logging.getLogger(__name__)
+# delivery time of Maildir unique names, seconds and microseconds
+MAILDIR_TIME = re.compile(r'(\d+)(?:\.M(\d+))?')
+
+_slack = None
+
+
+def open_mailbox(path):
+    if os.path.isdir(path):
+        return mailbox.Maildir(path, factory=None, create=False)
+    return mailbox.mbox(path, factory=None, create=False)
+
+
+def delivery_order(key):
+    match = MAILDIR_TIME.match(key)
+    if not match:
+        return float('inf'), 0, key
+    return int(match.group(1)), int(match.group(2) or 0), key
+
+
+def read_mailbox(box, start=0):
+    """Yield (index, raw bytes) of the mails of box from start, in mailbox order."""
+    keys = list(box.keys())
+    if isinstance(box, mailbox.Maildir):
+        keys.sort(key=delivery_order)
+    get_bytes = getattr(box, 'get_bytes', None) or box.get_string
+    for index in range(start, len(keys)):
+        yield index, get_bytes(keys[index])
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def init_worker(args):
+    global _slack
+    from .slack import Slack
+    _slack = Slack(args)
+
+
+def build(item):
+    """Parse and build one mail, returns (index, size, Message-ID, destinations, posts, error)."""
+    from . import metrics
+    from .parser import EmailParser
+    index, raw = item
+    try:
+        mail = EmailParser.parse(io.BytesIO(raw), detector=_slack.detector, **_slack.limits)
+        destinations = _slack.route(mail)
+        return index, len(raw), mail['Message-ID'], destinations, _slack.build(mail, destinations), None
+    except Exception as e:
+        return index, len(raw), None, None, None, '{!s}'.format(e)
+    finally:
+        metrics.flush()
+
+
+class Checkpoint(object):
+    """Number of mails of source delivered so far, kept in a JSON file."""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = os.path.abspath(source)
+
+    def load(self):
+        try:
+            with io.open(self.path, encoding='utf-8') as fp:
+                saved = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return 0
+        return saved.get('done', 0) if saved.get('source') == self.source else 0
+
+    def save(self, done):
+        tmp = '{:s}.{:d}.tmp'.format(self.path, os.getpid())
+        with io.open(tmp, 'w', encoding='utf-8') as fp:
+            fp.write(json.dumps({'source': self.source, 'done': done, 'time': time.time()}))
+        os.rename(tmp, self.path)
+
+
+class Ingester(object):
+    def __init__(self, slack, workers=None, batch=256, checkpoint=None, debug=False):
+        self.slack = slack
+        self.workers = workers
+        self.batch = batch
+        self.checkpoint = checkpoint
+        self.debug = debug
+        self.stats = {'mails': 0, 'bytes': 0, 'posts': 0, 'failed': 0, 'duplicates': 0}
+
+    def claim(self, results):
+        """Claim the destinations of a batch in one transaction, returns the claimed keys per result.
+
+        None stands for every destination, when there is nothing to deduplicate.
+        """
+        dedup = self.slack.dedup
+        keys = [
+            self.slack.dedup_keys(message_id, destinations) if dedup and message_id and error is None else None
+            for index, size, message_id, destinations, posts, error in results
+        ]
+        wanted = [k for batch in keys if batch for k in batch]
+        claimed = set(dedup.claim(wanted)) if wanted else set()
+        return [None if batch is None else [k for k in batch if k in claimed] for batch in keys]
+
+    def deliver(self, result, claimed):
+        index, size, message_id, destinations, posts, error = result
+        self.stats['mails'] += 1
+        self.stats['bytes'] += size
+        if error is not None:
+            # one broken mail must not stop a backfill
+            logger.error('skipping mail %d: %s', index, error)
+            self.stats['failed'] += 1
+            return
+        if claimed is not None and len(claimed) < len(destinations):
+            self.stats['duplicates'] += 1
+            claimed = set(claimed)
+            wanted = set(d for k, d in zip(self.slack.dedup_keys(message_id, destinations), destinations)
+                         if k in claimed)
+            channels = set(c for u, c in wanted)
+            # uploads go by channel only, whatever the webhook
+            posts = [
+                (url, payload) for url, payload in posts
+                if (url, payload.get('channel')) in wanted or (url == UPLOAD and payload.get('channel') in channels)
+            ]
+        if posts and not self.debug:
+            self.slack.deliver(posts)
+        self.stats['posts'] += len(posts)
+
+    def run(self, items, args):
+        """Build (index, raw bytes) items on the pool and deliver them in order."""
+        pool = None
+        if self.workers != 0:
+            pool = multiprocessing.Pool(self.workers or multiprocessing.cpu_count(), init_worker, (args,))
+        else:
+            init_worker(args)
+        try:
+            pending = None
+            for batch in batches(items, self.batch):
+                if pool is None:
+                    results = [build(item) for item in batch]
+                else:
+                    # build the next batch while this one is delivered
+                    results, pending = pending, pool.map_async(build, batch, chunksize=8)
+                    if results is None:
+                        continue
+                    results = results.get()
+                self.deliver_all(results)
+            if pending is not None:
+                self.deliver_all(pending.get())
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def deliver_all(self, results):
+        claimed = self.claim(results)
+        done = 0
+        try:
+            for i, result in enumerate(results):
+                try:
+                    self.deliver(result, claimed[i])
+                except Exception as e:
+                    # the next run starts from this mail, let it post where it failed and the rest of the batch
+                    keys = claimed[i] or []
+                    if keys:
+                        index, size, message_id, destinations, posts, error = result
+                        destination = dict(zip(self.slack.dedup_keys(message_id, destinations), destinations))
+                        keys = self.slack.failed_keys(keys, [destination[k] for k in keys], e)
+                    self.slack.release(keys + [k for later in claimed[i + 1:] if later for k in later])
+                    raise
+                done = i + 1
+        finally:
+            # once per batch, a killed run posts again at most a batch, which dedup drops
+            if done and self.checkpoint and not self.debug:
+                self.checkpoint.save(results[done - 1][0] + 1)
+
+
+def get_arg_parser():
+    from . import get_arg_parser as get_common_arg_parser
+    parser = get_common_arg_parser(add_help=False)
+    parser.prog = 'email2slack ingest'
+    parser.add_argument('-h', '--help', action='help', help='show this help message and exit')
+    parser.add_argument('source', help='mbox file or Maildir directory')
+    parser.add_argument(
+        '--workers', type=int,
+        help='processes parsing and building mails, 0 to do it in this one (default: number of CPUs)'
+    )
+    parser.add_argument(
+        '--batch', type=int, default=256,
+        help='mails handed to the pool at a time (default: %(default)s)'
+    )
+    parser.add_argument('--checkpoint', help='checkpoint file (default: in the state directory)')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start from the first mail')
+    return parser
+
+
+def main(argv=None):
+    from . import config
+    from .slack import Slack
+    from .state import state_path
+    args = get_arg_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    source = os.path.abspath(args.source)
+    path = args.checkpoint
+    if not path:
+        digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+        path = state_path(config.load(args).config, 'ingest-{:s}.json'.format(digest))
+    checkpoint = Checkpoint(path, source)
+    start = 0 if args.restart or args.debug else checkpoint.load()
+    if start:
+        logger.info('resuming %s after %d mails', source, start)
+
+    slack = Slack(args)
+    ingester = Ingester(slack, workers=args.workers, batch=args.batch, checkpoint=checkpoint, debug=args.debug)
+    began = time.time()
+    ingester.run(read_mailbox(open_mailbox(source), start), args)
+    elapsed = max(time.time() - began, 1e-9)
+    stats = ingester.stats
+    logger.info(
+        '%d mails, %d failed, %d duplicates, %d posts, %.1f MB in %.2fs: %.1f mails/s, %.2f MB/s',
+        stats['mails'], stats['failed'], stats['duplicates'], stats['posts'], stats['bytes'] / 1e6, elapsed,
+        stats['mails'] / elapsed, stats['bytes'] / 1e6 / elapsed
+    )
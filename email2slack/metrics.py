@@ -0,0 +1,234 @@
+"""Per-stage timings, byte and chunk counts, and HTTP statuses.
+
+Stages record into the process wide recorder, which does nothing until
+configure() is given a sink. flush() adds what was recorded since the last
+flush to totals kept in a sqlite file shared by every email2slack process and
+rewrites the Prometheus textfile from them, and sends the new samples to
+StatsD, which sums them itself.
+"""
+from __future__ import unicode_literals
+
+import io
+import logging
+import os
+import socket
+import threading
+import time
+
+from .state import connect
+
+logger = logging.getLogger(__name__)
+clock = getattr(time, 'perf_counter', time.time)
+
+# name: (type, help)
+METRICS = {
+    'email2slack_stage_seconds': ('summary', 'Time spent in each processing stage.'),
+    'email2slack_stage_bytes_total': ('counter', 'Input of each processing stage, in bytes or characters of text.'),
+    'email2slack_mails_total': ('counter', 'Mails notified.'),
+    'email2slack_duplicates_total': ('counter', 'Destinations skipped because the mail was already posted there.'),
+    'email2slack_digested_total': ('counter', 'Destinations a mail was held for, to be posted in a digest.'),
+    'email2slack_digests_total': ('counter', 'Digests posted.'),
+    'email2slack_chunks_total': ('counter', 'Messages mail bodies were split into.'),
+    'email2slack_posts_total': ('counter', 'Calls planned to post mails, packed chunks times destinations.'),
+    'email2slack_uploads_total': ('counter', 'Bodies posted as a file through the Web API.'),
+    'email2slack_http_responses_total': ('counter', 'Responses of Slack by HTTP status, error when none came.'),
+}
+STATSD_PACKET_SIZE = 512
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    return ','.join('{:s}="{:s}"'.format(k, escape('{!s}'.format(v))) for k, v in sorted(labels.items()))
+
+
+class NullTimer(object):
+    bytes = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class Timer(object):
+    """Times a with block as stage; set bytes to count its input as well."""
+
+    def __init__(self, recorder, stage):
+        self.recorder = recorder
+        self.stage = stage
+        self.bytes = None
+        self.start = None
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.observe('email2slack_stage_seconds', clock() - self.start, stage=self.stage)
+        if self.bytes is not None:
+            self.recorder.count('email2slack_stage_bytes_total', self.bytes, stage=self.stage)
+        return False
+
+
+class Recorder(object):
+    def __init__(self, path=None, textfile=None, statsd=None, prefix='email2slack'):
+        self.path = path
+        self.textfile = textfile
+        self.statsd = statsd
+        self.prefix = prefix
+        self.__lock = threading.Lock()
+        self.__pending = {}  # (name, labels): [count, sum]
+        self.__samples = []  # StatsD lines
+        self.__socket = None
+        if textfile:
+            db = connect(path)
+            try:
+                db.execute(
+                    'CREATE TABLE IF NOT EXISTS metric ('
+                    'name TEXT, labels TEXT, count REAL, sum REAL, PRIMARY KEY (name, labels))'
+                )
+            finally:
+                db.close()
+
+    def timer(self, stage):
+        return Timer(self, stage)
+
+    def __add(self, name, value, labels, sample):
+        key = (name, format_labels(labels))
+        with self.__lock:
+            totals = self.__pending.get(key)
+            if totals is None:
+                totals = self.__pending[key] = [0, 0.0]
+            totals[0] += 1
+            totals[1] += value
+            if self.statsd:
+                self.__samples.append(sample)
+
+    def __statsd_name(self, name, labels):
+        name = name[len('email2slack_'):]
+        if name.endswith('_total'):
+            name = name[:-len('_total')]
+        parts = [self.prefix, name] + ['{!s}'.format(labels[k]) for k in sorted(labels)]
+        return '.'.join(p.replace('.', '_').replace(':', '_').replace('|', '_') for p in parts if p)
+
+    def observe(self, name, seconds, **labels):
+        self.__add(name, seconds, labels, '{:s}:{:.3f}|ms'.format(self.__statsd_name(name, labels), seconds * 1000))
+
+    def count(self, name, value=1, **labels):
+        self.__add(name, value, labels, '{:s}:{!s}|c'.format(self.__statsd_name(name, labels), value))
+
+    def flush(self):
+        with self.__lock:
+            pending, self.__pending = self.__pending, {}
+            samples, self.__samples = self.__samples, []
+        # metrics must never break delivery
+        try:
+            if samples:
+                self.send(samples)
+            if pending and self.textfile:
+                self.store(pending)
+        except Exception as e:
+            logger.warning('failed to export metrics: %s', e)
+
+    def send(self, samples):
+        if self.__socket is None:
+            self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        packet = []
+        size = 0
+        for sample in samples + [None]:
+            if packet and (sample is None or size + len(sample) + 1 > STATSD_PACKET_SIZE):
+                try:
+                    self.__socket.sendto('\n'.join(packet).encode('utf-8'), self.statsd)
+                except socket.error:
+                    pass
+                packet = []
+                size = 0
+            if sample is not None:
+                packet.append(sample)
+                size += len(sample) + 1
+
+    def store(self, pending):
+        db = connect(self.path)
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            for (name, labels), (count, total) in pending.items():
+                db.execute(
+                    'INSERT OR IGNORE INTO metric (name, labels, count, sum) VALUES (?, ?, 0, 0)', (name, labels)
+                )
+                db.execute(
+                    'UPDATE metric SET count = count + ?, sum = sum + ? WHERE name = ? AND labels = ?',
+                    (count, total, name, labels)
+                )
+            rows = db.execute('SELECT name, labels, count, sum FROM metric ORDER BY name, labels').fetchall()
+            # still inside the transaction, so that files are replaced in order
+            self.write_textfile(rows)
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    def write_textfile(self, rows):
+        lines = []
+        previous = None
+        for name, labels, count, total in rows:
+            kind, description = METRICS.get(name, ('untyped', name))
+            if name != previous:
+                lines.append('# HELP {:s} {:s}'.format(name, description))
+                lines.append('# TYPE {:s} {:s}'.format(name, kind))
+                previous = name
+            labels = '{' + labels + '}' if labels else ''
+            if kind == 'summary':
+                lines.append('{:s}_sum{:s} {!r}'.format(name, labels, float(total)))
+                lines.append('{:s}_count{:s} {:d}'.format(name, labels, int(count)))
+            else:
+                lines.append('{:s}{:s} {!r}'.format(name, labels, float(total)))
+        tmp = '{:s}.{:d}.tmp'.format(self.textfile, os.getpid())
+        with io.open(tmp, 'w', encoding='utf-8') as fp:
+            fp.write('\n'.join(lines) + '\n')
+        os.rename(tmp, self.textfile)
+
+
+NULL_TIMER = NullTimer()
+_recorder = None
+_settings = None
+_lock = threading.Lock()
+
+
+def configure(path=None, textfile=None, statsd=None, prefix='email2slack', replace=True):
+    """Record into path, exporting to a Prometheus textfile and/or a StatsD (host, port).
+
+    With replace False a sink set by an earlier call is kept. Returns whether
+    these settings are the ones in use.
+    """
+    global _recorder, _settings
+    settings = (path, textfile, statsd, prefix)
+    with _lock:
+        if settings == _settings:
+            return True
+        if _recorder is not None and not replace:
+            return False
+        if _recorder is not None:
+            _recorder.flush()
+        _recorder = Recorder(path, textfile, statsd, prefix) if textfile or statsd else None
+        _settings = settings
+        return True
+
+
+def timer(stage):
+    recorder = _recorder
+    return NULL_TIMER if recorder is None else recorder.timer(stage)
+
+
+def count(name, value=1, **labels):
+    recorder = _recorder
+    if recorder is not None:
+        recorder.count(name, value, **labels)
+
+
+def flush():
+    recorder = _recorder
+    if recorder is not None:
+        recorder.flush()
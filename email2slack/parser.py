@@ -3,108 +3,233 @@ from __future__ import unicode_literals
 
 import re
 from email.header import decode_header
-from email.parser import Parser
 
 try:
-    from email.parser import BytesParser
+    from email.parser import BytesFeedParser as FeedParser  # Python 3
 except ImportError:
-    BytesParser = None
+    from email.feedparser import FeedParser  # Python 2, str is bytes
 
-import chardet
+from . import charset
+from . import metrics
+from .compat import *
 
-try:
-    from nkf import nkf
-except ImportError:
-    nkf = None
-
-
-def unfold_flowed(text):
-    lines = text.splitlines()
-    nlines = len(lines)
-    i = 0
-    while i < nlines - 1:
-        if not lines[i].endswith(' ') or lines[i] == '-- ':
-            i += 1
-            continue
-
-        quote = re.match(r'\s*(>\s*)+', lines[i])
-        if quote:
-            quote = quote.group(0)
-            if lines[i + 1].startswith(quote):
-                nquote = re.match(r'\s*(>\s*)+', lines[i + 1]).group(0)
-                if nquote != quote:
-                    i += 1
-                    continue
-                lines[i] = lines[i][:len(lines[i]) - 1] + lines[i + 1][len(quote):]
-                del (lines[i + 1])
-                nlines -= 1
-                continue
-        elif not re.match(r'\s*(>\s*)+', lines[i + 1]):
-            lines[i] = lines[i][:len(lines[i]) - 1] + lines[i + 1]
-            del (lines[i + 1])
-            nlines -= 1
-            continue
-        i += 1
-    return '\n'.join(lines)
+QUOTE = re.compile(r'\s*(>\s*)+')
+
+
+class FlowedDecoder(object):
+    """Single pass RFC 3676 format=flowed decoder.
+
+    Feed it text in chunks of any size with feed(), or whole lines with
+    feed_line(), then call close() for the unfolded text. A line ending with
+    a space (other than the signature separator '-- ') is joined with the
+    next one if both have the same quote prefix; with delsp the trailing
+    space is removed. Joined lines are kept as a list of parts, so long
+    paragraphs cost linear time.
+    """
+
+    def __init__(self, delsp=True):
+        self.delsp = delsp
+        self.lines = []
+        self.__parts = None  # line being unfolded, no empty items
+        self.__length = 0
+        self.__quote = None
+        self.__pending = ''
+
+    def __start(self, line):
+        self.__parts = [line] if line else []
+        self.__length = len(line)
+        quote = QUOTE.match(line)
+        self.__quote = quote.group(0) if quote else None
+
+    def __flush(self):
+        if self.__parts is not None:
+            self.lines.append(''.join(self.__parts))
+
+    def __is_soft(self):
+        if not self.__parts or not self.__parts[-1].endswith(' '):
+            return False
+        return self.__length != 3 or ''.join(self.__parts) != '-- '
+
+    def __join(self, rest):
+        parts = self.__parts
+        # the quote prefix can only change if it spans the whole line so far
+        requote = self.__quote is not None and len(self.__quote) >= self.__length - 1
+        if self.delsp:
+            parts[-1] = parts[-1][:-1]
+            self.__length -= 1
+            if not parts[-1]:
+                parts.pop()
+        if rest:
+            parts.append(rest)
+            self.__length += len(rest)
+        if requote:
+            self.__start(''.join(parts))
+
+    def feed_line(self, line):
+        if self.__parts is None:
+            self.__start(line)
+            return
+        if self.__is_soft():
+            quote = self.__quote
+            next_quote = QUOTE.match(line)
+            next_quote = next_quote.group(0) if next_quote else None
+            if quote:
+                if next_quote == quote:
+                    self.__join(line[len(quote):])
+                    return
+            elif next_quote is None:
+                self.__join(line)
+                return
+        self.__flush()
+        self.__start(line)
+
+    def feed(self, text):
+        text = self.__pending + text
+        self.__pending = ''
+        lines = text.splitlines(True)
+        if lines and (lines[-1] == lines[-1].rstrip('\r\n\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029') or
+                      lines[-1].endswith('\r')):
+            # incomplete line, or maybe the first half of \r\n
+            self.__pending = lines.pop()
+        for line in lines:
+            self.feed_line(line[:-2] if line.endswith('\r\n') else line[:-1])
+
+    def close(self):
+        if self.__pending:
+            pending = self.__pending
+            self.__pending = ''
+            self.feed_line(pending[:-1] if pending.endswith('\r') else pending)
+        self.__flush()
+        self.__parts = None
+        return '\n'.join(self.lines)
+
+
+def unfold_flowed(text, delsp=True):
+    decoder = FlowedDecoder(delsp)
+    decoder.feed(text)
+    return decoder.close()
+
+
+# only these parts are decoded, the payload of any other part is ignored
+TEXT_TYPES = ('text/plain', 'text/html')
+READ_SIZE = 64 * 1024
+MAX_MESSAGE_BYTES = 25 * 1024 * 1024
+MAX_PART_BYTES = 1024 * 1024
+TRUNCATED = '\n[truncated by email2slack]\n'
+
+HEADERS = ('From', 'To', 'Subject', 'Date', 'Message-ID')
+FOLDING = re.compile(r'\r?\n\s+')
+# decode_header does not work well in some case,
+# eg. FW: =?ISO-2022-JP?B?GyRCR1s/LklURz0bKEI=?=:
+# so encoded-words are split out and decoded one by one
+ENCODED_WORD = re.compile(r'(=\?[^?]+\?[BQbq]\?[^?]+\?=)')
+# distinct encoded-words remembered, senders and subjects repeat in bulk
+WORD_CACHE_SIZE = 1024
+
+
+@compat_lru_cache(maxsize=WORD_CACHE_SIZE)
+def decode_word(word):
+    decoded = []
+    for part, part_charset in decode_header(word):
+        if not isinstance(part, bytes):
+            decoded.append(part)
+        elif part_charset:
+            try:
+                decoded.append(charset.to_unicode(part, part_charset, charset.HEADER_NKF_OPTIONS))
+            except LookupError:
+                decoded.append(part.decode('utf-8', 'replace'))
+        else:
+            decoded.append(part.decode('utf-8', 'replace'))
+    return ''.join(decoded)
+
+
+def decode_value(value):
+    """Unfold a raw header value and decode its RFC 2047 encoded-words."""
+    if '\n' in value:
+        value = FOLDING.sub(' ', value)
+    if '=?' not in value:
+        return value
+    chunks = ENCODED_WORD.split(value)
+    # odd chunks are encoded-words, whitespace between two of them goes (RFC 2047)
+    decoded = []
+    last = len(chunks) - 1
+    for i, chunk in enumerate(chunks):
+        if i % 2:
+            decoded.append(decode_word(chunk))
+        elif chunk and not (0 < i < last and not chunk.strip(' \t')):
+            decoded.append(chunk)
+    return ''.join(decoded)
 
 
 class EmailParser(object):
     @staticmethod
-    def parse(mime_mail_fp):
-        if callable(BytesParser):
-            parsed_mail = BytesParser().parse(mime_mail_fp)
-        else:
-            parsed_mail = Parser().parse(mime_mail_fp)
-        result = {
-            'From': EmailParser.parse_header(parsed_mail, 'From'),
-            'To': EmailParser.parse_header(parsed_mail, 'To'),
-            'Subject': EmailParser.parse_header(parsed_mail, 'Subject'),
-            'Date': EmailParser.parse_header(parsed_mail, 'Date'),
-            'Message-ID': EmailParser.parse_header(parsed_mail, 'Message-ID'),
-            'body-plain': None,
-            'body-html': None
-        }
-
-        messages = []
-        extracted = EmailParser.extract_message(parsed_mail)
-        if extracted:
-            if isinstance(extracted, list):
-                messages.extend(extracted)
-            else:
-                messages.append(extracted)
-
-        for m in messages:
-            content_type = m[0]
-            if content_type:
-                content_type = content_type.lower()
-            body = m[1].replace('\r\n', '\n')
-            try:
-                parameter = dict([x.split('=', 1) for x in content_type.lower().replace('"', '').split('; ')[1:]])
-            except:
-                parameter = {}
-            if parameter.get('format') == 'flowed' and parameter.get('delsp') == 'yes':
-                body = unfold_flowed(body)
-            body = body.rstrip() + '\n'
-
-            if content_type is None or content_type.startswith('text/plain'):
-                if result['body-plain']:
-                    result['body-plain'] += body
-                else:
-                    result['body-plain'] = body
-            elif content_type.startswith('text/html'):
-                if result['body-html']:
-                    result['body-html'] += body
+    def read(mime_mail_fp, max_total_bytes=MAX_MESSAGE_BYTES):
+        """Feed the mail to the parser in blocks, ignoring anything after max_total_bytes."""
+        with metrics.timer('read') as timer:
+            parser = FeedParser()
+            total = 0
+            while True:
+                block = mime_mail_fp.read(READ_SIZE)
+                if not block:
+                    break
+                if max_total_bytes is not None and total + len(block) > max_total_bytes:
+                    block = block[:max(max_total_bytes - total, 0)]
+                total += len(block)
+                if block:
+                    parser.feed(block)
+                # past the limit, keep reading so that the MTA does not get EPIPE
+            timer.bytes = total
+            return parser.close()
+
+    @staticmethod
+    def parse(mime_mail_fp, max_part_bytes=MAX_PART_BYTES, max_total_bytes=MAX_MESSAGE_BYTES, detector=None):
+        with metrics.timer('parse'):
+            parsed_mail = EmailParser.read(mime_mail_fp, max_total_bytes)
+            result = EmailParser.parse_headers(parsed_mail)
+            result['body-plain'] = None
+            result['body-html'] = None
+
+            messages = []
+            with metrics.timer('extract'):
+                extracted = EmailParser.extract_message(parsed_mail, max_part_bytes, detector)
+            if extracted:
+                if isinstance(extracted, list):
+                    messages.extend(extracted)
                 else:
-                    result['body-html'] = body
+                    messages.append(extracted)
 
-        return result
+            for m in messages:
+                content_type = m[0]
+                if content_type:
+                    content_type = content_type.lower()
+                body = m[1].replace('\r\n', '\n')
+                try:
+                    parameter = dict([x.split('=', 1) for x in content_type.lower().replace('"', '').split('; ')[1:]])
+                except:
+                    parameter = {}
+                if parameter.get('format') == 'flowed':
+                    body = unfold_flowed(body, delsp=parameter.get('delsp') == 'yes')
+                body = body.rstrip() + '\n'
+
+                if content_type is None or content_type.startswith('text/plain'):
+                    if result['body-plain']:
+                        result['body-plain'] += body
+                    else:
+                        result['body-plain'] = body
+                elif content_type.startswith('text/html'):
+                    if result['body-html']:
+                        result['body-html'] += body
+                    else:
+                        result['body-html'] = body
+
+            return result
 
     @staticmethod
-    def extract_message(message):
+    def extract_message(message, max_part_bytes=MAX_PART_BYTES, detector=None):
         if message.is_multipart():
             messages = []
             for m in message.get_payload():
-                extracted = EmailParser.extract_message(m)
+                extracted = EmailParser.extract_message(m, max_part_bytes, detector)
                 if extracted:
                     if isinstance(extracted, list):
                         messages.extend(extracted)
@@ -112,83 +237,39 @@ class EmailParser(object):
                         messages.append(extracted)
             return messages
 
+        if message.get_content_type() not in TEXT_TYPES:
+            return None
         body = message.get_payload(decode=True)
         if not body:
             return None
-        charset = chardet.detect(body)['encoding']
-        if charset is None:
-            charset = 'utf-8'
-        elif charset == 'ISO-2022-JP':
-            if callable(nkf):
-                body = nkf('-Jwx', body)
-                charset = 'utf-8'
-            else:
-                charset = 'ISO-2022-JP-2004'
-                body = body.replace(b'\033$B', b'\033$(Q').replace(b'\033(J', b'\033(B')
-        elif charset == 'SHIFT_JIS':
-            if callable(nkf):
-                body = nkf('-Swx', body)
-                charset = 'utf-8'
-            else:
-                charset = 'CP932'
-        elif charset == 'EUC-JP':
-            if callable(nkf):
-                body = nkf('-Ew', body)
-                charset = 'utf-8'
-            else:
-                charset = 'EUCJIS2004'
-
-        return message['Content-Type'], body.decode(encoding=charset, errors='replace')
+        metrics.count('email2slack_stage_bytes_total', len(body), stage='extract')
+        if max_part_bytes is not None and len(body) > max_part_bytes:
+            text = charset.decode(
+                body[:max_part_bytes], message.get_content_charset(), truncated=True, detector=detector)
+            return message['Content-Type'], text + TRUNCATED
+        return message['Content-Type'], charset.decode(body, message.get_content_charset(), detector=detector)
+
+    @staticmethod
+    def parse_headers(parsed_mail, fields=HEADERS):
+        """Decode the first occurrence of each of fields, '' when missing, in one pass over the headers."""
+        wanted = dict((field.lower(), field) for field in fields)
+        result = dict((field, '') for field in fields)
+        raw_items = getattr(parsed_mail, 'raw_items', None)
+        if raw_items is None:
+            # Python 2, values are not processed
+            items, fetch = parsed_mail.items(), None
+        else:
+            items, fetch = raw_items(), parsed_mail.policy.header_fetch_parse
+        for name, value in items:
+            field = wanted.pop(name.lower(), None)
+            if field is None:
+                continue
+            result[field] = decode_value(value if fetch is None else fetch(name, value))
+            if not wanted:
+                break
+        return result
 
     @staticmethod
     def parse_header(parsed_mail, field):
-        # type: (List[str], str) -> str
-        decoded = []
-        raw_header = parsed_mail.get(field, '')
-        # decode_header does not work well in some case,
-        # eg. FW: =?ISO-2022-JP?B?GyRCR1s/LklURz0bKEI=?=:
-        chunks = re.split(r'(=\?[^?]+\?[BQ]\?[^?]+\?=)', re.sub(r'\r?\n\s+', ' ', raw_header))
-        i = 0
-        while i < len(chunks):
-            if chunks[i].startswith('=?') and chunks[i].endswith('?=') and \
-                            i < len(chunks) - 2 and \
-                            chunks[i + 1] == ' ' and \
-                    chunks[i + 2].startswith('=?') and chunks[i + 2].endswith('?='):
-                del (chunks[i + 1])
-            i += 1
-
-        for chunk in chunks:
-            if chunk.find('=?') >= 0:
-                for decoded_chunk, charset in decode_header(chunk):
-                    if charset:
-                        if charset == 'ISO-2022-JP':
-                            if callable(nkf):
-                                decoded_chunk = nkf('-Jw', decoded_chunk)
-                                charset = 'utf-8'
-                            else:
-                                charset = 'ISO-2022-JP-2004'
-                                decoded_chunk = decoded_chunk \
-                                    .replace(b'\033$B', b'\033$(Q') \
-                                    .replace(b'\033(J', b'\033(B')
-                        elif charset == 'SJIS':
-                            if callable(nkf):
-                                decoded_chunk = nkf('-Sw', decoded_chunk)
-                                charset = 'utf-8'
-                            else:
-                                charset = 'CP932'
-                        elif charset == 'EUC-JP':
-                            if callable(nkf):
-                                decoded_chunk = nkf('-Ew', decoded_chunk)
-                                charset = 'utf-8'
-                            else:
-                                charset = 'EUCJIS2004'
-                        try:
-                            decoded_chunk = decoded_chunk.decode(charset, errors='replace')
-                        except TypeError:
-                            pass
-                    else:
-                        decoded_chunk = decoded_chunk.decode()
-                    decoded.append(decoded_chunk)
-            elif chunk:
-                decoded.append(chunk)
-        return ''.join(decoded)
+        # type: (Message, str) -> str
+        return decode_value(parsed_mail.get(field, ''))
@@ -0,0 +1,223 @@
+"""Profiling a sampled fraction of the mails handled in production.
+
+A sampled mail is run from parsing to the end of Slack.notify under cProfile
+and, where available, tracemalloc. Three files tagged with its Message-ID are
+written to the directory: pstats, a tracemalloc snapshot and a JSON summary.
+Only one mail is profiled at a time in a process, since tracemalloc sees
+the allocations of every thread and a cProfile profiler cannot run while
+another one is active (Python 3.12+); mails arriving meanwhile are not
+sampled. Before 3.12 cProfile only sees the thread that enabled it, the one
+handling the sampled mail.
+
+"email2slack profile DIR" adds up the samples of a directory and prints the
+slowest mails, the functions taking most time and the biggest allocation
+sites.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+# file names stay ASCII, the file system encoding may be ASCII too (Python 2)
+UNSAFE = re.compile(r'[^A-Za-z0-9_.@-]+')
+MEMORY_FRAMES = 1
+
+_lock = threading.Lock()
+
+
+class NullSample(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def tag(self, mail):
+        pass
+
+
+class Sample(object):
+    """Profiling started by Profiler.sample(), until the end of a with block; tag() it with the parsed mail."""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.message_id = ''
+        self.sender = ''
+        self.profile = None
+        self.tracemalloc = None
+        self.started = None
+
+    def tag(self, mail):
+        self.message_id = mail['Message-ID']
+        self.sender = mail['From']
+
+    def start(self):
+        import cProfile
+        try:
+            if self.profiler.memory:
+                try:
+                    import tracemalloc
+                except ImportError:  # Python 2
+                    tracemalloc = None
+                if tracemalloc is not None and not tracemalloc.is_tracing():
+                    tracemalloc.start(MEMORY_FRAMES)
+                    self.tracemalloc = tracemalloc
+            self.profile = cProfile.Profile()
+            self.started = time.time()
+            self.profile.enable()
+        except Exception:
+            if self.tracemalloc is not None:
+                self.tracemalloc.stop()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        elapsed = time.time() - self.started
+        try:
+            snapshot = None
+            summary = {
+                'message_id': self.message_id,
+                'from': self.sender,
+                'time': self.started,
+                'seconds': elapsed,
+                'error': None if exc_info[0] is None else '{!s}'.format(exc_info[1]),
+            }
+            if self.tracemalloc is not None:
+                summary['current_bytes'], summary['peak_bytes'] = self.tracemalloc.get_traced_memory()
+                snapshot = self.tracemalloc.take_snapshot()
+                self.tracemalloc.stop()
+            self.profiler.write(self.profile, snapshot, summary)
+        except Exception as e:
+            # profiling must never break delivery
+            logger.warning('failed to write profile: %s', e)
+        finally:
+            _lock.release()
+        return False
+
+
+NULL_SAMPLE = NullSample()
+
+
+class Profiler(object):
+    def __init__(self, directory, rate=1.0, memory=True):
+        self.directory = directory
+        self.rate = rate
+        self.memory = memory
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def sample(self):
+        """Sample for the next mail, which does nothing unless the mail is picked."""
+        if random.random() >= self.rate or not _lock.acquire(False):
+            return NULL_SAMPLE
+        sample = Sample(self)
+        try:
+            sample.start()
+        except Exception as e:
+            # e.g. another profiler is active; the next mails may be sampled
+            logger.warning('failed to start profiling: %s', e)
+            _lock.release()
+            return NULL_SAMPLE
+        return sample
+
+    def write(self, profile, snapshot, summary):
+        tag = UNSAFE.sub('_', summary['message_id'].strip('<>'))[:80] or 'unknown'
+        base = os.path.join(self.directory, '{:.6f}-{:d}-{:s}'.format(summary['time'], os.getpid(), tag))
+        profile.dump_stats(base + '.pstats')
+        if snapshot is not None:
+            snapshot.dump(base + '.tracemalloc')
+        with io.open(base + '.json', 'w', encoding='utf-8') as fp:
+            fp.write(json.dumps(summary, ensure_ascii=False))
+
+
+class NullProfiler(object):
+    def sample(self):
+        return NULL_SAMPLE
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def report(directory, top=20, out=None):
+    """Print the slowest mails, hottest functions and biggest allocation sites of the samples in directory.
+
+    out is a text stream, sys.stdout by default.
+    """
+    import glob
+    import pstats
+    import sys
+    if out is None:
+        out = sys.stdout
+        if sys.version_info[0] == 2:
+            # Message-IDs and senders may not be ASCII, and a pipe has no encoding
+            import codecs
+            out = codecs.getwriter('utf-8')(out)
+
+    summaries = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with io.open(path, encoding='utf-8') as fp:
+            summaries.append((path[:-len('.json')], json.load(fp)))
+    if not summaries:
+        print('no samples in {:s}'.format(directory), file=out)
+        return
+    print('{:d} samples, slowest:'.format(len(summaries)), file=out)
+    for base, summary in sorted(summaries, key=lambda s: -s[1]['seconds'])[:top]:
+        print('{:10.3f}s {:>12s}  {:s}  {:s}'.format(
+            summary['seconds'], '{:,d} B'.format(summary['peak_bytes']) if 'peak_bytes' in summary else '-',
+            summary['message_id'], summary['from']
+        ), file=out)
+
+    profiles = [base + '.pstats' for base, _ in summaries if os.path.exists(base + '.pstats')]
+    if profiles:
+        print('', file=out)
+        # pstats writes str, bytes on Python 2
+        buf = io.StringIO() if sys.version_info[0] > 2 else io.BytesIO()
+        stats = pstats.Stats(profiles[0], stream=buf)
+        for path in profiles[1:]:
+            stats.add(path)
+        stats.files = []  # not a line per sample
+        stats.sort_stats('cumulative').print_stats(top)
+        text = buf.getvalue()
+        out.write(text.decode('utf-8', 'replace') if isinstance(text, bytes) else text)
+
+    snapshots = [base + '.tracemalloc' for base, _ in summaries if os.path.exists(base + '.tracemalloc')]
+    if snapshots:
+        import tracemalloc
+        sites = {}
+        for path in snapshots:
+            for stat in tracemalloc.Snapshot.load(path).statistics('lineno'):
+                size, count = sites.get(stat.traceback, (0, 0))
+                sites[stat.traceback] = size + stat.size, count + stat.count
+        print('allocation sites, bytes alive at the end of a mail, summed over {:d} samples:'.format(
+            len(snapshots)
+        ), file=out)
+        for traceback, (size, count) in sorted(sites.items(), key=lambda s: -s[1][0])[:top]:
+            print('{:14,d} B {:9,d}  {!s}'.format(size, count, traceback), file=out)
+
+
+def get_arg_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog='email2slack profile', description='summarize profiled mails')
+    parser.add_argument('directory', help='directory the samples were written to')
+    parser.add_argument('--top', type=int, default=20, help='lines per section (default: %(default)s)')
+    return parser
+
+
+def main(argv=None):
+    args = get_arg_parser().parse_args(argv)
+    report(args.directory, args.top)
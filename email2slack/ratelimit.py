@@ -0,0 +1,76 @@
+from __future__ import unicode_literals
+
+import time
+
+from .state import connect
+
+
+class RateLimiter(object):
+    """Token bucket per webhook url and channel, shared through a sqlite file.
+
+    Tokens are reserved inside an immediate transaction, so concurrent
+    processes queue up behind each other instead of all posting at once. The
+    bucket may go negative: that is the time already promised to others.
+    """
+
+    def __init__(self, path, rate=1.0, burst=3):
+        self.path = path
+        self.rate = float(rate)
+        self.burst = float(burst)
+        db = self.__connect()
+        try:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS bucket ('
+                'key TEXT PRIMARY KEY, tokens REAL, updated REAL, blocked_until REAL)'
+            )
+        finally:
+            db.close()
+
+    def __connect(self):
+        return connect(self.path)
+
+    def reserve(self, key):
+        """Take one token for key, returns seconds to wait before posting."""
+        db = self.__connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            row = db.execute('SELECT tokens, updated, blocked_until FROM bucket WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                tokens, blocked_until = self.burst, 0.0
+            else:
+                tokens = min(self.burst, row[0] + (now - row[1]) * self.rate)
+                blocked_until = row[2]
+            wait = max(0.0, (1.0 - tokens) / self.rate, blocked_until - now)
+            db.execute(
+                'INSERT OR REPLACE INTO bucket (key, tokens, updated, blocked_until) VALUES (?, ?, ?, ?)',
+                (key, tokens - 1.0, now, blocked_until)
+            )
+            db.execute('COMMIT')
+            return wait
+        finally:
+            db.close()
+
+    def acquire(self, key):
+        wait = self.reserve(key)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def block(self, key, seconds):
+        """Nobody posts to key for the next seconds, e.g. after 429 Retry-After."""
+        db = self.__connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            db.execute(
+                'INSERT OR IGNORE INTO bucket (key, tokens, updated, blocked_until) VALUES (?, ?, ?, 0)',
+                (key, self.burst, now)
+            )
+            db.execute(
+                'UPDATE bucket SET blocked_until = max(blocked_until, ?), tokens = min(tokens, 0) WHERE key = ?',
+                (now + seconds, key)
+            )
+            db.execute('COMMIT')
+        finally:
+            db.close()
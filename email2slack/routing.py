@@ -0,0 +1,196 @@
+from __future__ import unicode_literals
+
+import re
+
+# characters which are literal when not escaped
+LITERAL = re.compile(r'(?:[^\\.^$*+?{}\[\]|()]|\\[^A-Za-z0-9])*')
+CATCH_ALL = ('.*', '.*$', '')
+END_ANCHORS = ('$', r'\Z')
+# numbered back references and global inline flags change meaning when
+# patterns are joined into one alternation
+UNCOMBINABLE = re.compile(r'\\[1-9]|\(\?[aiLmsux]+\)')
+
+
+def unescape(pattern):
+    """Return the string pattern matches literally, or None if it is not a literal."""
+    if LITERAL.match(pattern).end() != len(pattern):
+        return None
+    return re.sub(r'\\(.)', r'\1', pattern)
+
+
+def classify(pattern):
+    """Return ('exact', address), ('domain', domain), ('all', None) or ('regex', None).
+
+    Only patterns which re.match() evaluates exactly like the lookup are
+    classified, everything else stays a regular expression.
+    """
+    if pattern in CATCH_ALL:
+        return 'all', None
+    for anchor in END_ANCHORS:
+        if not pattern.endswith(anchor) or pattern.endswith('\\' + anchor):
+            continue
+        body = pattern[:-len(anchor)]
+        if body.startswith('.*@'):
+            domain = unescape(body[3:])
+            if domain and '@' not in domain and '\n' not in domain:
+                return 'domain', domain
+        address = unescape(body)
+        if address and '\n' not in address:
+            return 'exact', address
+    return 'regex', None
+
+
+class Router(object):
+    """Ordered (pattern, value) rules matched with re.match against an address.
+
+    Exact-address and '.*@domain$' rules are answered from hash tables, all
+    other rules share one alternation regex; since alternatives are tried in
+    order, its match is the first matching rule. The first matching rule in
+    declaration order wins, as with a linear scan.
+    """
+
+    def __init__(self, rules):
+        self.rules = [(p, v) for p, v in rules]
+        self.exact = {}
+        self.domain = {}
+        self.catch_all = None
+        regex = []
+        for i, (pattern, value) in enumerate(self.rules):
+            kind, key = classify(pattern)
+            if kind == 'exact':
+                self.exact.setdefault(key, i)
+            elif kind == 'domain':
+                self.domain.setdefault(key, i)
+            elif kind == 'all':
+                if self.catch_all is None:
+                    self.catch_all = i
+            else:
+                regex.append(i)
+        self.regex = regex
+        self.first_regex = regex[0] if regex else len(self.rules)
+        self.__combined = None
+        self.__compiled = None
+
+    @property
+    def combined(self):
+        if self.__combined is None and self.regex:
+            if any(UNCOMBINABLE.search(self.rules[i][0]) for i in self.regex):
+                self.__combined = False
+                return False
+            try:
+                self.__combined = re.compile('|'.join(
+                    '(?P<_r{:d}>{:s})'.format(i, self.rules[i][0]) for i in self.regex
+                ))
+            except re.error:
+                # e.g. a group name clashing with ours
+                self.__combined = False
+        return self.__combined
+
+    @property
+    def compiled(self):
+        if self.__compiled is None:
+            self.__compiled = [re.compile(p) for p, v in self.rules]
+        return self.__compiled
+
+    def index(self, address):
+        """Index of the first rule matching address, or None."""
+        if '\n' in address:
+            return next((i for i, r in enumerate(self.compiled) if r.match(address)), None)
+        best = self.catch_all
+        i = self.exact.get(address)
+        if i is not None and (best is None or i < best):
+            best = i
+        if self.domain and '@' in address:
+            i = self.domain.get(address.rsplit('@', 1)[1])
+            if i is not None and (best is None or i < best):
+                best = i
+        if best is not None and best < self.first_regex:
+            return best
+
+        combined = self.combined
+        if combined is False:
+            for i in self.regex:
+                if best is not None and i > best:
+                    break
+                if self.compiled[i].match(address):
+                    return i
+            return best
+        if combined is not None:
+            m = combined.match(address)
+            if m:
+                i = int(m.lastgroup[2:])
+                if best is None or i < best:
+                    best = i
+        return best
+
+    def match(self, address):
+        """Value of the first matching rule, or None."""
+        i = self.index(address)
+        return None if i is None else self.rules[i][1]
+
+    def match_all(self, address):
+        """Values of every matching rule in declaration order."""
+        return [v for (p, v), r in zip(self.rules, self.compiled) if r.match(address)]
+
+    def __len__(self):
+        return len(self.rules)
+
+
+def trie_pattern(trie):
+    """Regular expression matching the longest path of trie from its root to a keyword end."""
+    alternatives = [re.escape(c) + trie_pattern(child) for c, child in sorted(trie.items()) if c]
+    if not alternatives:
+        return ''
+    pattern = alternatives[0] if len(alternatives) == 1 else '(?:{:s})'.format('|'.join(alternatives))
+    return '(?:{:s})?'.format(pattern) if '' in trie else pattern
+
+
+class KeywordRouter(object):
+    """Ordered (keyword, value) rules matched anywhere in a text, ignoring case.
+
+    The keywords are put in a trie, as the goto function of an Aho-Corasick
+    automaton, which is compiled to one regular expression: re walks the trie
+    from every position of the text in a single scan, instead of a search per
+    keyword. A match at a position stands for the keywords on its path too,
+    like the output function of the automaton.
+    """
+
+    def __init__(self, rules):
+        self.rules = [(k.lower(), v) for k, v in rules if k]
+        trie = {}
+        for keyword, value in self.rules:
+            node = trie
+            for c in keyword:
+                node = node.setdefault(c, {})
+            node[''] = True
+        self.__regex = re.compile('(?=({:s}))'.format(trie_pattern(trie)), re.DOTALL) if self.rules else None
+        self.__outputs = {}
+
+    def outputs(self, match):
+        """Indexes of the rules whose keyword is a prefix of match, i.e. on its path."""
+        if match not in self.__outputs:
+            self.__outputs[match] = frozenset(
+                i for i, (k, v) in enumerate(self.rules) if match.startswith(k)
+            )
+        return self.__outputs[match]
+
+    def indexes(self, text):
+        """Sorted indexes of the rules whose keyword is in text."""
+        if self.__regex is None:
+            return []
+        found = set()
+        for m in self.__regex.finditer(text.lower()):
+            found.update(self.outputs(m.group(1)))
+        return sorted(found)
+
+    def match(self, text):
+        """Value of the first rule whose keyword is in text, or None."""
+        indexes = self.indexes(text)
+        return self.rules[indexes[0]][1] if indexes else None
+
+    def match_all(self, text):
+        """Values of every rule whose keyword is in text, in declaration order."""
+        return [self.rules[i][1] for i in self.indexes(text)]
+
+    def __len__(self):
+        return len(self.rules)
@@ -0,0 +1,432 @@
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import copy
+import io
+import logging
+import os
+import shlex
+import socket
+import stat
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from . import config
+from . import transport
+from .compat import *
+from .parser import MAX_MESSAGE_BYTES, READ_SIZE, EmailParser
+from .profiling import NULL_PROFILER
+from .slack import Slack
+
+logger = logging.getLogger(__name__)
+# longest command line of a pipe client
+MAX_ARGV_BYTES = 65536
+# Slack instances kept for distinct client overrides, the least recently used is dropped
+MAX_INSTANCES = 32
+
+
+class UsageError(Exception):
+    pass
+
+
+class ArgumentParser(argparse.ArgumentParser):
+    """Parser for the command lines of clients, which must not exit the daemon."""
+
+    def error(self, message):
+        raise UsageError(message)
+
+    def exit(self, status=0, message=None):
+        raise UsageError(message or 'exit status {:d}'.format(status))
+
+
+class Forwarder(object):
+    """Runs the EmailParser -> Slack pipeline on a pool of worker threads.
+
+    One Slack instance is kept per distinct set of client overrides, up to
+    MAX_INSTANCES of them, so the configuration is only read once for each
+    of them. reload() replaces
+    the instances whose configuration files changed; a mail keeps the
+    instance it started with, so it is finished with the old configuration.
+    """
+
+    def __init__(self, args, workers=4, slack_factory=Slack):
+        self.args = args
+        self.pool = ThreadPool(workers)
+        self.slack_factory = slack_factory
+        self.__slack = OrderedDict()
+        self.__args = {}
+        self.__failed = {}  # key: stamp of a configuration which failed to load
+        self.__lock = threading.Lock()
+        self.__closed = threading.Event()
+        self.__watcher = None
+
+    def parse_args(self, argv=None):
+        """Return the options of a client command line, raises UsageError if it is invalid.
+
+        Clients may only override where a mail goes (-s, -t and -c), the
+        configuration file, spool and profile directories are the daemon's.
+        Parse in the thread of the connection, argparse must not run on the
+        pool: a SystemExit would kill the worker and the mail would never
+        be answered.
+        """
+        if not argv:
+            return self.args
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument('-s', '--slack')
+        parser.add_argument('-t', '--team')
+        parser.add_argument('-c', '--channel')
+        overrides = parser.parse_args(argv)
+        args = copy.copy(self.args)
+        for name in ('slack', 'team', 'channel'):
+            if getattr(overrides, name) is not None:
+                setattr(args, name, getattr(overrides, name))
+        return args
+
+    def get_slack(self, args=None):
+        if args is None:
+            args = self.args
+        key = (args.slack, args.team, args.channel)
+        with self.__lock:
+            if key in self.__slack:
+                slack = self.__slack.pop(key)
+            else:
+                slack = self.slack_factory(args)
+                self.__args[key] = args
+                if len(self.__slack) >= MAX_INSTANCES:
+                    oldest, _ = self.__slack.popitem(last=False)
+                    del self.__args[oldest]
+                    self.__failed.pop(oldest, None)
+            self.__slack[key] = slack
+            return slack
+
+    def reload(self):
+        """Rebuild the Slack instances whose configuration files changed, returns how many were."""
+        with self.__lock:
+            current = [(key, self.__args[key], self.__slack[key]) for key in self.__slack]
+        reloaded = 0
+        for key, args, slack in current:
+            stamp = config.get_stamp(config.candidates(args))
+            if stamp == getattr(slack, 'stamp', stamp) or stamp == self.__failed.get(key):
+                continue
+            # built outside the lock, mails keep being forwarded meanwhile
+            try:
+                replacement = self.slack_factory(args)
+            except Exception:
+                logger.exception('keeping the previous configuration, failed to load the new one')
+                self.__failed[key] = stamp
+                continue
+            with self.__lock:
+                if key not in self.__slack:
+                    continue  # dropped from the cache meanwhile
+                self.__slack[key] = replacement
+            reloaded += 1
+        if reloaded:
+            logger.info('configuration reloaded')
+        return reloaded
+
+    def watch(self, interval):
+        """Check the configuration files every interval seconds in a background thread."""
+        def run():
+            while not self.__closed.wait(interval):
+                try:
+                    self.reload()
+                except Exception:
+                    logger.exception('failed to check the configuration')
+
+        self.__watcher = threading.Thread(target=run)
+        self.__watcher.daemon = True
+        self.__watcher.start()
+
+    def max_bytes(self, args=None):
+        """Bytes of a mail kept for EmailParser, None for all of them."""
+        try:
+            slack = self.get_slack(args)
+        except Exception:
+            # forwarding fails the same way, and tells why
+            return MAX_MESSAGE_BYTES
+        return getattr(slack, 'limits', {}).get('max_total_bytes', MAX_MESSAGE_BYTES)
+
+    def forward(self, data, args=None):
+        slack = self.get_slack(args)
+        with getattr(slack, 'profiler', NULL_PROFILER).sample() as sample:
+            mail = EmailParser.parse(
+                io.BytesIO(data), detector=getattr(slack, 'detector', None), **getattr(slack, 'limits', {}))
+            sample.tag(mail)
+            slack.notify(mail)
+
+    def process(self, data, args=None):
+        return self.pool.apply(self.forward, (data, args))
+
+    def close(self):
+        self.__closed.set()
+        if self.__watcher is not None:
+            self.__watcher.join()
+        self.pool.close()
+        self.pool.join()
+        logger.info('http: %s', transport.stats())
+
+
+class MailHandler(compat_socketserver.StreamRequestHandler):
+    """Speaks just enough LMTP (RFC 2033) or SMTP to accept a message."""
+
+    def reply(self, *lines):
+        for i, line in enumerate(lines):
+            code, text = line.split(' ', 1)
+            sep = '-' if i < len(lines) - 1 else ' '
+            self.wfile.write('{:s}{:s}{:s}\r\n'.format(code, sep, text).encode('ascii'))
+        self.wfile.flush()
+
+    def read_data(self, limit=None):
+        """Read DATA up to the final dot, keeping its first limit bytes."""
+        lines = []
+        total = 0
+        start = True  # at the start of a line, not in a line longer than READ_SIZE
+        while True:
+            line = self.rfile.readline(READ_SIZE)
+            if not line:
+                return None
+            if start and line in (b'.\r\n', b'.\n'):
+                return b''.join(lines)
+            if start and line.startswith(b'.'):
+                line = line[1:]
+            start = line.endswith(b'\n')
+            if limit is not None:
+                # past the limit, keep reading up to the final dot
+                line = line[:max(limit - total, 0)]
+            total += len(line)
+            if line:
+                lines.append(line)
+
+    def handle(self):
+        lmtp = self.server.lmtp
+        hostname = self.server.hostname
+        sender = None
+        recipients = []
+
+        self.reply('220 {:s} {:s} email2slack ready'.format(hostname, 'LMTP' if lmtp else 'ESMTP'))
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode('ascii', 'replace').rstrip('\r\n')
+            verb = line.split(' ', 1)[0].upper()
+
+            if verb == 'LHLO' and lmtp or verb == 'EHLO' and not lmtp:
+                self.reply('250 {:s}'.format(hostname), '250 PIPELINING', '250 8BITMIME', '250 ENHANCEDSTATUSCODES')
+            elif verb == 'HELO' and not lmtp:
+                self.reply('250 {:s}'.format(hostname))
+            elif verb == 'MAIL':
+                sender = line[5:].strip()
+                recipients = []
+                self.reply('250 2.1.0 Ok')
+            elif verb == 'RCPT':
+                if sender is None:
+                    self.reply('503 5.5.1 Error: need MAIL command')
+                    continue
+                recipients.append(line[5:].strip())
+                self.reply('250 2.1.5 Ok')
+            elif verb == 'DATA':
+                if not recipients:
+                    self.reply('503 5.5.1 Error: need RCPT command')
+                    continue
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = self.read_data(self.server.forwarder.max_bytes())
+                if data is None:
+                    return
+                try:
+                    self.server.forwarder.process(data)
+                    status = '250 2.0.0 Ok'
+                except Exception:
+                    logger.exception('failed to forward message from %s', sender)
+                    status = '451 4.3.0 Error: local error in processing'
+                # LMTP answers once per accepted recipient, SMTP once per message
+                self.reply(*([status] * (len(recipients) if lmtp else 1)))
+                sender = None
+                recipients = []
+            elif verb == 'RSET':
+                sender = None
+                recipients = []
+                self.reply('250 2.0.0 Ok')
+            elif verb == 'NOOP':
+                self.reply('250 2.0.0 Ok')
+            elif verb == 'VRFY':
+                self.reply('252 2.5.2 Cannot VRFY user')
+            elif verb == 'QUIT':
+                self.reply('221 2.0.0 Bye')
+                return
+            else:
+                self.reply('502 5.5.2 Error: command not recognized')
+
+
+class PipeHandler(compat_socketserver.StreamRequestHandler):
+    """Counterpart of email2slack.client.
+
+    The client sends its command line as one shell-quoted line followed by the
+    raw message until EOF, and waits for a single 'OK' or 'ERR reason' line.
+    """
+
+    def handle(self):
+        line = self.rfile.readline(MAX_ARGV_BYTES).decode('utf-8', 'replace')
+        try:
+            if line and not line.endswith('\n'):
+                raise UsageError('command line too long')
+            # ValueError: shlex could not split the line
+            args = self.server.forwarder.parse_args(shlex.split(line))
+        except (UsageError, ValueError) as e:
+            logger.error('bad command line from pipe client: %s', e)
+            self.read_data(0)
+            self.answer('ERR usage: {!s}'.format(e))
+            return
+        try:
+            self.server.forwarder.process(self.read_data(self.server.forwarder.max_bytes(args)), args)
+            status = 'OK'
+        except Exception as e:
+            logger.exception('failed to forward message from pipe client')
+            status = 'ERR {!s}'.format(e)
+        self.answer(status)
+
+    def read_data(self, limit=None):
+        """Read the message to EOF, keeping its first limit bytes."""
+        blocks = []
+        total = 0
+        while True:
+            block = self.rfile.read(READ_SIZE)
+            if not block:
+                return b''.join(blocks)
+            if limit is not None:
+                # past the limit, keep reading so that the client does not get EPIPE
+                block = block[:max(limit - total, 0)]
+            total += len(block)
+            if block:
+                blocks.append(block)
+
+    def answer(self, status):
+        self.wfile.write('{:s}\n'.format(status.replace('\n', ' ')).encode('utf-8'))
+
+
+class ServerMixin(object):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, forwarder, handler=MailHandler, protocol='LMTP'):
+        self.forwarder = forwarder
+        self.protocol = protocol
+        self.lmtp = protocol == 'LMTP'
+        self.hostname = socket.getfqdn()
+        compat_socketserver.TCPServer.__init__(self, address, handler)
+
+
+class TCPServer(ServerMixin, compat_socketserver.ThreadingMixIn, compat_socketserver.TCPServer):
+    pass
+
+
+def remove_socket(path):
+    """Remove the unix domain socket at path, returns False if something else is there."""
+    try:
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            return False
+        os.unlink(path)
+    except OSError:
+        if os.path.lexists(path):
+            raise
+    return True
+
+
+if hasattr(compat_socketserver, 'UnixStreamServer'):
+    class UnixServer(ServerMixin, compat_socketserver.ThreadingMixIn, compat_socketserver.UnixStreamServer):
+        def server_bind(self):
+            if not remove_socket(self.server_address):
+                raise Exception('not a socket, refusing to replace it: {:s}'.format(self.server_address))
+            compat_socketserver.UnixStreamServer.server_bind(self)
+else:
+    UnixServer = None
+
+
+def make_server(address, forwarder, protocol='LMTP'):
+    """address is either HOST:PORT or a path to a unix domain socket.
+
+    protocol is one of LMTP, SMTP or PIPE (see email2slack.client).
+    """
+    handler = PipeHandler if protocol == 'PIPE' else MailHandler
+    if '/' in address:
+        if UnixServer is None:
+            raise Exception('unix domain sockets are not supported on this platform')
+        return UnixServer(address, forwarder, handler=handler, protocol=protocol)
+    host, _, port = address.rpartition(':')
+    return TCPServer((host or '127.0.0.1', int(port)), forwarder, handler=handler, protocol=protocol)
+
+
+def get_arg_parser():
+    from . import get_arg_parser as get_common_arg_parser
+    parser = get_common_arg_parser(add_help=False)
+    parser.prog = 'email2slack serve'
+    parser.add_argument('-h', '--help', action='help', help='show this help message and exit')
+    parser.add_argument(
+        '--lmtp',
+        help='accept LMTP on this address, HOST:PORT or /path/to/socket'
+    )
+    parser.add_argument(
+        '--smtp',
+        help='accept SMTP on this address, HOST:PORT or /path/to/socket'
+    )
+    parser.add_argument(
+        '--socket',
+        help='accept messages from email2slack-client on this unix domain socket'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=4,
+        help='number of messages processed concurrently (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--reload-interval', type=float, default=5,
+        help='seconds between checks for changed config files, 0 disables reloading (default: %(default)s)'
+    )
+    return parser
+
+
+def serve(servers):
+    threads = []
+    for server in servers:
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    try:
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+            if isinstance(server.server_address, str):
+                remove_socket(server.server_address)
+
+
+def main(argv=None):
+    args = get_arg_parser().parse_args(argv)
+    if not (args.lmtp or args.smtp or args.socket):
+        args.lmtp = '127.0.0.1:8024'
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    forwarder = Forwarder(args, workers=args.workers)
+    forwarder.get_slack()
+    if args.reload_interval > 0:
+        forwarder.watch(args.reload_interval)
+    servers = []
+    if args.lmtp:
+        servers.append(make_server(args.lmtp, forwarder, protocol='LMTP'))
+    if args.smtp:
+        servers.append(make_server(args.smtp, forwarder, protocol='SMTP'))
+    if args.socket:
+        servers.append(make_server(args.socket, forwarder, protocol='PIPE'))
+    for server in servers:
+        logger.info('listening on %s (%s)', server.server_address, server.protocol)
+    try:
+        serve(servers)
+    finally:
+        forwarder.close()
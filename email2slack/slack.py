@@ -1,216 +1,438 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import os
-import re
-from email.utils import parseaddr, getaddresses
+import logging
+import sys
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parseaddr
 
-import requests
-from bs4 import BeautifulSoup
+from . import charset
+from . import config
+from . import htmltext
+from . import metrics
+from . import profiling
+from .chunker import CHUNKS_PER_POST, Chunker, html_escape
+from .dedup import DedupStore
+from .digest import DigestStore
+from .ratelimit import RateLimiter
+from .spool import Spool
+from .state import state_path
+from .transport import get_transport
+from .upload import UPLOAD, Uploader, filename_for
 
-try:
-    import lxml
-    HTMLParser = 'lxml'
-except ImportError:
-    HTMLParser = 'html5lib'
+logger = logging.getLogger(__name__)
 
-from .compat import *
+
+class DeliveryError(Exception):
+    """Posting to some destinations failed, the others were posted.
+
+    failed maps the (webhook url, channel) of the failed posts to their error.
+    """
+
+    def __init__(self, failed):
+        Exception.__init__(self, '; '.join(
+            '{:s}: {!s}'.format(channel or url, e) for (url, channel), e in failed.items()
+        ))
+        self.failed = failed
 
 
 class Slack(object):
     __debug = False
 
     def __init__(self, args):
-        cfg = compat_configparser()
-        candidate = [
-            'email2slack',
-            os.path.expanduser('~/.email2slack'),
-            '/etc/email2slack',
-            '/usr/local/etc/email2slack'
-        ]
-        if args.config:
-            candidate.insert(0, args.config)
-        cfg.read(candidate)
+        snapshot = config.load(args)
+        cfg = snapshot.config
+        # what the configuration was read from, to notice changes
+        self.stamp = snapshot.stamp
 
         Slack.__debug = args.debug
-        default_slack = args.slack
-        default_team = args.team
-        default_channel = args.channel
-
-        slack = {}
-        if cfg.has_section('Team'):
-            for name, url in cfg.items('Slack'):
-                if name == 'default' and default_slack:
-                    url = default_slack
-                    default_slack = None
-                slack[name] = url
-        if default_slack:
-            slack['default'] = default_slack
-
-        self.__team = []
-        if cfg.has_section('Team'):
-            for pattern, team in cfg.items('Team'):
-                if pattern == 'default':
-                    pattern = r'.*'
-                    if default_team:
-                        team = default_team
-                        default_team = None
-                self.__team.append((re.compile(pattern), slack[team]))
-        if default_team and default_team in slack:
-            self.__team.append((re.compile(r'.*'), slack[default_team]))
-        if len(self.__team) == 0 and 'default' in slack:
-            self.__team.append((re.compile(r'.*'), slack['default']))
-
-        self.__channel = []
-        if cfg.has_section('Channel'):
-            for pattern, channel in cfg.items('Channel'):
-                if pattern == 'default':
-                    pattern = r'.*'
-                    if default_channel:
-                        channel = default_channel
-                        default_channel = None
-                self.__channel.append((re.compile(pattern), channel))
-        if default_channel:
-            self.__channel.append((re.compile(r'.*'), default_channel))
+        self.__team = snapshot.team
+        self.__channel = snapshot.channel
 
         self.flags = {}
         if cfg.has_option('Flags', 'pretext'):
             self.flags['pretext'] = cfg.getboolean('Flags', 'pretext')
-        self.mime_part = {}
-        if cfg.has_section('MIME Part'):
-            self.mime_part = [(re.compile(x[0]), x[1]) for x in cfg.items('MIME Part')]
-        self.pretext = []
-        if cfg.has_section('PreText'):
-            self.pretext = [(re.compile(x[0]), x[1]) for x in cfg.items('PreText')]
+        if cfg.has_option('Flags', 'fanout'):
+            self.flags['fanout'] = cfg.getboolean('Flags', 'fanout')
+        self.mime_part = snapshot.mime_part
+        self.pretext = snapshot.pretext
+        self.digest_from = snapshot.digest_from
+        self.digest_subject = snapshot.digest_subject
+        self.subject_route = snapshot.subject_route
+        self.from_route = snapshot.from_route
+        self.body_route = snapshot.body_route
+
+        # keyword arguments for EmailParser.parse
+        self.limits = {}
+        if cfg.has_option('Limits', 'max_message_bytes'):
+            self.limits['max_total_bytes'] = cfg.getint('Limits', 'max_message_bytes') or None
+        if cfg.has_option('Limits', 'max_part_bytes'):
+            self.limits['max_part_bytes'] = cfg.getint('Limits', 'max_part_bytes') or None
+        self.chunks_per_post = CHUNKS_PER_POST
+        if cfg.has_option('Limits', 'chunks_per_post'):
+            self.chunks_per_post = max(cfg.getint('Limits', 'chunks_per_post'), 1)
+        # how much of the body [Body Route] keywords are looked for in
+        self.route_body_chars = 4096
+        if cfg.has_option('Limits', 'route_body_chars'):
+            self.route_body_chars = cfg.getint('Limits', 'route_body_chars')
+
+        # EmailParser is stateless, it is given this instance's charset detector
+        detector = {}
+        if cfg.has_option('Charset', 'detector'):
+            detector['backend'] = cfg.get('Charset', 'detector')
+        if cfg.has_option('Charset', 'sample_size'):
+            detector['sample'] = cfg.getint('Charset', 'sample_size')
+        self.detector = charset.Detector(**detector)
+        self.html_converter = None
+        if cfg.has_option('HTML', 'converter'):
+            self.html_converter = htmltext.check_converter(cfg.get('HTML', 'converter'))
+
+        export = {}
+        if cfg.has_option('Metrics', 'textfile'):
+            export['textfile'] = cfg.get('Metrics', 'textfile')
+        if cfg.has_option('Metrics', 'statsd'):
+            host, port = cfg.get('Metrics', 'statsd').rsplit(':', 1)
+            export['statsd'] = (host, int(port))
+        if cfg.has_option('Metrics', 'prefix'):
+            export['prefix'] = cfg.get('Metrics', 'prefix')
+        # the recorder is process wide, the first configuration keeps it
+        if export and not metrics.configure(state_path(cfg, 'metrics.sqlite'), replace=False, **export):
+            logger.warning('[Metrics] changed, it only takes effect after a restart')
+
+        http = {}
+        if cfg.has_option('HTTP', 'pool_size'):
+            http['pool_size'] = cfg.getint('HTTP', 'pool_size')
+        if cfg.has_option('HTTP', 'connect_timeout'):
+            http['connect_timeout'] = cfg.getfloat('HTTP', 'connect_timeout')
+        if cfg.has_option('HTTP', 'read_timeout'):
+            http['read_timeout'] = cfg.getfloat('HTTP', 'read_timeout')
+        if cfg.has_option('HTTP', 'keep_alive'):
+            http['keep_alive'] = cfg.getboolean('HTTP', 'keep_alive')
+        self.transport = get_transport(**http)
+
+        self.retries = 3
+        if cfg.has_option('Rate Limit', 'retries'):
+            self.retries = cfg.getint('Rate Limit', 'retries')
+
+        self.uploader = None
+        self.upload_threshold = 40000
+        if cfg.has_option('Upload', 'token'):
+            upload = {'retries': self.retries}
+            if cfg.has_option('Upload', 'api_url'):
+                upload['api_url'] = cfg.get('Upload', 'api_url')
+            self.uploader = Uploader(self.transport, cfg.get('Upload', 'token'), **upload)
+            if cfg.has_option('Upload', 'threshold'):
+                self.upload_threshold = cfg.getint('Upload', 'threshold')
+        self.ratelimit = None
+        if not args.debug and (not cfg.has_option('Rate Limit', 'enabled') or
+                               cfg.getboolean('Rate Limit', 'enabled')):
+            limit = {}
+            if cfg.has_option('Rate Limit', 'rate'):
+                limit['rate'] = cfg.getfloat('Rate Limit', 'rate')
+            if cfg.has_option('Rate Limit', 'burst'):
+                limit['burst'] = cfg.getint('Rate Limit', 'burst')
+            self.ratelimit = RateLimiter(state_path(cfg, 'ratelimit.sqlite'), **limit)
+
+        self.dedup = None
+        if not args.debug and (not cfg.has_option('Dedup', 'enabled') or cfg.getboolean('Dedup', 'enabled')):
+            store = {}
+            if cfg.has_option('Dedup', 'ttl'):
+                store['ttl'] = cfg.getfloat('Dedup', 'ttl')
+            if cfg.has_option('Dedup', 'max_entries'):
+                store['max_entries'] = cfg.getint('Dedup', 'max_entries')
+            self.dedup = DedupStore(state_path(cfg, 'dedup.sqlite'), **store)
+
+        self.digest = None
+        if not args.debug and (snapshot.tables['digest_from'] or snapshot.tables['digest_subject']):
+            self.digest = DigestStore(state_path(cfg, 'digest.sqlite'))
+
+        self.profiler = profiling.NULL_PROFILER
+        if getattr(args, 'profile', None):
+            self.profiler = profiling.Profiler(args.profile)
+        elif cfg.has_option('Profile', 'directory'):
+            profile = {'rate': 0.01}
+            if cfg.has_option('Profile', 'sample'):
+                profile['rate'] = cfg.getfloat('Profile', 'sample')
+            if cfg.has_option('Profile', 'memory'):
+                profile['memory'] = cfg.getboolean('Profile', 'memory')
+            self.profiler = profiling.Profiler(cfg.get('Profile', 'directory'), **profile)
+
+        spool = getattr(args, 'spool', None)
+        if not spool and cfg.has_option('Spool', 'directory'):
+            spool = cfg.get('Spool', 'directory')
+        self.spool = Spool(spool) if spool else None
 
     def notify(self, mail):
+        try:
+            if self.digest:
+                self.flush_digests()
+            claimed, destinations = self.claim(mail['Message-ID'], self.route(mail))
+            if not destinations:
+                return
+            window = self.digest_window(mail)
+            if window is not None:
+                self.digest.hold(destinations, mail['Subject'], window)
+                metrics.count('email2slack_digested_total', len(destinations))
+                return
+            try:
+                self.deliver(self.build(mail, destinations))
+            except Exception as e:
+                # let a retry of the MTA post it again where it failed
+                self.release(self.failed_keys(claimed, destinations, e))
+                raise
+        finally:
+            metrics.flush()
 
-        def html_escape(text):
-            return text \
-                .replace('&', '&amp;') \
-                .replace('<', '&lt;') \
-                .replace('>', '&gt;')
-
-        def get_html_text(html):
-            soup = BeautifulSoup(html, HTMLParser)
-            for e in soup(['style', 'script', '[document]', 'head', 'title']):
-                e.extract()
-            for br in soup.find_all("br"):
-                br.replace_with("\n")
-            for td in soup.find_all("td"):
-                td.replace_with(td.get_text() + " ")
-            for tr in soup.find_all("tr"):
-                tr.replace_with(tr.get_text() + "\n")
-            for p in soup.find_all("p"):
-                p.replace_with(p.get_text() + "\n")
-            return re.sub('\n{2,}', '\n\n', soup.get_text()).lstrip('\n')
-
-        def increment_of_url(text):
-            URL_PATTERN = r'(https?://[-\w\d:#@%/;$()~_?+=.&]*)'
-            DOMAINURL_PATTERN = r'(\b(?:[\w\d][-\w\d]+?\.)+\w{2,4}\b)'
-            urls = re.findall(URL_PATTERN, text)
-            domains = re.findall(DOMAINURL_PATTERN, text)
-            return len(urls) * len('<>') + len(''.join(domains)) + len(urls) * len('<http://|>')
-
-        def increment_of_callto(text):
-            return len(re.findall(r'\b(\d{3}-\d{3}-\d{4}|\d{4}-\d{3}-\d{4})\b', text)) * len('<callto:>')
-
-        def increment_of_mailaddr(text):
-            addrs = [
-                a for n, a in getaddresses(
-                    [x for x in re.sub(r'<mailto:[^>]+>', '', text).replace(' ', '\n').splitlines() if x.find('@') > 1]
-                )
-            ]
-            return len(''.join(addrs)) + len(addrs) * len('<mailto:|>')
+    def claim(self, message_id, destinations):
+        """Return (keys, destinations) for the destinations message_id was not posted to yet.
+
+        keys are to be passed to release() if posting fails.
+        """
+        if not self.dedup or not message_id:
+            return [], destinations
+        keys = self.dedup_keys(message_id, destinations)
+        claimed = self.dedup.claim(keys)
+        metrics.count('email2slack_duplicates_total', len(destinations) - len(claimed))
+        destination = dict(zip(keys, destinations))
+        return claimed, [destination[k] for k in claimed]
+
+    @staticmethod
+    def dedup_keys(message_id, destinations):
+        return ['{:s}\n{:s}\n{:s}'.format(message_id, u, c) for u, c in destinations]
+
+    def release(self, keys):
+        if keys:
+            self.dedup.release(keys)
 
+    @staticmethod
+    def failed_keys(keys, destinations, error):
+        """Return the keys of claim() to release after deliver() raised error.
+
+        keys go with destinations. A DeliveryError tells which destinations
+        failed, any other error may have happened anywhere.
+        """
+        if not isinstance(error, DeliveryError):
+            return keys
+        # uploads go by channel only, whatever the webhook
+        return [k for k, (u, c) in zip(keys, destinations) if (u, c) in error.failed or (UPLOAD, c) in error.failed]
+
+    def deliver(self, posts):
+        """Post or spool the (webhook url, payload) list returned by build().
+
+        With fanout, every destination is tried before DeliveryError is raised.
+        """
+        if self.spool:
+            self.spool.put(posts)
+            return
+        if self.flags.get('fanout') and not Slack.__debug and sys.version_info >= (3, 5):
+            from . import fanout
+            failed = fanout.deliver(posts, self.__post)
+            if failed:
+                raise DeliveryError(failed)
+            return
+        for url, payload in posts:
+            self.__post(url, payload)
+
+    def digest_window(self, mail):
+        """Seconds mail is held for a digest, None to post it now."""
+        if not self.digest:
+            return None
+        window = self.digest_from.match(parseaddr(mail['From'])[1])
+        if window is None:
+            # option names, hence patterns, are lower case
+            window = self.digest_subject.match(mail['Subject'].lower())
+        return None if window is None else float(window)
+
+    def flush_digests(self):
+        """Post the digests whose window is over."""
+        for digest in self.digest.take_due():
+            try:
+                self.deliver(self.build_digest(digest))
+            except Exception as e:
+                # keep them for the next attempt, the mail being notified is not at fault
+                logger.warning('failed to post digest to %s: %s', digest[1], e)
+                self.digest.restore(digest)
+                continue
+            metrics.count('email2slack_digests_total')
+
+    def build_digest(self, digest):
+        """Return the (webhook url, payload) list for a digest returned by DigestStore.take_due()."""
+        url, channel, started, last, entries = digest
+        total = sum(count for subject, count in entries)
+        text = '*Digest*: {:d} mails from {:s} to {:s}\n'.format(
+            total, formatdate(started, localtime=True), formatdate(last, localtime=True)
+        )
+        body = ''.join('{:d} x {:s}\n'.format(count, subject) for subject, count in entries)
+        footer = 'Posted by email2slack. Digest of {:d} mails.'.format(total)
+        chunker = Chunker(body)
+        if chunker.fits(text):
+            return [(url, self.__payload(
+                '{:s}```{:s}```\n'.format(html_escape(text), chunker.escaped), channel=channel, footer=footer
+            ))]
+        messages = [
+            '{:s}```{:s}```'.format(html_escape(heading), chunk)
+            for heading, chunk in chunker.chunks(text, 'continued: digest\n')
+        ]
+        return self.__plan([(url, channel)], messages, footer)
+
+    def send(self, url, payload):
+        """Post one payload built by build(), returns the HTTP response (None in debug mode)."""
+        return self.__post(url, payload)
+
+    def route(self, mail):
+        """Return the (webhook url, channel) list mail goes to."""
         header_to = mail['To']
         address_to = parseaddr(header_to)[1]
+        with metrics.timer('routing'):
+            routes = self.content_routes(mail)
+            url = self.__team.match(address_to)
+            if url is None and (not routes or any(u is None for u, c in routes)):
+                raise Exception('team not found: {:s}'.format(header_to))
+            if routes:
+                # the keywords decide the channel, and the team if they name one
+                teams = self.__team.match_all(address_to) if self.flags.get('fanout') else [url]
+                destinations = []
+                for u, c in routes:
+                    for team in [u] if u else teams:
+                        if (team, c) not in destinations:
+                            destinations.append((team, c))
+                return destinations
+
+            channel = self.__channel.match(address_to)
+            if channel is None:
+                raise Exception('channel not found: {:s}'.format(header_to))
+
+            destinations = [(url, channel)]
+            if self.flags.get('fanout'):
+                for u in self.__team.match_all(address_to):
+                    for c in self.__channel.match_all(address_to):
+                        if (u, c) not in destinations:
+                            destinations.append((u, c))
+        return destinations
+
+    def content_routes(self, mail):
+        """Return the (webhook url or None, channel) list of the [Subject Route], [From Route] and [Body Route]
+        keywords found in mail, the first one only unless fanout is set.
+
+        Sections are tried in this order, and rules in order of declaration.
+        """
+        routes = []
+        for router, get_text in (
+                (self.subject_route, lambda: mail['Subject']),
+                (self.from_route, lambda: mail['From']),
+                (self.body_route, lambda: self.__route_body(mail)),
+        ):
+            if not router:
+                continue
+            for u, c in router.match_all(get_text()):
+                if not self.flags.get('fanout'):
+                    return [(u, c)]
+                if (u, c) not in routes:
+                    routes.append((u, c))
+        return routes
+
+    def __route_body(self, mail):
+        if mail['body-plain']:
+            return mail['body-plain'][:self.route_body_chars]
+        if mail['body-html']:
+            return htmltext.to_text(mail['body-html'], self.html_converter)[:self.route_body_chars]
+        return ''
+
+    def build(self, mail, destinations=None):
+        """Return the list of (webhook url, payload) to post for mail, in order.
+
+        destinations defaults to route(mail).
+        """
+        if destinations is None:
+            destinations = self.route(mail)
+        with metrics.timer('build'):
+            posts = self.__build(mail, destinations)
+        # a webhook call per post, uploads take three Web API calls
+        logger.debug('%d calls planned for %s', len(posts), mail['Message-ID'])
+        metrics.count('email2slack_mails_total')
+        metrics.count('email2slack_posts_total', len(posts))
+        return posts
+
+    def __build(self, mail, destinations):
+        header_to = mail['To']
         header_from = mail['From']
         address_from = parseaddr(header_from)[1]
         subject = mail['Subject']
         date = mail['Date']
         message_id = mail['Message-ID']
-        mime_part = [x[1] for x in self.mime_part if x[0].match(address_from)]
-        if len(mime_part) and mime_part[0] == 'html' and mail['body-html']:
-            body = get_html_text(mail['body-html'])
-            self.flags['pretext'] = False
+        pretext = self.flags.get('pretext', False)
+        mime_part = self.mime_part.match(address_from)
+        if mime_part == 'html' and mail['body-html']:
+            body = htmltext.to_text(mail['body-html'], self.html_converter)
+            pretext = False
         elif mail['body-plain']:
             body = mail['body-plain']
         elif mail['body-html']:
-            body = get_html_text(mail['body-html'])
+            body = htmltext.to_text(mail['body-html'], self.html_converter)
         else:
             body = ''
 
-        url = [r[1] for r in self.__team if r[0].match(address_to)]
-        if url is None:
-            raise Exception('team not found: {:s}'.format(header_to))
-
-        channel = [r[1] for r in self.__channel if r[0].match(address_to)]
-        if channel is None:
-            raise Exception('channel not found: {:s}'.format(header_to))
-
         text = '*Date*: {:s}\n*From*: {:s}\n*To*: {:s}\n*Subject*: {:s}\n'.format(date, header_from, header_to, subject)
-        msg_limit = 4000 \
-                    - len(html_escape(text)) \
-                    - increment_of_mailaddr(text) \
-                    - len('``````\n')
-        pretext = self.flags.get('pretext', False)
-        escaped = html_escape(body)
-        increment = increment_of_url(body) + increment_of_mailaddr(body) + increment_of_callto(body)
-        if not pretext or len(escaped) + increment <= msg_limit:
+        if self.uploader and len(body.encode('utf-8')) > self.upload_threshold:
+            # one file, whatever the length, instead of a post per chunk
+            comment = '{:s}Posted by email2slack. Original mail is {:s}.'.format(
+                html_escape(text), html_escape(message_id)
+            )
+            return [(UPLOAD, {
+                'channel': c,
+                'filename': filename_for(subject),
+                'title': subject,
+                'content': body,
+                'initial_comment': comment,
+            }) for c in OrderedDict((c, None) for u, c in destinations)]
+
+        chunker = Chunker(body)
+        if not pretext or chunker.fits(text):
+            metrics.count('email2slack_chunks_total')
             text = html_escape(text)
             if pretext:
-                text += '```{:s}```\n'.format(escaped)
+                text += '```{:s}```\n'.format(chunker.escaped)
             else:
-                text += '{:s}'.format(escaped)
-            self.__post(url[0], self.__payload(
+                text += '{:s}'.format(chunker.escaped)
+            return [(u, self.__payload(
                 text,
-                channel=channel[0],
+                channel=c,
                 footer='Posted by email2slack. Original mail is {:s}.'.format(html_escape(message_id))
-            ))
-            return
+            )) for u, c in destinations]
 
-        heading = text
+        messages = []
         continued = 'continued: {:s}\n'.format(subject)
+        for heading, chunk in chunker.chunks(text, continued):
+            metrics.count('email2slack_chunks_total')
+            messages.append('{:s}```{:s}```'.format(heading, chunk))
+        return self.__plan(
+            destinations, messages, 'Posted by email2slack. Original mail is {:s}.'.format(html_escape(message_id))
+        )
 
-        body = body.splitlines()
-        escaped = escaped.splitlines()
-        increment = [increment_of_url(x) + increment_of_mailaddr(x) + increment_of_callto(x) for x in body]
-
-        msg_limit = 4000 \
-                    - len(html_escape(heading)) \
-                    - increment_of_mailaddr(heading) \
-                    - len('``````\n')
-
-        while body:
-            i = 0
-            l = 0
-            lines = len(body)
-            while i < lines and l + len(escaped[i]) + increment[i] + 1 < msg_limit:
-                l += len(escaped[i]) + increment[i] + 1
-                i += 1
-            chunk = '\n'.join(escaped[0:i]) + '\n'
-            text = '{:s}```{:s}```'.format(heading, chunk)
-            self.__post(url[0], self.__payload(text, channel=channel[0]))
-            body = body[i:]
-            escaped = escaped[i:]
-            increment = increment[i:]
-            if not heading.startswith('continued:'):
-                heading = continued
-                msg_limit = 4000 \
-                            - len(html_escape(heading)) \
-                            - increment_of_mailaddr(heading) \
-                            - len('``````\n')
-        self.__post(url[0], self.__payload(
-            '',
-            channel=channel[0],
-            footer='Posted by email2slack. Original mail is {:s}.'.format(html_escape(message_id))
-        ))
+    def __plan(self, destinations, messages, footer):
+        """Return the (webhook url, payload) list carrying messages, then footer, to each destination.
+
+        A post takes up to chunks_per_post messages, the first one as its text
+        and the following ones as attachments, and the last post the footer,
+        which makes the fewest webhook calls for the mail.
+        """
+        posts = []
+        for start in range(0, len(messages), self.chunks_per_post):
+            group = messages[start:start + self.chunks_per_post]
+            last = start + self.chunks_per_post >= len(messages)
+            posts.extend((u, self.__payload(
+                group[0],
+                channel=c,
+                attachments=group[1:],
+                footer=footer if last else None
+            )) for u, c in destinations)
+        return posts
 
     @staticmethod
-    def __payload(text, username=None, channel=None, footer=None):
+    def __payload(text, username=None, channel=None, attachments=None, footer=None):
         result = {'text': text}
-        attachments = None
+        attachments = [{'text': t, 'mrkdwn_in': ['text']} for t in attachments or []] or None
 
         if username:
             result['username'] = username
@@ -219,20 +441,56 @@ class Slack(object):
         if footer:
             if attachments is None:
                 attachments = [{}]
-            attachments[0]["footer"] = footer
+            attachments[-1]["footer"] = footer
         if attachments:
             result['attachments'] = attachments
 
         return result
 
-    @staticmethod
-    def __post(url, body):
+    def __post(self, url, body):
         if Slack.__debug:
             print(body['channel'])
+            if url == UPLOAD:
+                print(body['initial_comment'])
+                print('[{:s}, {:d} characters]'.format(body['filename'], len(body['content'])))
+                return
             if body['text']:
                 print(body['text'])
-            if 'attachments' in body:
-                for k, v in body['attachments'][0].items():
-                    print(v)
+            for attachment in body.get('attachments', []):
+                if 'text' in attachment:
+                    print(attachment['text'])
+                if 'footer' in attachment:
+                    print(attachment['footer'])
+        elif url == UPLOAD:
+            if self.ratelimit:
+                self.ratelimit.acquire('{:s} {:s}'.format(url, body['channel']))
+            with metrics.timer('upload') as timer:
+                timer.bytes = len(body['content'])
+                self.uploader.upload(
+                    body['channel'], body['filename'], body['content'], body['title'], body['initial_comment']
+                )
+            metrics.count('email2slack_uploads_total')
         else:
-            requests.post(url, json=body)
+            key = '{:s} {!s}'.format(url, body.get('channel'))
+            for attempt in range(self.retries + 1):
+                if self.ratelimit:
+                    self.ratelimit.acquire(key)
+                with metrics.timer('post'):
+                    try:
+                        response = self.transport.post(url, json=body)
+                    except Exception:
+                        metrics.count('email2slack_http_responses_total', status='error')
+                        raise
+                metrics.count('email2slack_http_responses_total', status=response.status_code)
+                if response.status_code != 429:
+                    break
+                try:
+                    retry_after = float(response.headers.get('Retry-After', 1))
+                except ValueError:
+                    retry_after = 1.0
+                if self.ratelimit:
+                    self.ratelimit.block(key, retry_after)
+                else:
+                    time.sleep(retry_after)
+            response.raise_for_status()
+            return response
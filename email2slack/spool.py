@@ -0,0 +1,206 @@
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Spool(object):
+    """Maildir-like queue of notifications waiting to be posted.
+
+    Every entry is a JSON file holding the (url, payload) list built for one
+    mail. Entries are written to tmp/ and renamed into new/, a worker claims
+    one by renaming it into cur/ and removes it once everything is posted.
+    Entries which ran out of attempts are moved to failed/. They hold the
+    webhook URLs, so directories and files are only readable by the owner.
+    """
+    SUBDIRS = ('tmp', 'new', 'cur', 'failed')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.__count = 0
+        for path in [directory] + [os.path.join(directory, d) for d in self.SUBDIRS]:
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path, 0o700)
+                except OSError:
+                    if not os.path.isdir(path):
+                        raise
+
+    def path(self, subdir, name):
+        return os.path.join(self.directory, subdir, name)
+
+    def unique_name(self):
+        self.__count += 1
+        return '{:.6f}.P{:d}Q{:d}.{:s}'.format(time.time(), os.getpid(), self.__count, socket.gethostname())
+
+    def write(self, subdir, name, entry):
+        tmp = self.path('tmp', name)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with io.open(fd, 'w', encoding='utf-8') as fp:
+            fp.write(json.dumps(entry, ensure_ascii=False))
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(tmp, self.path(subdir, name))
+
+    def put(self, posts):
+        name = self.unique_name()
+        self.write('new', name, {
+            'created': time.time(),
+            'attempts': 0,
+            'not_before': 0,
+            'posts': posts,
+        })
+        return name
+
+    def claim(self, limit):
+        """Move up to limit entries which are due from new/ to cur/ and return them."""
+        claimed = []
+        now = time.time()
+        for name in sorted(os.listdir(os.path.join(self.directory, 'new'))):
+            if len(claimed) >= limit:
+                break
+            try:
+                with io.open(self.path('new', name), encoding='utf-8') as fp:
+                    entry = json.load(fp)
+            except (IOError, OSError, ValueError):
+                continue
+            if entry.get('not_before', 0) > now:
+                continue
+            try:
+                os.rename(self.path('new', name), self.path('cur', name))
+            except OSError:
+                continue  # claimed by another worker
+            try:
+                # recover() tells stale entries by mtime, which rename keeps
+                os.utime(self.path('cur', name), None)
+            except OSError:
+                pass
+            claimed.append((name, entry))
+        return claimed
+
+    def done(self, name):
+        os.unlink(self.path('cur', name))
+
+    def retry(self, name, entry, delay):
+        entry['attempts'] += 1
+        entry['not_before'] = time.time() + delay
+        self.write('new', name, entry)
+        os.unlink(self.path('cur', name))
+
+    def fail(self, name, entry):
+        self.write('failed', name, entry)
+        os.unlink(self.path('cur', name))
+
+    def recover(self, stale=600):
+        """Return entries left in cur/ by a crashed worker to new/."""
+        now = time.time()
+        for name in os.listdir(os.path.join(self.directory, 'cur')):
+            try:
+                if os.path.getmtime(self.path('cur', name)) < now - stale:
+                    os.rename(self.path('cur', name), self.path('new', name))
+            except OSError:
+                pass
+
+
+class Deliverer(object):
+    def __init__(self, spool, slack, batch=50, max_attempts=10, backoff=30, max_backoff=3600):
+        self.spool = spool
+        self.slack = slack
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def deliver(self, name, entry):
+        posts = entry['posts']
+        while posts:
+            url, payload = posts[0]
+            try:
+                response = self.slack.send(url, payload)
+                if response is not None:
+                    response.raise_for_status()
+            except Exception as e:
+                if entry['attempts'] + 1 >= self.max_attempts:
+                    logger.error('giving up on %s after %d attempts: %s', name, entry['attempts'] + 1, e)
+                    self.spool.fail(name, entry)
+                else:
+                    delay = min(self.backoff * 2 ** entry['attempts'], self.max_backoff)
+                    logger.warning('failed to post %s, retrying in %ds: %s', name, delay, e)
+                    self.spool.retry(name, entry, delay)
+                return False
+            # keep only what is left, so that a retry does not repeat chunks
+            posts.pop(0)
+        self.spool.done(name)
+        return True
+
+    def run_once(self):
+        """Deliver one batch, returns the number of entries handled."""
+        from . import metrics
+        try:
+            if getattr(self.slack, 'digest', None):
+                self.slack.flush_digests()
+            entries = self.spool.claim(self.batch)
+            for name, entry in entries:
+                self.deliver(name, entry)
+        finally:
+            metrics.flush()
+        return len(entries)
+
+    def run(self, interval=5, once=False):
+        from . import transport
+        self.spool.recover()
+        try:
+            while True:
+                while self.run_once():
+                    pass
+                if once:
+                    return
+                time.sleep(interval)
+        finally:
+            logger.info('http: %s', transport.stats())
+
+
+def get_arg_parser():
+    from . import get_arg_parser as get_common_arg_parser
+    parser = get_common_arg_parser(add_help=False)
+    parser.prog = 'email2slack deliver'
+    parser.add_argument('-h', '--help', action='help', help='show this help message and exit')
+    parser.add_argument('--once', action='store_true', help='drain the spool once and exit')
+    parser.add_argument(
+        '--batch', type=int, default=50,
+        help='number of spooled mails claimed at a time (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--interval', type=float, default=5,
+        help='seconds to wait when the spool is empty (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--max-attempts', type=int, default=10,
+        help='attempts before a mail is moved to failed/ (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--backoff', type=float, default=30,
+        help='first retry delay in seconds, doubled on every attempt (default: %(default)s)'
+    )
+    return parser
+
+
+def main(argv=None):
+    from .slack import Slack
+    args = get_arg_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    slack = Slack(args)
+    if not slack.spool:
+        raise Exception('spool directory is not configured, use --spool or [Spool] directory')
+    Deliverer(
+        slack.spool, slack,
+        batch=args.batch, max_attempts=args.max_attempts, backoff=args.backoff
+    ).run(interval=args.interval, once=args.once)
@@ -0,0 +1,52 @@
+"""Location of small state files shared by concurrent email2slack processes."""
+from __future__ import unicode_literals
+
+import os
+import stat
+import tempfile
+
+
+def check_private(directory):
+    """Raise OSError unless directory is a real directory only its owner, this user, can write.
+
+    The default directory has a predictable name in a shared /tmp: another
+    user could create it first and plant a config cache or sqlite state.
+    """
+    if not hasattr(os, 'getuid'):
+        return
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise OSError('refusing state directory {:s}: not a private directory of this user, '
+                      'remove it or set [State] directory'.format(directory))
+
+
+def state_directory(cfg=None):
+    """EMAIL2SLACK_STATE_DIR, [State] directory, or a per-user directory in /tmp."""
+    directory = os.environ.get('EMAIL2SLACK_STATE_DIR')
+    if not directory and cfg is not None and cfg.has_option('State', 'directory'):
+        directory = cfg.get('State', 'directory')
+    default = not directory
+    if default:
+        uid = os.getuid() if hasattr(os, 'getuid') else 0
+        directory = os.path.join(tempfile.gettempdir(), 'email2slack-{:d}'.format(uid))
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory, 0o700)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    if default:
+        check_private(directory)
+    return directory
+
+
+def state_path(cfg, name):
+    return os.path.join(state_directory(cfg), name)
+
+
+def connect(path, timeout=30):
+    """Open a sqlite database which several processes may write at once."""
+    import sqlite3
+    db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    db.execute('PRAGMA journal_mode=WAL')
+    return db
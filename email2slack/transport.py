@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+
+import threading
+
+
+class Transport(object):
+    """Pooled keep-alive HTTP session shared by every post of a process.
+
+    Counts the TCP connections actually opened and the requests sent, so that
+    connection reuse can be checked with stats().
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=10, read_timeout=30, keep_alive=True):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self.__session = None
+        self.__lock = threading.Lock()
+        self.__opened = 0
+        self.__requests = 0
+
+    def __count_connect(self):
+        with self.__lock:
+            self.__opened += 1
+
+    def __make_adapter(self):
+        import requests
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+        count = self.__count_connect
+
+        def counting(pool_cls):
+            class Connection(pool_cls.ConnectionCls):
+                def connect(self):
+                    count()
+                    return super(Connection, self).connect()
+
+            class Pool(pool_cls):
+                ConnectionCls = Connection
+            return Pool
+
+        class Adapter(requests.adapters.HTTPAdapter):
+            def init_poolmanager(self, *args, **kwargs):
+                super(Adapter, self).init_poolmanager(*args, **kwargs)
+                self.poolmanager.pool_classes_by_scheme = {
+                    'http': counting(HTTPConnectionPool),
+                    'https': counting(HTTPSConnectionPool),
+                }
+
+        return Adapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+
+    @property
+    def session(self):
+        if self.__session is None:
+            with self.__lock:
+                if self.__session is None:
+                    import requests
+                    session = requests.Session()
+                    adapter = self.__make_adapter()
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    if not self.keep_alive:
+                        session.headers['Connection'] = 'close'
+                    self.__session = session
+        return self.__session
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        session = self.session
+        with self.__lock:
+            self.__requests += 1
+        return session.post(url, **kwargs)
+
+    def stats(self):
+        with self.__lock:
+            return {
+                'requests': self.__requests,
+                'connections_opened': self.__opened,
+                'connections_reused': max(self.__requests - self.__opened, 0),
+            }
+
+    def close(self):
+        if self.__session is not None:
+            self.__session.close()
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(pool_size=10, connect_timeout=10, read_timeout=30, keep_alive=True):
+    """Return the process wide Transport for these settings."""
+    key = (pool_size, connect_timeout, read_timeout, keep_alive)
+    with _transports_lock:
+        if key not in _transports:
+            _transports[key] = Transport(*key)
+        return _transports[key]
+
+
+def stats():
+    """Counters summed over every Transport of this process."""
+    result = {'requests': 0, 'connections_opened': 0, 'connections_reused': 0}
+    with _transports_lock:
+        transports = list(_transports.values())
+    for transport in transports:
+        for k, v in transport.stats().items():
+            result[k] += v
+    return result
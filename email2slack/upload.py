@@ -0,0 +1,84 @@
+"""Posting a long body as one file through the Slack Web API.
+
+Incoming webhooks cannot carry files, so uploads use a bot token:
+files.getUploadURLExternal, a POST of the content to the URL it returns,
+then files.completeUploadExternal shares the file in the channel with the
+heading as its comment.
+"""
+from __future__ import unicode_literals
+
+import json
+import re
+import time
+
+API_URL = 'https://slack.com/api/'
+# url of the posts build() makes for an upload, there is no webhook involved
+UPLOAD = 'upload:'
+UNSAFE = re.compile(r'[^\w.-]+', re.UNICODE)
+
+
+def filename_for(subject):
+    name = UNSAFE.sub('_', subject).strip('_.')[:64]
+    return '{:s}.txt'.format(name or 'mail')
+
+
+class Uploader(object):
+    def __init__(self, transport, token, api_url=API_URL, retries=3):
+        self.transport = transport
+        self.token = token
+        self.api_url = api_url if api_url.endswith('/') else api_url + '/'
+        self.retries = retries
+        self.__channels = {}
+
+    def __request(self, url, **kwargs):
+        for attempt in range(self.retries + 1):
+            response = self.transport.post(url, **kwargs)
+            if response.status_code != 429:
+                break
+            try:
+                time.sleep(float(response.headers.get('Retry-After', 1)))
+            except ValueError:
+                time.sleep(1)
+        response.raise_for_status()
+        return response
+
+    def call(self, method, **params):
+        """Call a Web API method, returns its JSON result."""
+        response = self.__request(
+            self.api_url + method, data=params, headers={'Authorization': 'Bearer {:s}'.format(self.token)}
+        )
+        result = response.json()
+        if not result.get('ok'):
+            raise Exception('{:s} failed: {!s}'.format(method, result.get('error', 'unknown error')))
+        return result
+
+    def channel_id(self, channel):
+        """files.completeUploadExternal only takes IDs, look #names up with conversations.list."""
+        if not channel.startswith('#'):
+            return channel
+        name = channel[1:]
+        if name not in self.__channels:
+            cursor = ''
+            while True:
+                result = self.call('conversations.list', exclude_archived='true', limit=1000, cursor=cursor)
+                for c in result.get('channels', []):
+                    self.__channels[c['name']] = c['id']
+                cursor = result.get('response_metadata', {}).get('next_cursor')
+                if name in self.__channels or not cursor:
+                    break
+        if name not in self.__channels:
+            raise Exception('channel not found: {:s}'.format(channel))
+        return self.__channels[name]
+
+    def upload(self, channel, filename, content, title, comment):
+        data = content.encode('utf-8')
+        target = self.call(
+            'files.getUploadURLExternal', filename=filename, length=len(data), snippet_type='text'
+        )
+        self.__request(target['upload_url'], data=data, headers={'Content-Type': 'text/plain; charset=utf-8'})
+        return self.call(
+            'files.completeUploadExternal',
+            files=json.dumps([{'id': target['file_id'], 'title': title}]),
+            channel_id=self.channel_id(channel),
+            initial_comment=comment
+        )
@@ -37,16 +37,20 @@ setup(
     install_requires=[
         'beautifulsoup4>=4.6.0,<5',
         'requests>=2.18.2,<3',
+        'chardet',
         'html5lib==1.0.1'
     ],
     extras_require={
         'test': ['pytest'],
         'lxml': ['lxml>=4.1.1,<4.4.0'],
-        'nkf': ['nkf==0.2.0']
+        'nkf': ['nkf==0.2.0'],
+        'cchardet': ['cchardet'],
+        'charset_normalizer': ['charset_normalizer']
     },
     entry_points={
         'console_scripts': [
             'email2slack = email2slack:main',
+            'email2slack-client = email2slack.client:main',
         ],
     },
 )
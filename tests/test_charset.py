@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+
+from email2slack import charset
+
+
+class TestCharset(unittest.TestCase):
+    def setUp(self):
+        self.sampled = []
+        charset.default_detector.function = self.detect
+        self.addCleanup(charset.configure)
+
+    def detect(self, sample):
+        self.sampled.append(len(sample))
+        return {'encoding': 'utf-8'}
+
+    def test_declared_charset_skips_detection(self):
+        self.assertEqual(charset.decode('日本語'.encode('utf-8'), 'UTF-8'), '日本語')
+        self.assertEqual(charset.decode('日本語'.encode('euc-jp'), 'euc-jp'), '日本語')
+        self.assertEqual(charset.decode('日本語'.encode('shift_jis'), 'Shift_JIS'), '日本語')
+        self.assertEqual(charset.decode(b'plain ascii', None), 'plain ascii')
+        self.assertEqual(self.sampled, [])
+
+    def test_wrong_declaration_falls_back_to_detection(self):
+        self.assertEqual(charset.decode('日本語'.encode('utf-8'), 'us-ascii'), '日本語')
+        self.assertEqual(charset.decode('日本語'.encode('utf-8'), 'x-unknown'), '日本語')
+        self.assertEqual(len(self.sampled), 2)
+
+    def test_detection_sample_is_bounded(self):
+        detector = charset.Detector(sample=1024)
+        detector.function = self.detect
+        charset.decode(b'\xff' * 100000, None, detector=detector)
+        self.assertEqual(self.sampled, [1024])
+        # the default detector is left alone
+        charset.decode(b'\xff' * 100000, None)
+        self.assertEqual(self.sampled, [1024, charset.SAMPLE_SIZE])
+
+
+if __name__ == '__main__':
+    unittest.main()
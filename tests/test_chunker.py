@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from email2slack import get_arg_parser
+from email2slack.chunker import Chunker, html_escape, increment_of, limit_for
+from email2slack.slack import Slack
+
+HEADING = '*Date*: d\n*From*: F <f@example.com>\n*To*: to@example.com\n*Subject*: s\n'
+CONTINUED = 'continued: s\n'
+
+
+class TestChunker(unittest.TestCase):
+    def test_short_body_fits(self):
+        chunker = Chunker('see http://example.com & mail a@example.com\n')
+        self.assertTrue(chunker.fits(HEADING))
+        self.assertEqual(chunker.escaped, 'see http://example.com &amp; mail a@example.com\n')
+
+    def test_increment_matches_whole_body(self):
+        for body in ('a@b.c\nd@e.f 555-123-4567\nwww.example.org', '"x@y.z\nq@r.s"', '<mailto:a@b\n.c>'):
+            chunker = Chunker(body)
+            self.assertEqual(chunker.increment(), increment_of(body), body)
+
+    def test_chunks(self):
+        lines = ['line {:d} <http://example.com/{:d}> a@example.com'.format(i, i) for i in range(500)]
+        chunker = Chunker('\n'.join(lines) + '\n')
+        self.assertFalse(chunker.fits(HEADING))
+        chunks = list(chunker.chunks(HEADING, CONTINUED))
+
+        self.assertEqual([h for h, c in chunks], [HEADING] + [CONTINUED] * (len(chunks) - 1))
+        self.assertEqual(''.join(c for h, c in chunks), html_escape('\n'.join(lines) + '\n'))
+        for heading, chunk in chunks:
+            self.assertLess(len(chunk) + increment_of(chunk), limit_for(heading))
+
+    def test_overlong_line_makes_progress(self):
+        chunks = list(Chunker('x' * 5000 + '\nshort\n').chunks(HEADING, CONTINUED))
+        self.assertEqual([c for h, c in chunks], ['x' * 5000 + '\n', 'short\n'])
+
+
+class TestPlan(unittest.TestCase):
+    CONFIG = '''[Slack]
+default=https://hook
+
+[Team]
+default=default
+
+[Channel]
+default=#general
+
+[Flags]
+pretext=true
+
+[Limits]
+chunks_per_post={:d}
+'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        os.environ['EMAIL2SLACK_STATE_DIR'] = self.directory
+        self.addCleanup(os.environ.pop, 'EMAIL2SLACK_STATE_DIR')
+
+    def build(self, chunks_per_post):
+        path = os.path.join(self.directory, 'email2slack-{:d}.conf'.format(chunks_per_post))
+        with open(path, 'w') as fp:
+            fp.write(self.CONFIG.format(chunks_per_post))
+        slack = Slack(get_arg_parser().parse_args(['-f', path, '--debug']))
+        lines = ['line {:d} <http://example.com/{:d}>'.format(i, i) for i in range(1000)]
+        return slack.build({
+            'To': 'to@example.com', 'From': 'f@example.com', 'Subject': 's', 'Date': 'd', 'Message-ID': '<m>',
+            'body-plain': '\n'.join(lines) + '\n', 'body-html': '',
+        }, [('https://hook', '#a'), ('https://hook', '#b')])
+
+    def test_footer_in_last_post(self):
+        posts = self.build(1)
+        chunks = len(posts) // 2
+        self.assertGreater(chunks, 4)
+        self.assertTrue(all('attachments' not in p for u, p in posts[:-2]))
+        for u, payload in posts[-2:]:
+            self.assertEqual(payload['attachments'], [{'footer': 'Posted by email2slack. Original mail is &lt;m&gt;.'}])
+            self.assertTrue(payload['text'].startswith('continued: s\n```'))
+
+    def test_chunks_packed(self):
+        unpacked = self.build(1)
+        posts = self.build(4)
+        chunks = len(unpacked) // 2
+        self.assertEqual(len(posts), 2 * ((chunks + 3) // 4))
+        # same messages in the same order for each destination
+        for channel in ('#a', '#b'):
+            messages = []
+            for u, payload in posts:
+                if payload['channel'] == channel:
+                    messages.append(payload['text'])
+                    messages.extend(a['text'] for a in payload.get('attachments', []) if 'text' in a)
+            self.assertEqual(messages, [p['text'] for u, p in unpacked if p['channel'] == channel])
+        self.assertIn('footer', posts[-1][1]['attachments'][-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from email2slack import get_arg_parser
+from email2slack.dedup import DedupStore
+from email2slack.slack import DeliveryError, Slack
+
+CONFIG = '''[Slack]
+default=https://hook/good
+bad=https://hook/bad
+
+[Team]
+default=default
+.*=bad
+
+[Channel]
+default=#general
+
+[Flags]
+fanout=true
+
+[Rate Limit]
+enabled=false
+'''
+
+
+class Response(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError('HTTP {:d}'.format(self.status_code))
+
+
+class Transport(object):
+    def __init__(self):
+        self.posted = []
+
+    def post(self, url, json=None):
+        self.posted.append(url)
+        return Response(500 if url.endswith('/bad') else 200)
+
+
+class TestDedupStore(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'dedup.sqlite')
+
+    def test_claim_once(self):
+        store = DedupStore(self.path)
+        self.assertEqual(store.claim(['<a@x> #general', '<a@x> #random']), ['<a@x> #general', '<a@x> #random'])
+        # another process sees the same file
+        self.assertEqual(DedupStore(self.path).claim(['<a@x> #general', '<b@x> #general']), ['<b@x> #general'])
+
+    def test_ttl(self):
+        store = DedupStore(self.path, ttl=0.1)
+        self.assertEqual(store.claim(['a']), ['a'])
+        self.assertEqual(store.claim(['a']), [])
+        time.sleep(0.2)
+        self.assertEqual(store.claim(['a']), ['a'])
+
+    def test_max_entries_evicts_least_recent(self):
+        store = DedupStore(self.path, max_entries=2)
+        for key in ('a', 'b', 'c'):
+            store.claim([key])
+            time.sleep(0.01)
+        self.assertEqual(store.claim(['b', 'c']), [])
+        self.assertEqual(store.claim(['a']), ['a'])
+
+    def test_release(self):
+        store = DedupStore(self.path)
+        store.claim(['a'])
+        store.release(['a'])
+        self.assertEqual(store.claim(['a']), ['a'])
+
+    def test_concurrent_claims(self):
+        claimed = []
+
+        def worker():
+            claimed.extend(DedupStore(self.path).claim(['a', 'b']))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(claimed), ['a', 'b'])
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio fan-out requires Python 3.5+')
+class TestNotify(unittest.TestCase):
+    def test_release_failed_destinations_only(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        config = os.path.join(directory, 'email2slack.conf')
+        with io.open(config, 'w', encoding='utf-8') as fp:
+            fp.write(CONFIG)
+        os.environ['EMAIL2SLACK_STATE_DIR'] = os.path.join(directory, 'state')
+        self.addCleanup(os.environ.pop, 'EMAIL2SLACK_STATE_DIR')
+        slack = Slack(get_arg_parser().parse_args(['-f', config]))
+        slack.transport = Transport()
+        mail = {
+            'From': 'root@example.com', 'To': 'to@example.com', 'Subject': 's', 'Date': 'd',
+            'Message-ID': '<m@example.com>', 'body-plain': 'body\n', 'body-html': '',
+        }
+
+        with self.assertRaises(DeliveryError) as raised:
+            slack.notify(mail)
+        self.assertEqual(list(raised.exception.failed), [('https://hook/bad', '#general')])
+        self.assertEqual(sorted(slack.transport.posted), ['https://hook/bad', 'https://hook/good'])
+        # a retry of the MTA posts to the failed destination only
+        slack.transport.posted = []
+        with self.assertRaises(DeliveryError):
+            slack.notify(mail)
+        self.assertEqual(slack.transport.posted, ['https://hook/bad'])
+
+
+if __name__ == '__main__':
+    unittest.main()
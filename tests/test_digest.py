@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from email2slack import get_arg_parser
+from email2slack.digest import DigestStore
+from email2slack.slack import Slack
+
+CONFIG = '''[Slack]
+default=https://hooks.slack.com/services/FOO/BAR/FOOBAR
+
+[Team]
+default=default
+
+[Channel]
+default=#general
+
+[Digest Subject]
+\\[fail2ban\\]=0.5
+
+[Dedup]
+enabled=false
+'''
+
+
+def mail(subject, sender='root@example.com'):
+    return {
+        'From': sender, 'To': 'to@example.com', 'Subject': subject, 'Date': 'd', 'Message-ID': '<m@example.com>',
+        'body-plain': 'body\n', 'body-html': '',
+    }
+
+
+class TestDigest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'digest.sqlite')
+
+    def test_store(self):
+        store = DigestStore(self.path)
+        store.hold([('hook', '#a'), ('hook', '#b')], 'banned 1.2.3.4', 0)
+        store.hold([('hook', '#a')], 'banned 5.6.7.8', 0)
+        store.hold([('hook', '#a')], 'banned 1.2.3.4', 0)
+        store.hold([('hook', '#c')], 'later', 3600)
+        digests = dict(((url, channel), entries) for url, channel, _, _, entries in store.take_due())
+        self.assertEqual(digests, {
+            ('hook', '#a'): [('banned 1.2.3.4', 2), ('banned 5.6.7.8', 1)],
+            ('hook', '#b'): [('banned 1.2.3.4', 1)],
+        })
+        self.assertEqual(store.take_due(), [])
+
+    def test_restore(self):
+        store = DigestStore(self.path)
+        store.hold([('hook', '#a')], 'a', 0, count=3)
+        digest = store.take_due()[0]
+        store.restore(digest)
+        url, channel, started, _, entries = store.take_due()[0]
+        self.assertEqual((url, channel, started, entries), ('hook', '#a', digest[2], [('a', 3)]))
+
+    def test_notify(self):
+        config = os.path.join(self.directory, 'email2slack.conf')
+        with io.open(config, 'w', encoding='utf-8') as fp:
+            fp.write(CONFIG)
+        os.environ['EMAIL2SLACK_STATE_DIR'] = os.path.join(self.directory, 'state')
+        self.addCleanup(os.environ.pop, 'EMAIL2SLACK_STATE_DIR')
+        spool = os.path.join(self.directory, 'spool')
+        slack = Slack(get_arg_parser().parse_args(['-f', config, '--spool', spool]))
+
+        for i in range(5):
+            slack.notify(mail('[Fail2Ban] sshd: banned 10.0.0.{:d}'.format(i % 2)))
+        self.assertEqual(slack.spool.claim(10), [])
+        time.sleep(0.6)
+        # the window is over, the next mail posts the digest first
+        slack.notify(mail('hello'))
+        posts = [e['posts'] for _, e in sorted(slack.spool.claim(10))]
+        self.assertEqual(len(posts), 2)
+        (url, digest), = posts[0]
+        self.assertEqual(digest['channel'], '#general')
+        self.assertIn('*Digest*: 5 mails', digest['text'])
+        self.assertIn('3 x [Fail2Ban] sshd: banned 10.0.0.0\n2 x [Fail2Ban] sshd: banned 10.0.0.1\n', digest['text'])
+        self.assertIn('*Subject*: hello', posts[1][0][1]['text'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sys
+import threading
+import time
+import unittest
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio fan-out requires Python 3.5+')
+class TestFanout(unittest.TestCase):
+    def test_concurrent_and_ordered(self):
+        from email2slack import fanout
+
+        posted = []
+        lock = threading.Lock()
+
+        def post(url, payload):
+            time.sleep(0.2)
+            with lock:
+                posted.append((url, payload['channel'], payload['text']))
+
+        posts = []
+        for chunk in ('1', '2'):
+            for url, channel in (('a', '#x'), ('a', '#y'), ('b', '#x')):
+                posts.append((url, {'channel': channel, 'text': chunk}))
+
+        start = time.time()
+        fanout.deliver(posts, post)
+        elapsed = time.time() - start
+
+        self.assertLess(elapsed, 0.2 * 6 * 0.75)
+        self.assertEqual(sorted(posted), sorted((u, p['channel'], p['text']) for u, p in posts))
+        for destination in (('a', '#x'), ('a', '#y'), ('b', '#x')):
+            self.assertEqual([t for u, c, t in posted if (u, c) == destination], ['1', '2'])
+
+    def test_errors_are_returned_after_other_destinations(self):
+        from email2slack import fanout
+
+        posted = []
+
+        def post(url, payload):
+            if url == 'bad':
+                raise IOError('unreachable')
+            posted.append(url)
+
+        failed = fanout.deliver([('bad', {'channel': '#x'}), ('good', {'channel': '#x'})], post)
+        self.assertEqual(list(failed), [('bad', '#x')])
+        self.assertIsInstance(failed['bad', '#x'], IOError)
+        self.assertEqual(posted, ['good'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import random
+import re
+import unittest
+
+from email2slack.parser import FlowedDecoder, unfold_flowed
+
+
+def reference_unfold_flowed(text):
+    # the list based implementation FlowedDecoder replaced
+    lines = text.splitlines()
+    nlines = len(lines)
+    i = 0
+    while i < nlines - 1:
+        if not lines[i].endswith(' ') or lines[i] == '-- ':
+            i += 1
+            continue
+
+        quote = re.match(r'\s*(>\s*)+', lines[i])
+        if quote:
+            quote = quote.group(0)
+            if lines[i + 1].startswith(quote):
+                nquote = re.match(r'\s*(>\s*)+', lines[i + 1]).group(0)
+                if nquote != quote:
+                    i += 1
+                    continue
+                lines[i] = lines[i][:len(lines[i]) - 1] + lines[i + 1][len(quote):]
+                del (lines[i + 1])
+                nlines -= 1
+                continue
+        elif not re.match(r'\s*(>\s*)+', lines[i + 1]):
+            lines[i] = lines[i][:len(lines[i]) - 1] + lines[i + 1]
+            del (lines[i + 1])
+            nlines -= 1
+            continue
+        i += 1
+    return '\n'.join(lines)
+
+
+class TestFlowed(unittest.TestCase):
+    def test_examples(self):
+        self.assertEqual(unfold_flowed('a \nb \nc\nd'), 'abc\nd')
+        self.assertEqual(unfold_flowed('> a \n> b\n>> c \n> d\n'), '> ab\n>> c \n> d')
+        self.assertEqual(unfold_flowed('sig \n-- \nname'), 'sig--name')
+        self.assertEqual(unfold_flowed('-- \nname'), '-- \nname')
+
+    def test_delsp_no(self):
+        self.assertEqual(unfold_flowed('one \ntwo \nthree', delsp=False), 'one two three')
+        self.assertEqual(unfold_flowed('> one \n> two', delsp=False), '> one two')
+
+    def test_same_as_reference(self):
+        rnd = random.Random(3676)
+        pieces = ['a', 'b ', ' ', '>', '> ', ' > ', '-- ', '\n', '\n', '\r\n', '\r', '']
+        for _ in range(3000):
+            text = ''.join(rnd.choice(pieces) for _ in range(rnd.randint(0, 30)))
+            expected = reference_unfold_flowed(text)
+            self.assertEqual(unfold_flowed(text), expected, repr(text))
+
+            decoder = FlowedDecoder()
+            i = 0
+            while i < len(text):
+                n = rnd.randint(1, 4)
+                decoder.feed(text[i:i + n])
+                i += n
+            self.assertEqual(decoder.close(), expected, repr(text))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+
+from email2slack.htmltext import soup_text, stream_text
+
+SAMPLES = [
+    '<div dir="ltr"><span style="background-color:rgb(255,0,0)">red</span></div>',
+    '<html><head><title>t</title><style>p {}</style></head>\n<body><p>a<br>b</p><p>c</p></body></html>',
+    '<table>\n<tr><td>a</td><td>b</td></tr>\n<tr><td>c<p>d</p></td><td>e</td></tr>\n</table>after',
+    '<table><tr><td><table><tr><td>x</td><td>y</td></tr></table></td><td>z</td></tr></table>',
+    '<table><td>implied<td>row<tr><td>next</table>',
+    '<p>open<p>implicitly closed<div>block</div>tail',
+    '<td>cell outside of a table</td><tr>row</tr>',
+    '<pre>\nfirst newline dropped\n</pre>&lt;escaped&gt; &amp; <b>bold<i>nested</b>text</i>',
+    '<table>moved before<tr><td>cell</td></tr></table>',
+]
+
+
+class TestHTMLText(unittest.TestCase):
+    def test_layout(self):
+        self.assertEqual(stream_text(SAMPLES[1]), 'a\nb\nc\n')
+        self.assertEqual(stream_text(SAMPLES[2]), 'a b \n\ncd e \n\nafter')
+        self.assertEqual(stream_text(SAMPLES[4]), 'implied row \nnext \n')
+
+    def test_same_as_soup(self):
+        for html in SAMPLES:
+            self.assertEqual(stream_text(html), soup_text(html), html)
+
+    def test_deep_nesting(self):
+        html = '<table><tr><td>' * 5000 + 'x' + '</td></tr></table>' * 5000
+        self.assertEqual(stream_text(html), 'x \n')
+
+
+if __name__ == '__main__':
+    unittest.main()
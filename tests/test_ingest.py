@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import mailbox
+import os
+import shutil
+import tempfile
+import unittest
+from email.mime.text import MIMEText
+
+from email2slack import ingest
+from email2slack.spool import Spool
+
+CONFIG = '''[Slack]
+default=https://hooks.slack.com/services/FOO/BAR/FOOBAR
+
+[Team]
+default=default
+
+[Channel]
+default=#general
+'''
+
+
+def mail(i):
+    message = MIMEText('body {:d}\n'.format(i), 'plain', 'utf-8')
+    message['From'] = 'from@example.com'
+    message['To'] = 'to@example.com'
+    message['Subject'] = 'mail {:d}'.format(i)
+    message['Date'] = 'Thu, 27 Jul 2017 22:39:48 +0900'
+    message['Message-ID'] = '<{:d}@example.com>'.format(i)
+    return message.as_string().encode('ascii')
+
+
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        os.environ['EMAIL2SLACK_STATE_DIR'] = os.path.join(self.directory, 'state')
+        self.addCleanup(os.environ.pop, 'EMAIL2SLACK_STATE_DIR')
+        self.config = os.path.join(self.directory, 'email2slack.conf')
+        with io.open(self.config, 'w', encoding='utf-8') as fp:
+            fp.write(CONFIG)
+        self.spool = os.path.join(self.directory, 'spool')
+
+    def ingest(self, source, *options):
+        ingest.main(['--spool', self.spool, '-f', self.config, '--batch', '3'] + list(options) + [source])
+        spool = Spool(self.spool)
+        subjects = []
+        for name, entry in sorted(spool.claim(1000)):
+            spool.done(name)
+            subjects.extend(p['text'].split('*Subject*: ')[1].split('\n')[0] for u, p in entry['posts'] if p['text'])
+        return subjects
+
+    def test_mbox_resumes_from_checkpoint(self):
+        path = os.path.join(self.directory, 'mbox')
+        box = mailbox.mbox(path)
+        for i in range(5):
+            box.add(mail(i))
+        box.flush()
+        self.assertEqual(self.ingest(path, '--workers', '0'), ['mail {:d}'.format(i) for i in range(5)])
+
+        box.add(mail(5))
+        box.add(mail(6))
+        box.flush()
+        self.assertEqual(self.ingest(path, '--workers', '0'), ['mail 5', 'mail 6'])
+        # from the start, already posted mails are dropped as duplicates
+        self.assertEqual(self.ingest(path, '--workers', '0', '--restart'), [])
+
+    def test_maildir_on_pool_keeps_order(self):
+        path = os.path.join(self.directory, 'Maildir')
+        box = mailbox.Maildir(path)
+        for i in range(10):
+            box.add(mail(i))
+        self.assertEqual(self.ingest(path, '--workers', '2'), ['mail {:d}'.format(i) for i in range(10)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from email2slack import EmailParser, metrics
+from email2slack.metrics import Recorder
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'metrics.sqlite')
+        self.textfile = os.path.join(directory, 'email2slack.prom')
+
+    def read_textfile(self):
+        with io.open(self.textfile, encoding='utf-8') as fp:
+            return fp.read().splitlines()
+
+    def test_textfile_sums_processes(self):
+        for status in (200, 200, 429):
+            # a recorder per process, as in pipe mode
+            recorder = Recorder(self.path, self.textfile)
+            with recorder.timer('parse') as timer:
+                timer.bytes = 100
+            recorder.count('email2slack_http_responses_total', status=status)
+            recorder.flush()
+
+        lines = self.read_textfile()
+        self.assertIn('# TYPE email2slack_stage_seconds summary', lines)
+        self.assertIn('email2slack_stage_seconds_count{stage="parse"} 3', lines)
+        self.assertIn('email2slack_stage_bytes_total{stage="parse"} 300.0', lines)
+        self.assertIn('email2slack_http_responses_total{status="200"} 2.0', lines)
+        self.assertIn('email2slack_http_responses_total{status="429"} 1.0', lines)
+
+    def test_statsd(self):
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(sink.close)
+        sink.bind(('127.0.0.1', 0))
+        sink.settimeout(5)
+
+        recorder = Recorder(statsd=sink.getsockname())
+        recorder.observe('email2slack_stage_seconds', 0.25, stage='post')
+        recorder.count('email2slack_http_responses_total', status=200)
+        recorder.flush()
+        lines = sink.recv(65536).decode('utf-8').splitlines()
+        self.assertEqual(lines, ['email2slack.stage_seconds.post:250.000|ms', 'email2slack.http_responses.200:1|c'])
+
+    def test_stages(self):
+        self.addCleanup(metrics.configure)
+        metrics.configure(self.path, textfile=self.textfile)
+        path = os.path.join(os.path.dirname(__file__), 'data', 'utf8.txt')
+        with open(path, 'rb') as fp:
+            EmailParser.parse(fp)
+        metrics.flush()
+
+        lines = self.read_textfile()
+        for stage in ('read', 'parse', 'extract'):
+            self.assertIn('email2slack_stage_seconds_count{{stage="{:s}"}} 1'.format(stage), lines)
+        self.assertIn('email2slack_stage_bytes_total{{stage="read"}} {:.1f}'.format(os.path.getsize(path)), lines)
+
+    def test_keep_sink(self):
+        self.addCleanup(metrics.configure)
+        self.assertTrue(metrics.configure(self.path, textfile=self.textfile))
+        self.assertFalse(metrics.configure(self.path, textfile=self.textfile + '.new', replace=False))
+        self.assertTrue(metrics.configure(self.path, textfile=self.textfile, replace=False))
+        metrics.count('email2slack_mails_total')
+        metrics.flush()
+        self.assertFalse(os.path.exists(self.textfile + '.new'))
+        self.assertIn('email2slack_mails_total 1.0', self.read_textfile())
+
+    def test_disabled(self):
+        self.assertIs(metrics.timer('parse'), metrics.NULL_TIMER)
+
+
+if __name__ == '__main__':
+    unittest.main()
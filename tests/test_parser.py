@@ -2,11 +2,32 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import io
 import os
 import unittest
 
 from email2slack import EmailParser
 
+ATTACHMENT = b'''From: x <x>
+To: test@example.com
+Subject: attachment
+Message-ID: <x>
+Date: Fri, 28 Jul 2017 02:05:35 +0900
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="b"
+
+--b
+Content-Type: text/plain; charset=utf-8
+
+%s
+--b
+Content-Type: application/pdf
+Content-Transfer-Encoding: base64
+
+%s
+--b--
+'''
+
 
 class TestEmailParser(unittest.TestCase):
     @classmethod
@@ -106,6 +127,36 @@ class TestEmailParser(unittest.TestCase):
             'body-html': None
         })
 
+    def test_attachment_is_skipped(self):
+        mail = ATTACHMENT % (b'body', b'JVBERi0xLjQK' * 1000)
+        result = EmailParser.parse(io.BytesIO(mail))
+        self.assertEqual(result['body-plain'], 'body\n')
+        self.assertEqual(result['body-html'], None)
+
+    def test_limits(self):
+        mail = ATTACHMENT % ('あ'.encode('utf-8') * 100, b'JVBERi0xLjQK' * 1000)
+        result = EmailParser.parse(io.BytesIO(mail), max_part_bytes=20)
+        self.assertEqual(result['body-plain'], 'あ' * 6 + '\n[truncated by email2slack]\n')
+
+        result = EmailParser.parse(io.BytesIO(mail), max_total_bytes=200)
+        self.assertEqual(result['Subject'], 'attachment')
+        self.assertLess(len(result['body-plain'] or ''), 200)
+
+    def test_headers(self):
+        mail = (
+            b'Subject: FW: =?ISO-2022-JP?B?GyRCR1s/LklURz0bKEI=?=:\r\n'
+            b' =?utf-8?b?5pel5pys6Kqe?=  =?shift_jis?Q?=93=FA?=\r\n'
+            b'From: =?euc-jp?B?xvzL3A==?= <x@example.com>\r\n'
+            b'from: second@example.com\r\n'
+            b'\r\n'
+            b'body\r\n'
+        )
+        result = EmailParser.parse(io.BytesIO(mail))
+        self.assertEqual(result['Subject'], 'FW: 配信不能: 日本語日')
+        self.assertEqual(result['From'], '日本 <x@example.com>')
+        self.assertEqual(result['To'], '')
+        self.assertEqual(result['Message-ID'], '')
+
 
 if __name__ == '__main__':
     unittest.main()
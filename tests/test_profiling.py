@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from email2slack import profiling
+from email2slack.profiling import NULL_SAMPLE, Profiler
+
+
+def work():
+    return [str(i) * 10 for i in range(10000)]
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_sample_and_report(self):
+        profiler = Profiler(self.directory)
+        with profiler.sample() as sample:
+            # one mail at a time
+            self.assertIs(profiler.sample(), NULL_SAMPLE)
+            sample.tag({'Message-ID': '<a/b@example.com>', 'From': 'Ünicode <slow@example.com>'})
+            work()
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual([os.path.splitext(n)[1] for n in names][:2], ['.json', '.pstats'])
+        self.assertTrue(names[0].endswith('-a_b@example.com.json'))
+
+        out = io.StringIO()
+        profiling.report(self.directory, top=5, out=out)
+        self.assertIn('<a/b@example.com>  Ünicode <slow@example.com>', out.getvalue())
+        self.assertIn('(work)', out.getvalue())
+
+    def test_failed_start_does_not_stop_sampling(self):
+        profiler = Profiler(self.directory)
+
+        def start(sample):
+            raise ValueError('another profiler is active')
+
+        original = profiling.Sample.start
+        profiling.Sample.start = start
+        try:
+            self.assertIs(profiler.sample(), NULL_SAMPLE)
+        finally:
+            profiling.Sample.start = original
+        with profiler.sample() as sample:
+            self.assertIsNot(sample, NULL_SAMPLE)
+
+    def test_rate(self):
+        self.assertIs(Profiler(self.directory, rate=0).sample(), NULL_SAMPLE)
+
+
+if __name__ == '__main__':
+    unittest.main()
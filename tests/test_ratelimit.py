@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from email2slack.ratelimit import RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'ratelimit.sqlite')
+
+    def test_burst_then_rate(self):
+        limiter = RateLimiter(self.path, rate=0.1, burst=2)
+        waits = [limiter.reserve('hook #a') for _ in range(4)]
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertAlmostEqual(waits[2], 10, delta=0.5)
+        self.assertAlmostEqual(waits[3], 20, delta=0.5)
+        # other destinations have their own bucket
+        self.assertEqual(limiter.reserve('hook #b'), 0)
+
+    def test_shared_between_limiters(self):
+        limiters = [RateLimiter(self.path, rate=20, burst=1) for _ in range(4)]
+        start = time.time()
+        threads = [threading.Thread(target=l.acquire, args=('hook #a',)) for l in limiters]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertGreaterEqual(time.time() - start, 3 / 20.0 * 0.9)
+
+    def test_retry_after(self):
+        limiter = RateLimiter(self.path, rate=10, burst=5)
+        limiter.block('hook #a', 30)
+        self.assertAlmostEqual(limiter.reserve('hook #a'), 30, delta=0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import re
+import shutil
+import tempfile
+import time
+import unittest
+
+from email2slack import config, get_arg_parser
+from email2slack.routing import KeywordRouter, Router
+from email2slack.slack import Slack
+
+RULES = [
+    (r'.*@gmail.com', 'gmail'),
+    (r'alice@example\.com$', 'alice'),
+    (r'(\w)\1@example\.com', 'double'),
+    (r'.*@example\.com$', 'example'),
+    (r'bob@example\.com$', 'bob (shadowed)'),
+    (r'ops-.*', 'ops'),
+    (r'.*@example\.org\Z', 'org'),
+    (r'.*', 'default'),
+    (r'never', 'never'),
+]
+ADDRESSES = [
+    'alice@example.com', 'bob@example.com', 'aa@example.com', 'x@gmail.com', 'x@gmailxcom',
+    'ops-1@example.com', 'ops-1@example.net', 'a@example.org', 'a@b@example.com', 'alice@example.com.evil',
+    '', 'never',
+]
+KEYWORDS = [
+    ('critical', '#critical'),
+    ('crit', '#crit'),
+    ('warning', '#warning'),
+    ('ning', '#ning'),
+    ('ab', '#ab'),
+    ('bc', '#bc'),
+    ('障害', '#障害'),
+    ('a.b', '#dot'),
+]
+TEXTS = [
+    'CRITICAL: disk full', 'crit', 'Warning', 'warnin', 'abc', 'a.b', 'axb', 'サーバ障害', '', 'nothing\ncritical',
+]
+
+
+def linear(rules, address):
+    return [v for p, v in rules if re.match(p, address)]
+
+
+class TestRouter(unittest.TestCase):
+    def test_same_as_linear_scan(self):
+        for rules in (RULES, RULES[:-2], RULES[1:], [r for r in RULES if r[1] != 'double']):
+            router = Router(rules)
+            for address in ADDRESSES:
+                expected = linear(rules, address)
+                self.assertEqual(router.match(address), expected[0] if expected else None, (rules, address))
+                self.assertEqual(router.match_all(address), expected)
+
+    def test_index_kinds(self):
+        router = Router(RULES)
+        self.assertEqual(router.exact, {'alice@example.com': 1, 'bob@example.com': 4})
+        self.assertEqual(router.domain, {'example.com': 3, 'example.org': 6})
+        self.assertEqual(router.catch_all, 7)
+
+
+class TestKeywordRouter(unittest.TestCase):
+    def test_same_as_linear_scan(self):
+        for rules in (KEYWORDS, KEYWORDS[::-1], KEYWORDS[2:], []):
+            router = KeywordRouter(rules)
+            for text in TEXTS:
+                expected = [v for k, v in rules if k in text.lower()]
+                self.assertEqual(router.match(text), expected[0] if expected else None, (rules, text))
+                self.assertEqual(router.match_all(text), expected)
+
+
+class TestContentRoute(unittest.TestCase):
+    CONFIG = '''[Slack]
+default=https://hook/default
+ops=https://hook/ops
+
+[Team]
+default=default
+
+[Channel]
+default=#general
+
+[Subject Route]
+critical=ops #critical
+warning=#warning
+
+[Body Route]
+disk full=#disk
+'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        os.environ['EMAIL2SLACK_STATE_DIR'] = self.directory
+        self.addCleanup(os.environ.pop, 'EMAIL2SLACK_STATE_DIR')
+        path = os.path.join(self.directory, 'email2slack.conf')
+        with open(path, 'w') as fp:
+            fp.write(self.CONFIG)
+        self.slack = Slack(get_arg_parser().parse_args(['-f', path, '--debug']))
+
+    def route(self, subject, body='', html=''):
+        return self.slack.route({
+            'To': 'to@example.com', 'From': 'root@example.com', 'Subject': subject, 'body-plain': body,
+            'body-html': html,
+        })
+
+    def test_route(self):
+        self.assertEqual(self.route('[CRITICAL] Warning: disk full'), [('https://hook/ops', '#critical')])
+        self.assertEqual(self.route('WARNING disk full'), [('https://hook/default', '#warning')])
+        self.assertEqual(self.route('status', 'disk full'), [('https://hook/default', '#disk')])
+        # matched against the text, not the markup
+        self.assertEqual(self.route('status', html='<p>Disk <b>full</b></p>'), [('https://hook/default', '#disk')])
+        self.assertEqual(self.route('status', 'x' * 5000 + 'disk full'), [('https://hook/default', '#general')])
+        self.assertEqual(self.route('status'), [('https://hook/default', '#general')])
+
+    def test_fanout(self):
+        self.slack.flags['fanout'] = True
+        self.assertEqual(self.route('critical warning', 'disk full'), [
+            ('https://hook/ops', '#critical'), ('https://hook/default', '#warning'), ('https://hook/default', '#disk'),
+        ])
+
+
+class TestConfigCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        os.environ['EMAIL2SLACK_STATE_DIR'] = self.directory
+        self.addCleanup(os.environ.pop, 'EMAIL2SLACK_STATE_DIR')
+        self.path = os.path.join(self.directory, 'email2slack.conf')
+        self.args = get_arg_parser().parse_args(['-f', self.path])
+
+    def write(self, channel):
+        with open(self.path, 'w') as fp:
+            fp.write('[Slack]\ndefault=https://hook\n[Team]\ndefault=default\n[Channel]\ndefault={:s}\n'.format(channel))
+
+    def test_invalidated_by_mtime(self):
+        self.write('#first')
+        self.assertEqual(config.load(self.args).channel.match('a@b'), '#first')
+        cached = config.load(self.args)
+        self.assertEqual(cached.channel.match('a@b'), '#first')
+        self.assertEqual(cached.config.get('Slack', 'default'), 'https://hook')
+
+        self.write('#second')
+        os.utime(self.path, (time.time() + 10, time.time() + 10))
+        self.assertEqual(config.load(self.args).channel.match('a@b'), '#second')
+
+    def test_overrides_are_part_of_the_key(self):
+        self.write('#first')
+        config.load(self.args)
+        args = get_arg_parser().parse_args(['-f', self.path, '-c', '#override'])
+        self.assertEqual(config.load(args).channel.match('a@b'), '#override')
+
+
+if __name__ == '__main__':
+    unittest.main()
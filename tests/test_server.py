@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import smtplib
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from email2slack import config, get_arg_parser
+from email2slack.server import MAX_INSTANCES, Forwarder, UsageError, make_server
+
+
+class RecordingSlack(object):
+    def __init__(self, args):
+        self.args = args
+        self.mails = []
+
+    def notify(self, mail):
+        self.mails.append(mail)
+
+
+class TestServer(unittest.TestCase):
+    def start(self, address, protocol):
+        slack = {}
+
+        def factory(args):
+            slack[args.channel] = RecordingSlack(args)
+            return slack[args.channel]
+
+        forwarder = Forwarder(get_arg_parser().parse_args([]), workers=2, slack_factory=factory)
+        server = make_server(address, forwarder, protocol=protocol)
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+        self.addCleanup(forwarder.close)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, slack
+
+    def read(self, filename):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', filename)
+        with open(path, mode='rb') as fp:
+            return fp.read()
+
+    def test_lmtp(self):
+        server, slack = self.start('127.0.0.1:0', 'LMTP')
+        client = smtplib.LMTP(*server.server_address)
+        refused = client.sendmail('from@example.com', ['a@example.com', 'b@example.com'], self.read('utf8.txt'))
+        client.sendmail('from@example.com', ['a@example.com'], self.read('fail2ban.txt'))
+        client.quit()
+        self.assertEqual(refused, {})
+        self.assertEqual([m['Subject'] for m in slack[None].mails], ['日本語', '[Fail2Ban] sshd: started on xxx'])
+        self.assertEqual(slack[None].mails[0]['body-plain'], 'このメールは日本語で書かれています\n')
+
+    def test_smtp(self):
+        server, slack = self.start('127.0.0.1:0', 'SMTP')
+        client = smtplib.SMTP(*server.server_address)
+        client.sendmail('from@example.com', ['a@example.com'], self.read('ascii.txt'))
+        client.quit()
+        self.assertEqual(slack[None].mails[0]['body-plain'], 'test message\n')
+
+    def test_pipe_client(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'email2slack.sock')
+        server, slack = self.start(path, 'PIPE')
+        client = subprocess.Popen(
+            [sys.executable, '-m', 'email2slack.client', '--socket', path, '-c', "#it's"],
+            stdin=subprocess.PIPE
+        )
+        client.communicate(self.read('fail2ban.txt'))
+        self.assertEqual(client.returncode, 0)
+        self.assertEqual(slack["#it's"].mails[0]['Subject'], '[Fail2Ban] sshd: started on xxx')
+
+    def test_data_is_capped(self):
+        server, slack = self.start('127.0.0.1:0', 'LMTP')
+        server.forwarder.max_bytes = lambda args=None: 1000
+        body = b''.join(b'.line %d\r\n' % i for i in range(20000))
+        client = smtplib.LMTP(*server.server_address)
+        client.sendmail('from@example.com', ['a@example.com'], self.read('ascii.txt') + body)
+        client.quit()
+        self.assertLess(len(slack[None].mails[0]['body-plain']), 1000)
+        self.assertTrue(slack[None].mails[0]['body-plain'].startswith('test message\n.line 0\n'))
+
+    def test_socket_does_not_replace_a_file(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'aliases')
+        with open(path, 'w') as fp:
+            fp.write('root: admin\n')
+        forwarder = Forwarder(get_arg_parser().parse_args([]), workers=1, slack_factory=RecordingSlack)
+        self.addCleanup(forwarder.close)
+        self.assertRaises(Exception, make_server, path, forwarder, 'LMTP')
+        with open(path) as fp:
+            self.assertEqual(fp.read(), 'root: admin\n')
+
+    def test_pipe_usage_error(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'email2slack.sock')
+        server, slack = self.start(path, 'PIPE')
+        for line in (b"'--bogus'", b"'-h'", b"'-c"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.addCleanup(sock.close)
+            sock.settimeout(10)
+            sock.connect(path)
+            sock.sendall(line + b'\n' + self.read('ascii.txt'))
+            sock.shutdown(socket.SHUT_WR)
+            self.assertTrue(sock.makefile('rb').readline().startswith(b'ERR usage: '), line)
+        self.assertEqual(slack, {})
+        # the workers are still alive
+        server.forwarder.process(self.read('ascii.txt'))
+        self.assertEqual(len(slack[None].mails), 1)
+
+    def test_client_overrides(self):
+        forwarder = Forwarder(get_arg_parser().parse_args(['-f', '/etc/email2slack.conf']),
+                              workers=1, slack_factory=RecordingSlack)
+        self.addCleanup(forwarder.close)
+        default = forwarder.get_slack()
+        for argv in (['-f', '/tmp/conf'], ['--spool', '/tmp/spool'], ['--profile', '/tmp/profile']):
+            self.assertRaises(UsageError, forwarder.parse_args, argv)
+        channel = forwarder.get_slack(forwarder.parse_args(['-c', '#it']))
+        self.assertIsNot(channel, default)
+        self.assertEqual(channel.args.channel, '#it')
+        self.assertEqual(channel.args.config, '/etc/email2slack.conf')
+
+    def test_cache_is_bounded(self):
+        forwarder = Forwarder(get_arg_parser().parse_args([]), workers=1, slack_factory=RecordingSlack)
+        self.addCleanup(forwarder.close)
+        first = forwarder.get_slack(forwarder.parse_args(['-c', '#0']))
+        for i in range(1, MAX_INSTANCES + 1):
+            forwarder.get_slack(forwarder.parse_args(['-c', '#{:d}'.format(i)]))
+        self.assertIsNot(forwarder.get_slack(forwarder.parse_args(['-c', '#0'])), first)
+        latest = forwarder.get_slack(forwarder.parse_args(['-c', '#0']))
+        self.assertIs(forwarder.get_slack(forwarder.parse_args(['-c', '#0'])), latest)
+
+    def test_reload(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'email2slack.conf')
+        with open(path, 'w') as fp:
+            fp.write('[Flags]\n')
+        broken = []
+
+        def factory(args):
+            if broken:
+                raise ValueError('broken')
+            slack = RecordingSlack(args)
+            slack.stamp = config.get_stamp(config.candidates(args))
+            return slack
+
+        forwarder = Forwarder(get_arg_parser().parse_args(['-f', path]), workers=1, slack_factory=factory)
+        self.addCleanup(forwarder.close)
+        old = forwarder.get_slack()
+        self.assertEqual(forwarder.reload(), 0)
+
+        with open(path, 'a') as fp:
+            fp.write('pretext=true\n')
+        self.assertEqual(forwarder.reload(), 1)
+        new = forwarder.get_slack()
+        self.assertIsNot(new, old)
+
+        # a broken configuration is not used, nor loaded again until it changes
+        broken.append(True)
+        with open(path, 'a') as fp:
+            fp.write('fanout=true\n')
+        self.assertEqual(forwarder.reload(), 0)
+        self.assertIs(forwarder.get_slack(), new)
+        broken.pop()
+        self.assertEqual(forwarder.reload(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from email2slack.spool import Deliverer, Spool
+
+
+class FlakySlack(object):
+    """Fails the first `failures` posts of a payload text."""
+
+    def __init__(self, failures):
+        self.failures = dict(failures)
+        self.sent = []
+
+    def send(self, url, payload):
+        if self.failures.get(payload['text']):
+            self.failures[payload['text']] -= 1
+            raise IOError('connection refused')
+        self.sent.append((url, payload))
+
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.spool = Spool(self.directory)
+
+    def ls(self, subdir):
+        return os.listdir(os.path.join(self.directory, subdir))
+
+    def test_deliver(self):
+        self.spool.put([['https://hook', {'text': 'あ', 'channel': '#a'}], ['https://hook', {'text': 'b'}]])
+        self.spool.put([['https://hook', {'text': 'c'}]])
+        slack = FlakySlack({})
+        self.assertEqual(Deliverer(self.spool, slack).run_once(), 2)
+        self.assertEqual([p['text'] for u, p in slack.sent], ['あ', 'b', 'c'])
+        self.assertEqual(self.ls('new') + self.ls('cur') + self.ls('tmp'), [])
+
+    def test_retry_does_not_repeat_posted_chunks(self):
+        self.spool.put([['https://hook', {'text': 'a'}], ['https://hook', {'text': 'b'}]])
+        slack = FlakySlack({'b': 1})
+        deliverer = Deliverer(self.spool, slack, backoff=0)
+        deliverer.run_once()
+        self.assertEqual(len(self.ls('new')), 1)
+        deliverer.run_once()
+        self.assertEqual([p['text'] for u, p in slack.sent], ['a', 'b'])
+        self.assertEqual(self.ls('new'), [])
+
+    def test_backoff(self):
+        self.spool.put([['https://hook', {'text': 'a'}]])
+        deliverer = Deliverer(self.spool, FlakySlack({'a': 1}), backoff=3600)
+        self.assertEqual(deliverer.run_once(), 1)
+        self.assertEqual(len(self.ls('new')), 1)
+        # not due yet
+        self.assertEqual(deliverer.run_once(), 0)
+
+    def test_give_up(self):
+        self.spool.put([['https://hook', {'text': 'a'}]])
+        deliverer = Deliverer(self.spool, FlakySlack({'a': 5}), max_attempts=2, backoff=0)
+        deliverer.run_once()
+        deliverer.run_once()
+        self.assertEqual(len(self.ls('failed')), 1)
+        self.assertEqual(self.ls('new'), [])
+
+    def test_claimed_entry_is_not_stale(self):
+        name = self.spool.put([['https://hook', {'text': 'a'}]])
+        # waited in new/ longer than stale, e.g. during an outage
+        old = time.time() - 3600
+        os.utime(self.spool.path('new', name), (old, old))
+        self.assertEqual([n for n, e in self.spool.claim(10)], [name])
+        self.spool.recover(stale=600)
+        self.assertEqual(self.ls('cur'), [name])
+
+    def test_private(self):
+        umask = os.umask(0o022)
+        self.addCleanup(os.umask, umask)
+        spool = Spool(os.path.join(self.directory, 'spool'))
+        name = spool.put([['https://hook', {'text': 'a'}]])
+        for path in (spool.directory, os.path.dirname(spool.path('new', name))):
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+        self.assertEqual(os.stat(spool.path('new', name)).st_mode & 0o777, 0o600)
+
+
+if __name__ == '__main__':
+    unittest.main()
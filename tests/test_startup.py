@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# seconds; generous enough for slow CI machines, far below what importing
+# requests/bs4/chardet eagerly costs. Override with EMAIL2SLACK_IMPORT_BUDGET.
+IMPORT_BUDGET = float(os.environ.get('EMAIL2SLACK_IMPORT_BUDGET', '0.15'))
+HEAVY_MODULES = ['bs4', 'chardet', 'html5lib', 'lxml', 'requests']
+
+PROBE = '''
+import json, sys, time
+t = time.time()
+from email2slack import main
+elapsed = time.time() - t
+print(json.dumps({'elapsed': elapsed, 'loaded': [m for m in %r if m in sys.modules]}))
+''' % (HEAVY_MODULES,)
+
+CLIENT_PROBE = '''
+import json, sys, time
+t = time.time()
+from email2slack.client import main
+elapsed = time.time() - t
+print(json.dumps({'elapsed': elapsed, 'loaded': sorted(m for m in sys.modules if m.startswith('email2slack'))}))
+'''
+
+
+class TestStartup(unittest.TestCase):
+    def probe(self, probe=PROBE):
+        output = subprocess.check_output([sys.executable, '-c', probe])
+        return json.loads(output.decode('utf-8'))
+
+    def test_no_heavy_imports(self):
+        self.assertEqual(self.probe()['loaded'], [])
+
+    def test_import_budget(self):
+        # best of three, to ignore a cold disk cache
+        elapsed = min(self.probe()['elapsed'] for _ in range(3))
+        self.assertLess(elapsed, IMPORT_BUDGET)
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'the package is imported eagerly before Python 3.7')
+    def test_client(self):
+        probes = [self.probe(CLIENT_PROBE) for _ in range(3)]
+        self.assertEqual(probes[0]['loaded'], ['email2slack', 'email2slack.client'])
+        # a fraction of the budget of the whole command line
+        self.assertLess(min(p['elapsed'] for p in probes), IMPORT_BUDGET / 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from email2slack import state
+
+
+@unittest.skipUnless(hasattr(os, 'getuid'), 'no file owners')
+class TestStateDirectory(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.addCleanup(setattr, tempfile, 'tempdir', tempfile.tempdir)
+        tempfile.tempdir = self.tmp
+        saved = os.environ.pop('EMAIL2SLACK_STATE_DIR', None)
+        if saved is not None:
+            self.addCleanup(os.environ.__setitem__, 'EMAIL2SLACK_STATE_DIR', saved)
+        self.default = os.path.join(self.tmp, 'email2slack-{:d}'.format(os.getuid()))
+
+    def test_created_private(self):
+        self.assertEqual(state.state_directory(), self.default)
+        self.assertEqual(os.stat(self.default).st_mode & 0o777, 0o700)
+
+    def test_refuses_open_directory(self):
+        os.mkdir(self.default)
+        os.chmod(self.default, 0o777)
+        self.assertRaises(OSError, state.state_directory)
+
+    def test_refuses_symlink(self):
+        target = os.path.join(self.tmp, 'elsewhere')
+        os.mkdir(target, 0o700)
+        os.symlink(target, self.default)
+        self.assertRaises(OSError, state.state_directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
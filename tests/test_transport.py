@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import unittest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from email2slack.transport import Transport
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), WebhookHandler)
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{:d}/hook'.format(self.server.server_address[1])
+
+    def post(self, transport, n):
+        for i in range(n):
+            self.assertEqual(transport.post(self.url, json={'text': str(i)}).status_code, 200)
+        transport.close()
+        return transport.stats()
+
+    def test_keep_alive(self):
+        self.assertEqual(self.post(Transport(), 3), {
+            'requests': 3,
+            'connections_opened': 1,
+            'connections_reused': 2,
+        })
+
+    def test_no_keep_alive(self):
+        self.assertEqual(self.post(Transport(keep_alive=False), 3)['connections_opened'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
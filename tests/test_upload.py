@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.parse import parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from urlparse import parse_qs
+
+from email2slack import get_arg_parser
+from email2slack.compat import compat_socketserver
+from email2slack.slack import Slack
+
+CONFIG = '''[Slack]
+default={url:s}/hook
+
+[Team]
+default=default
+
+[Channel]
+default=#general
+
+[Flags]
+pretext=true
+
+[Upload]
+token=xoxb-test
+api_url={url:s}/api/
+threshold=1000
+
+[Rate Limit]
+enabled=false
+
+[Dedup]
+enabled=false
+'''
+
+
+class SlackHandler(BaseHTTPRequestHandler):
+    """Stand-in for incoming webhooks and the Web API methods used for uploads."""
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, status, result, headers=()):
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '{:d}'.format(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        server.requests.append(self.path)
+        if self.path == '/hook':
+            server.posts.append(json.loads(data.decode('utf-8')))
+            return self.reply(200, 'ok')
+        if self.path == '/upload/F1':
+            server.files.append(data.decode('utf-8'))
+            return self.reply(200, 'OK - {:d}'.format(len(data)))
+        if self.headers['Authorization'] != 'Bearer xoxb-test':
+            return self.reply(200, {'ok': False, 'error': 'invalid_auth'})
+        form = dict((k, v[0]) for k, v in parse_qs(data.decode('utf-8')).items())
+        if self.path == '/api/files.getUploadURLExternal':
+            if not server.limited:
+                server.limited = True
+                return self.reply(429, {'ok': False, 'error': 'ratelimited'}, [('Retry-After', '0')])
+            return self.reply(200, {
+                'ok': True, 'file_id': 'F1',
+                'upload_url': 'http://127.0.0.1:{:d}/upload/F1'.format(server.server_address[1]),
+            })
+        if self.path == '/api/conversations.list':
+            return self.reply(200, {
+                'ok': True, 'channels': [{'id': 'C1', 'name': 'general'}], 'response_metadata': {'next_cursor': ''}
+            })
+        if self.path == '/api/files.completeUploadExternal':
+            server.completed.append(form)
+            return self.reply(200, {'ok': True})
+        self.reply(404, {'ok': False, 'error': 'unknown_method'})
+
+    def log_message(self, *args):
+        pass
+
+
+class SlackServer(compat_socketserver.ThreadingMixIn, HTTPServer):
+    # the process wide transport keeps its connections open
+    daemon_threads = True
+
+
+class TestUpload(unittest.TestCase):
+    def setUp(self):
+        self.server = SlackServer(('127.0.0.1', 0), SlackHandler)
+        self.server.requests, self.server.posts, self.server.files, self.server.completed = [], [], [], []
+        self.server.limited = False
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        config = os.path.join(self.directory, 'email2slack.conf')
+        with io.open(config, 'w', encoding='utf-8') as fp:
+            fp.write(CONFIG.format(url='http://127.0.0.1:{:d}'.format(self.server.server_address[1])))
+        os.environ['EMAIL2SLACK_STATE_DIR'] = os.path.join(self.directory, 'state')
+        self.addCleanup(os.environ.pop, 'EMAIL2SLACK_STATE_DIR')
+        self.slack = Slack(get_arg_parser().parse_args(['-f', config]))
+
+    def mail(self, body):
+        return {
+            'From': 'cron@example.com', 'To': 'to@example.com', 'Subject': 'nightly log', 'Date': 'd',
+            'Message-ID': '<m@example.com>', 'body-plain': body, 'body-html': '',
+        }
+
+    def test_long_body_is_uploaded(self):
+        body = ''.join('line {:d} <ok>\n'.format(i) for i in range(5000))
+        self.slack.notify(self.mail(body))
+        self.assertEqual(self.server.posts, [])
+        self.assertEqual(self.server.files, [body])
+        completed, = self.server.completed
+        self.assertEqual(completed['channel_id'], 'C1')
+        self.assertEqual(json.loads(completed['files']), [{'id': 'F1', 'title': 'nightly log'}])
+        self.assertIn('*Subject*: nightly log\n', completed['initial_comment'])
+        self.assertIn('Original mail is &lt;m@example.com&gt;.', completed['initial_comment'])
+        self.assertEqual(self.server.requests, [
+            '/api/files.getUploadURLExternal', '/api/files.getUploadURLExternal', '/upload/F1',
+            '/api/conversations.list', '/api/files.completeUploadExternal',
+        ])
+
+    def test_short_body_is_posted(self):
+        self.slack.notify(self.mail('short\n'))
+        self.assertEqual(self.server.requests, ['/hook'])
+        self.assertIn('```short\n```', self.server.posts[0]['text'])
+
+
+if __name__ == '__main__':
+    unittest.main()